@@ -58,6 +58,18 @@ const options = {
     if (file.endsWith('.gz')) {
       res.set('Content-Encoding', 'gzip');
     }
+
+    if (file.endsWith('.br')) {
+      res.set('Content-Encoding', 'br');
+    }
+
+    if (file.endsWith('.zst')) {
+      res.set('Content-Encoding', 'zstd');
+    }
+
+    if (file.endsWith('.cgb')) {
+      res.set('Content-Type', 'application/octet-stream');
+    }
   },
 };
 
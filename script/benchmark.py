@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark asset validation, dev config builds and releases against a synthetic asset tree and
+in-memory storage. Runs entirely offline and reports results as JSON.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import string
+import sys
+import tempfile
+import time
+
+import derived  # pylint:disable=E0401
+import instrumentation  # pylint:disable=E0401
+import release_configs  # pylint:disable=E0401
+import release_manager  # pylint:disable=E0401
+import schema_validate  # pylint:disable=E0401
+import storage  # pylint:disable=E0401
+
+
+# Locales generated for each locale-modified property
+LOCALES = ('en', 'fr')
+
+# Matches pattern properties for locale-modified keys, such as `^name(_[a-z]+)?$`
+RE_LOCALE_PROPERTY = re.compile(r'^\^([a-z]+)\(_\[a-z\]\+\)\?\$$')
+
+# Keys generated for other pattern properties
+PATTERN_KEYS = {
+    '^[0-6]+$': ['01234', '56'],
+    'android|ios': ['android', 'ios'],
+}
+
+# Centre of generated coordinates, and the distance in degrees they are spread around it
+COORDINATE_CENTRE = {'latitude': 45.4231, 'longitude': -75.6831}
+COORDINATE_SPREAD = 0.05
+
+
+def generate_word(rng):
+    """
+    Generate a random lowercase word.
+
+    :param rng:
+        Random number generator
+    :type rng:
+        :class:random.Random
+    :rtype:
+        `str`
+    """
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10)))
+
+
+def generate_sentence(rng):
+    """
+    Generate a random sentence, including some accented characters.
+
+    :param rng:
+        Random number generator
+    :type rng:
+        :class:random.Random
+    :rtype:
+        `str`
+    """
+    words = [generate_word(rng) for _ in range(rng.randint(3, 12))]
+    if rng.random() < 0.3:
+        words.append(rng.choice(['école', 'réservé', 'bibliothèque', 'café']))
+    return ' '.join(words).capitalize()
+
+
+# Generators for values of string patterns used by the schemas
+PATTERN_VALUES = {
+    r'^[0-9]{4}-(0[1-9]|1[0-2])-([0-2][0-9]|3[01])$':
+        lambda rng: '2018-{0:02d}-{1:02d}'.format(rng.randint(1, 12), rng.randint(1, 28)),
+    r'^([012][0-9]):([0-5][0-9])$':
+        lambda rng: '{0:02d}:{1:02d}'.format(rng.randint(6, 25), rng.randint(0, 59)),
+    r'^(([012][0-9]):([0-5][0-9])|[Nn]/[Aa])$':
+        lambda rng: '{0:02d}:{1:02d}'.format(rng.randint(6, 23), rng.randint(0, 59)),
+    r'^#[0-9a-f]{6}$':
+        lambda rng: '#{0:06x}'.format(rng.randint(0, 0xffffff)),
+    r'^([a-z]+\|?)+$':
+        lambda rng: '|'.join(generate_word(rng) for _ in range(rng.randint(1, 3))),
+    r'^[0-9]+$':
+        lambda rng: str(rng.randint(1000, 9999)),
+    r'^[a-z]+$':
+        generate_word,
+    r'^[a-z0-9]+$':
+        lambda rng: generate_word(rng) if rng.random() < 0.8 else str(rng.randint(1, 999)),
+    r'^(pref|app)_[a-z_]+$':
+        lambda rng: 'pref_{0}'.format(generate_word(rng)),
+    r'^boolean|multi|text|link|custom$':
+        lambda rng: rng.choice(['boolean', 'multi', 'text', 'link', 'custom']),
+    r'^((\[((bold|italic)\|?)*\]|).+|\[linebreak\])$':
+        generate_sentence,
+}
+
+
+def resolve_schema(schema, root):
+    """
+    Resolve a schema which is a `$ref` to a base schema in `schema_validate.STORE`, or to a
+    definition in the root schema.
+
+    :param schema:
+        Schema to resolve
+    :type schema:
+        `dict`
+    :param root:
+        Root schema, for local references
+    :type root:
+        `dict`
+    :rtype:
+        `dict`, `dict`
+    """
+    while '$ref' in schema:
+        ref = schema['$ref']
+        if ref.startswith('#/'):
+            schema = root
+            for part in ref[2:].split('/'):
+                schema = schema[part]
+        else:
+            root = schema_validate.STORE[ref]
+            schema = root
+    return schema, root
+
+
+def generate_pattern_keys(pattern, rng, breadth):
+    """
+    Generate keys for the pattern properties of an object.
+
+    :param pattern:
+        Pattern of the property names
+    :type pattern:
+        `str`
+    :param rng:
+        Random number generator
+    :type rng:
+        :class:random.Random
+    :param breadth:
+        Maximum number of keys to generate for open-ended patterns
+    :type breadth:
+        `int`
+    :rtype:
+        `list` of `str`
+    """
+    locale_property = RE_LOCALE_PROPERTY.match(pattern)
+    if locale_property:
+        return ['{0}_{1}'.format(locale_property.group(1), locale) for locale in LOCALES]
+    if pattern in PATTERN_KEYS:
+        return PATTERN_KEYS[pattern]
+    return ['{0}_{1}'.format(generate_word(rng), index)
+            for index in range(rng.randint(1, breadth))]
+
+
+def generate_value(schema, root, rng, breadth, depth=0, name=None):
+    """
+    Generate a random value which is valid for a schema.
+
+    :param schema:
+        Schema of the value
+    :type schema:
+        `dict`
+    :param root:
+        Root schema, for local references
+    :type root:
+        `dict`
+    :param rng:
+        Random number generator
+    :type rng:
+        :class:random.Random
+    :param breadth:
+        Maximum number of items in arrays and open-ended objects near the root
+    :type breadth:
+        `int`
+    :param depth:
+        Depth of the value in the generated document
+    :type depth:
+        `int`
+    :param name:
+        Name of the property the value is for, if any
+    :type name:
+        `str`
+    :rtype:
+        any JSON value
+    """
+    # pylint:disable=R0911,R0912,R0913
+    schema, root = resolve_schema(schema, root)
+    if 'oneOf' in schema:
+        return generate_value(schema['oneOf'][0], root, rng, breadth, depth, name)
+    if 'enum' in schema:
+        return rng.choice(schema['enum'])
+
+    # Collections get smaller the deeper they are, so documents stay a reasonable size
+    item_breadth = max(1, breadth >> (2 * depth))
+    schema_type = schema.get('type', 'object')
+    if isinstance(schema_type, list):
+        schema_type = [x for x in schema_type if x != 'null'][0]
+
+    if schema_type == 'object':
+        value = {}
+        for key in schema.get('required', []) + sorted(schema.get('properties', {})):
+            if key in value or (key not in schema.get('required', []) and rng.random() < 0.5):
+                continue
+            value[key] = generate_value(
+                schema['properties'][key], root, rng, breadth, depth + 1, key)
+        for pattern in sorted(schema.get('patternProperties', {})):
+            for key in generate_pattern_keys(pattern, rng, item_breadth):
+                value[key] = generate_value(
+                    schema['patternProperties'][pattern], root, rng, breadth, depth + 1, key)
+        return value
+    if schema_type == 'array':
+        count = rng.randint(1, min(item_breadth, schema.get('maxItems', item_breadth)))
+        item_schema, item_root = resolve_schema(schema.get('items', {}), root)
+        if schema.get('uniqueItems') and 'enum' in item_schema:
+            return rng.sample(item_schema['enum'], min(count, len(item_schema['enum'])))
+        return [generate_value(item_schema, item_root, rng, breadth, depth + 1, name)
+                for _ in range(count)]
+    if schema_type == 'number':
+        if name in COORDINATE_CENTRE:
+            return round(COORDINATE_CENTRE[name] +
+                         rng.uniform(-COORDINATE_SPREAD, COORDINATE_SPREAD), 6)
+        return rng.randint(schema.get('minimum', 0), 100)
+    if schema_type == 'boolean':
+        return rng.random() < 0.5
+    if 'pattern' in schema:
+        value = PATTERN_VALUES[schema['pattern']](rng)
+        assert re.search(schema['pattern'], value), 'No generator for `{0}`'.format(
+            schema['pattern'])
+        return value
+    if name is not None and name.startswith('link'):
+        return 'https://www.example.com/{0}/'.format(generate_word(rng))
+    return generate_sentence(rng)
+
+
+def generate_corpus(
+        corpus_dir,
+        schema_dir,
+        json_count,
+        image_count,
+        text_count,
+        breadth=8,
+        image_size=64 * 1024,
+        seed=0):
+    """
+    Generate a synthetic asset tree with JSON assets which are valid for the schemas in
+    `schema_dir`, images and text files. The same arguments always generate the same tree.
+
+    :param corpus_dir:
+        Directory to generate assets in
+    :type corpus_dir:
+        `str`
+    :param schema_dir:
+        The base directory of schema files
+    :type schema_dir:
+        `str`
+    :param json_count:
+        Number of JSON assets to generate
+    :type json_count:
+        `int`
+    :param image_count:
+        Number of images to generate
+    :type image_count:
+        `int`
+    :param text_count:
+        Number of text files to generate
+    :type text_count:
+        `int`
+    :param breadth:
+        Maximum number of items in arrays and open-ended objects near the root of JSON assets
+    :type breadth:
+        `int`
+    :param image_size:
+        Maximum size of generated images, in bytes
+    :type image_size:
+        `int`
+    :param seed:
+        Seed for the random number generator
+    :type seed:
+        `int`
+    """
+    # pylint:disable=R0913,R0914
+    rng = random.Random(seed)
+    if not schema_validate.STORE:
+        schema_validate.load_base_schemas(schema_dir)
+    for asset_type in ('json', 'image', 'text'):
+        os.makedirs(os.path.join(corpus_dir, asset_type), exist_ok=True)
+
+    # Derived assets are built from the other assets, so they have no source to generate
+    schema_names = sorted(
+        name[:-len('.schema.json')]
+        for name in os.listdir(os.path.join(schema_dir, 'json'))
+        if 'json/{0}.json'.format(name[:-len('.schema.json')]) not in derived.DERIVED_ASSETS
+    )
+    for index in range(json_count):
+        schema_name = schema_names[index % len(schema_names)]
+        with open(os.path.join(schema_dir, 'json', '{0}.schema.json'.format(schema_name))) as file:
+            schema = json.load(file)
+
+        # Additional assets for a schema use a modifier, which is stripped to find the schema
+        copy = index // len(schema_names)
+        modifier = '' if copy == 0 else '.x{0}'.format(
+            ''.join(string.ascii_lowercase[int(digit)] for digit in str(copy)))
+        asset_name = '{0}{1}.json'.format(schema_name, modifier)
+        with open(os.path.join(corpus_dir, 'json', asset_name), 'w') as asset_file:
+            json.dump(generate_value(schema, schema, rng, breadth), asset_file,
+                      ensure_ascii=False, indent=2)
+
+    for index in range(image_count):
+        size = rng.randint(image_size // 4, image_size)
+        with open(os.path.join(corpus_dir, 'image', 'image_{0}.png'.format(index)), 'wb') as file:
+            file.write(b'\x89PNG\r\n\x1a\n')
+            file.write(bytes(rng.getrandbits(8) for _ in range(size)))
+
+    for index in range(text_count):
+        with open(os.path.join(corpus_dir, 'text', 'text_{0}.txt'.format(index)), 'w') as file:
+            file.write('\n'.join(generate_sentence(rng) for _ in range(rng.randint(10, 100))))
+
+
+def time_call(func, *args, **kwargs):
+    """
+    Call a function with its output suppressed, and return how long it took in seconds.
+
+    :param func:
+        Function to call
+    :type func:
+        `callable`
+    :rtype:
+        `float`
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        return time.perf_counter() - start
+
+
+def release(bucket, corpus_dir, output_dir, version):
+    """
+    Run a full release of the corpus to the bucket, as the release manager does.
+
+    :param bucket:
+        Bucket to release to
+    :type bucket:
+        :class:storage.Storage
+    :param corpus_dir:
+        Directory of assets to release
+    :type corpus_dir:
+        `str`
+    :param output_dir:
+        Output directory for minified assets
+    :type output_dir:
+        `str`
+    :param version:
+        Version of the config to release
+    :type version:
+        `str`
+    """
+    assets, _ = release_manager.update_changed_assets(bucket, corpus_dir, output_dir, None)
+    config_key, config_details = release_configs.build_release_config(
+        assets,
+        version,
+        {'en': '', 'fr': ''}
+    )
+    release_configs.update_changed_configs(bucket, {config_key: config_details})
+    release_configs.update_config_index(bucket, version)
+
+
+def run_benchmarks(work_dir, schema_dir, parameters):
+    """
+    Generate a corpus in a working directory and time validating it, building a dev config from
+    it, and releasing it twice to in-memory storage: once to an empty bucket and once more with no
+    changes. Returns the results.
+
+    :param work_dir:
+        Directory to generate the corpus and outputs in
+    :type work_dir:
+        `str`
+    :param schema_dir:
+        The base directory of schema files
+    :type schema_dir:
+        `str`
+    :param parameters:
+        Size of the corpus, latency of storage and number of processes
+    :type parameters:
+        `dict`
+    :rtype:
+        `dict`
+    """
+    corpus_dir = os.path.join(work_dir, 'assets', '')
+    release_dir = os.path.join(work_dir, 'assets_release', '')
+    results = {}
+
+    results['generate_corpus'] = {'seconds': time_call(
+        generate_corpus,
+        corpus_dir,
+        schema_dir,
+        parameters['json'],
+        parameters['images'],
+        parameters['text'],
+        breadth=parameters['breadth'],
+        image_size=parameters['imageSize'],
+        seed=parameters['seed']
+    )}
+    results['generate_corpus']['bytes'] = sum(
+        os.path.getsize(os.path.join(directory, name))
+        for (directory, _, names) in os.walk(corpus_dir)
+        for name in names
+    )
+
+    results['validate_all'] = {'seconds': time_call(
+        schema_validate.validate_all,
+        corpus_dir,
+        schema_dir,
+        processes=parameters['processes']
+    )}
+
+    bucket = storage.InstrumentedStorage(
+        storage.MemoryStorage('benchmark', latency=parameters['latency']))
+    for (phase, version) in (('release_cold', '1.0.0'), ('release_unchanged', '1.0.1')):
+        bucket.reset()
+        instrumentation.reset()
+        results[phase] = {
+            'seconds': time_call(release, bucket, corpus_dir, release_dir, version),
+            'phases': instrumentation.get_phases(),
+            'storage': bucket.get_stats(),
+        }
+
+    app_dirs = {
+        'android': os.path.join(work_dir, 'android'),
+        'ios': os.path.join(work_dir, 'ios'),
+    }
+    results['build_dev_config'] = {'seconds': time_call(
+        release_manager.build_dev_config,
+        release_dir,
+        os.path.join(release_dir, 'config'),
+        app_dirs,
+        'public.json',
+        {'en': '', 'fr': ''}
+    )}
+    return results
+
+
+if __name__ == '__main__':
+    PARAMETERS = {
+        'breadth': 8,
+        'images': 50,
+        'imageSize': 64 * 1024,
+        'json': 50,
+        'latency': 0.02,
+        'processes': None,
+        'seed': 0,
+        'text': 20,
+    }
+    OUTPUT_PATH = None
+    SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets_schemas')
+
+    if '-h' in sys.argv or '--help' in sys.argv:
+        print('Usage: ./benchmark.py [--json <n>] [--images <n>] [--text <n>]', end='')
+        print(' [--breadth <n>] [--image-size <bytes>] [--latency <seconds>]', end='')
+        print(' [--processes <n>] [--seed <n>]', end='')
+        print(' [--schemas <schema_dir>] [--output <results.json>]')
+        sys.exit(0)
+
+    for (option, parameter, parse) in (
+            ('--json', 'json', int),
+            ('--images', 'images', int),
+            ('--text', 'text', int),
+            ('--breadth', 'breadth', int),
+            ('--image-size', 'imageSize', int),
+            ('--latency', 'latency', float),
+            ('--processes', 'processes', int),
+            ('--seed', 'seed', int)):
+        if option in sys.argv:
+            PARAMETERS[parameter] = parse(sys.argv[sys.argv.index(option) + 1])
+    if '--schemas' in sys.argv:
+        SCHEMA_DIR = sys.argv[sys.argv.index('--schemas') + 1]
+    if '--output' in sys.argv:
+        OUTPUT_PATH = sys.argv[sys.argv.index('--output') + 1]
+
+    WORK_DIR = tempfile.mkdtemp(prefix='campus-guide-benchmark-')
+    try:
+        REPORT = {
+            'parameters': PARAMETERS,
+            'platform': {
+                'cpus': os.cpu_count(),
+                'python': platform.python_version(),
+                'system': platform.platform(),
+            },
+            'results': run_benchmarks(WORK_DIR, SCHEMA_DIR, PARAMETERS),
+            'peakRss': instrumentation.get_peak_rss(),
+            'timestamp': int(time.time()),
+        }
+    finally:
+        shutil.rmtree(WORK_DIR)
+
+    if OUTPUT_PATH is None:
+        print(json.dumps(REPORT, sort_keys=True, indent=2))
+    else:
+        with open(OUTPUT_PATH, 'w') as REPORT_FILE:
+            json.dump(REPORT, REPORT_FILE, sort_keys=True, indent=2)
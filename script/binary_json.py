@@ -0,0 +1,309 @@
+"""
+Compact binary encoding of JSON assets, with a table of the strings they repeat, so the app
+downloads and parses less than the JSON.
+
+An encoded asset starts with BINARY_MAGIC and the string table: the number of strings as a
+varint, then each string as the varint length of its UTF-8 bytes and the bytes. Strings are
+ordered by the number of times they are used, most used first, so they have the shortest
+indices. Every key of an object is in the table, and so is every string value used more than
+once. The table is followed by the value of the asset, as a tag and its content:
+
+- `0x00`, `0x01`, `0x02`: `null`, `false` and `true`
+- `0x03 <varint>`: an integer, zigzag encoded so small negative integers are short
+- `0x04 <8 bytes>`: a float, as a big-endian IEEE 754 double
+- `0x05 <index>`: a string in the string table
+- `0x06 <length> <bytes>`: a string which is not in the string table
+- `0x07 <count> <values>`: an array
+- `0x08 <count> <index> <value> ...`: an object, with the index of each key in the string table
+
+Varints are encoded by `delta.encode_varint`. Every encoded asset is decoded after it is built,
+and is only used if the result is identical to the JSON.
+"""
+
+import json
+import struct
+
+import delta  # pylint:disable=E0401
+
+
+# First bytes of an encoded asset
+BINARY_MAGIC = b'CGB\x01'
+
+# Tags of encoded values
+TAG_NULL = 0x00
+TAG_FALSE = 0x01
+TAG_TRUE = 0x02
+TAG_INTEGER = 0x03
+TAG_FLOAT = 0x04
+TAG_STRING_REF = 0x05
+TAG_STRING = 0x06
+TAG_ARRAY = 0x07
+TAG_OBJECT = 0x08
+
+# Encoding of floats
+FLOAT_STRUCT = struct.Struct('>d')
+
+
+def count_strings(value, key_counts, value_counts):
+    """
+    Count the number of times each key and string value is used in a JSON value.
+
+    :param value:
+        JSON value
+    :type value:
+        `object`
+    :param key_counts:
+        Number of times each key is used, updated with the keys in `value`
+    :type key_counts:
+        `dict`
+    :param value_counts:
+        Number of times each string value is used, updated with the strings in `value`
+    :type value_counts:
+        `dict`
+    """
+    if isinstance(value, dict):
+        for key in value:
+            key_counts[key] = key_counts.get(key, 0) + 1
+            count_strings(value[key], key_counts, value_counts)
+    elif isinstance(value, list):
+        for item in value:
+            count_strings(item, key_counts, value_counts)
+    elif isinstance(value, str):
+        value_counts[value] = value_counts.get(value, 0) + 1
+
+
+def build_string_table(value):
+    """
+    Build the string table of a JSON value: every key, and every string value used more than
+    once, most used first. Strings used as often are in order, so the table is always the same
+    for the same value.
+
+    :param value:
+        JSON value
+    :type value:
+        `object`
+    :rtype:
+        `list` of `str`
+    """
+    key_counts = {}
+    value_counts = {}
+    count_strings(value, key_counts, value_counts)
+    counts = dict(key_counts)
+    for (string, count) in value_counts.items():
+        if string in counts or count > 1:
+            counts[string] = counts.get(string, 0) + count
+    return sorted(counts, key=lambda string: (-counts[string], string))
+
+
+def encode_string(string):
+    """
+    Encode a string as the varint length of its UTF-8 bytes and the bytes.
+
+    :param string:
+        String to encode
+    :type string:
+        `str`
+    :rtype:
+        `bytes`
+    """
+    encoded = string.encode('utf-8')
+    return delta.encode_varint(len(encoded)) + encoded
+
+
+def encode_value(value, string_indices, encoded):
+    """
+    Encode a JSON value after its string table.
+
+    :param value:
+        JSON value
+    :type value:
+        `object`
+    :param string_indices:
+        Index of each string in the string table
+    :type string_indices:
+        `dict`
+    :param encoded:
+        Encoded content, which the value is appended to
+    :type encoded:
+        `bytearray`
+    """
+    # pylint:disable=R0912
+    if value is None:
+        encoded.append(TAG_NULL)
+    elif value is False:
+        encoded.append(TAG_FALSE)
+    elif value is True:
+        encoded.append(TAG_TRUE)
+    elif isinstance(value, int):
+        encoded.append(TAG_INTEGER)
+        encoded += delta.encode_varint(value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, float):
+        encoded.append(TAG_FLOAT)
+        encoded += FLOAT_STRUCT.pack(value)
+    elif isinstance(value, str):
+        if value in string_indices:
+            encoded.append(TAG_STRING_REF)
+            encoded += delta.encode_varint(string_indices[value])
+        else:
+            encoded.append(TAG_STRING)
+            encoded += encode_string(value)
+    elif isinstance(value, list):
+        encoded.append(TAG_ARRAY)
+        encoded += delta.encode_varint(len(value))
+        for item in value:
+            encode_value(item, string_indices, encoded)
+    elif isinstance(value, dict):
+        encoded.append(TAG_OBJECT)
+        encoded += delta.encode_varint(len(value))
+        for key in value:
+            encoded += delta.encode_varint(string_indices[key])
+            encode_value(value[key], string_indices, encoded)
+    else:
+        raise ValueError('Cannot encode {0}'.format(type(value).__name__))
+
+
+def encode(value):
+    """
+    Encode a JSON value with its string table.
+
+    :param value:
+        JSON value
+    :type value:
+        `object`
+    :rtype:
+        `bytes`
+    """
+    strings = build_string_table(value)
+    encoded = bytearray(BINARY_MAGIC)
+    encoded += delta.encode_varint(len(strings))
+    for string in strings:
+        encoded += encode_string(string)
+    encode_value(value, {string: index for (index, string) in enumerate(strings)}, encoded)
+    return bytes(encoded)
+
+
+def decode_string(data, position):
+    """
+    Decode a string encoded by `encode_string`. Returns the string and the position after it.
+
+    :param data:
+        Encoded data
+    :type data:
+        `bytes`
+    :param position:
+        Position of the string in `data`
+    :type position:
+        `int`
+    :rtype:
+        `str`, `int`
+    """
+    (length, position) = delta.decode_varint(data, position)
+    if position + length > len(data):
+        raise ValueError('Truncated string')
+    return data[position:position + length].decode('utf-8'), position + length
+
+
+def decode_value(data, position, strings):
+    """
+    Decode a value encoded by `encode_value`. Returns the value and the position after it.
+
+    :param data:
+        Encoded data
+    :type data:
+        `bytes`
+    :param position:
+        Position of the value in `data`
+    :type position:
+        `int`
+    :param strings:
+        String table
+    :type strings:
+        `list` of `str`
+    :rtype:
+        `object`, `int`
+    """
+    # pylint:disable=R0911,R0912
+    if position >= len(data):
+        raise ValueError('Truncated value')
+    tag = data[position]
+    position += 1
+    if tag == TAG_NULL:
+        return None, position
+    if tag == TAG_FALSE:
+        return False, position
+    if tag == TAG_TRUE:
+        return True, position
+    if tag == TAG_INTEGER:
+        (zigzag, position) = delta.decode_varint(data, position)
+        return (zigzag >> 1) ^ -(zigzag & 1), position
+    if tag == TAG_FLOAT:
+        if position + FLOAT_STRUCT.size > len(data):
+            raise ValueError('Truncated float')
+        return FLOAT_STRUCT.unpack_from(data, position)[0], position + FLOAT_STRUCT.size
+    if tag == TAG_STRING_REF:
+        (index, position) = delta.decode_varint(data, position)
+        return strings[index], position
+    if tag == TAG_STRING:
+        return decode_string(data, position)
+    if tag == TAG_ARRAY:
+        (count, position) = delta.decode_varint(data, position)
+        array = []
+        for _ in range(count):
+            (item, position) = decode_value(data, position, strings)
+            array.append(item)
+        return array, position
+    if tag == TAG_OBJECT:
+        (count, position) = delta.decode_varint(data, position)
+        obj = {}
+        for _ in range(count):
+            (index, position) = delta.decode_varint(data, position)
+            (obj[strings[index]], position) = decode_value(data, position, strings)
+        return obj, position
+    raise ValueError('Unknown tag {0}'.format(tag))
+
+
+def decode(data):
+    """
+    Decode a JSON value encoded by `encode`.
+
+    :param data:
+        Encoded data
+    :type data:
+        `bytes`
+    :rtype:
+        `object`
+    """
+    if not data.startswith(BINARY_MAGIC):
+        raise ValueError('Not a binary asset')
+    (count, position) = delta.decode_varint(data, len(BINARY_MAGIC))
+    strings = []
+    for _ in range(count):
+        (string, position) = decode_string(data, position)
+        strings.append(string)
+    (value, position) = decode_value(data, position, strings)
+    if position != len(data):
+        raise ValueError('Unexpected data after the value')
+    return value
+
+
+def build_binary(content):
+    """
+    Encode a JSON asset, and check that decoding it gives the same JSON. Returns the encoded
+    asset, or None if it cannot be encoded.
+
+    :param content:
+        JSON content of the asset
+    :type content:
+        `bytes`
+    :rtype:
+        `bytes` or None
+    """
+    try:
+        value = json.loads(content.decode('utf-8'))
+        encoded = encode(value)
+        decoded = decode(encoded)
+    except (IndexError, ValueError):
+        return None
+    if json.dumps(decoded) != json.dumps(value):
+        return None
+    return encoded
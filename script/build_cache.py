@@ -0,0 +1,247 @@
+"""
+Manifest of the assets built into an output directory by `minify`, so assets which have not
+changed since the last build are not minified and compressed again.
+
+The manifest is stored as `.build_cache.json` in the output directory:
+
+    {
+      "format": 2,
+      "settings": { "binary": true, "compress_level": 9, "encodings": ["br", "gzip", "zstd"] },
+      "files": {
+        "json/transit.json": {
+          "source": "<MD5 of the source asset>",
+          "md5": "<MD5 of the built asset>",
+          "size": <size of the built asset>,
+          "zmd5": "<MD5 of the gzipped asset>",
+          "zsize": <size of the gzipped asset>,
+          "variants": {
+            "br": { "md5": "<MD5 of the brotli asset>", "size": <size of the brotli asset> }
+          },
+          "binary": { "md5": "<MD5 of the binary asset>", "size": <size of the binary asset> }
+        }
+      }
+    }
+
+Paths in `files` are relative to the output directory and always use `/`. `zmd5` and `zsize`
+are only present for assets with a gzipped output, and `variants` lists the other compressed
+outputs of an asset by encoding. The gzipped output is only kept when it is smaller than the
+asset, and other compressed outputs only when they are smaller than both the asset and its
+gzipped output. `binary` is only present for JSON assets with a binary encoding from `binary_json`,
+which is also only kept when it is smaller than the asset. The `source` of a derived asset is a
+digest of the built assets it is derived from. JSON assets record the locales they have
+variants for in `locales`, and the `source` of each variant is the MD5 of the built asset.
+
+The output directory is cleaned and every asset is rebuilt when the manifest is missing, cannot
+be parsed, or has a different `format`. Every asset is rebuilt when `settings` differ from the
+settings of the current build. Otherwise, an asset is rebuilt when it has no entry, the MD5 of
+its source differs from `source`, or any of its outputs is missing or has a different size
+than recorded. Outputs of assets which no longer exist in the source directory are deleted.
+"""
+
+import hashlib
+import json
+import os
+
+
+# Name of the manifest in the output directory
+MANIFEST_NAME = '.build_cache.json'
+
+# Version of the manifest format. Increment when the format or the build output changes.
+MANIFEST_FORMAT = 2
+
+# Extension of the compressed output of an asset in each encoding
+COMPRESSED_EXTENSIONS = {
+    'gzip': '.gz',
+    'br': '.br',
+    'zstd': '.zst',
+}
+
+# Extension of the binary encoding of a JSON asset from `binary_json`
+BINARY_EXTENSION = '.cgb'
+
+# Size of chunks to read when hashing files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_file_md5(path):
+    """
+    Get the hex MD5 digest of a file, reading it in chunks.
+
+    :param path:
+        Location of the file
+    :type path:
+        `str`
+    :rtype:
+        `str`
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def get_relative_path(path, base_dir):
+    """
+    Get the path of a file relative to a directory, as it is recorded in the manifest.
+
+    :param path:
+        Location of the file
+    :type path:
+        `str`
+    :param base_dir:
+        Directory the path is relative to
+    :type base_dir:
+        `str`
+    :rtype:
+        `str`
+    """
+    return os.path.relpath(path, base_dir).replace(os.path.sep, '/')
+
+
+def load_manifest(output_dir):
+    """
+    Load the manifest from an output directory. Returns None if there is no manifest, or it
+    cannot be used.
+
+    :param output_dir:
+        Output directory of the build
+    :type output_dir:
+        `str`
+    :rtype:
+        `dict` or None
+    """
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get('format') != MANIFEST_FORMAT:
+        return None
+    return manifest
+
+
+def get_cached_files(output_dir, settings):
+    """
+    Get the entries of the manifest in an output directory which can be reused by a build with
+    the given settings. Returns None if the output directory must be cleaned before building.
+
+    :param output_dir:
+        Output directory of the build
+    :type output_dir:
+        `str`
+    :param settings:
+        Settings of the current build
+    :type settings:
+        `dict`
+    :rtype:
+        `dict` or None
+    """
+    manifest = load_manifest(output_dir)
+    if manifest is None:
+        return None
+    if manifest.get('settings') != settings:
+        return {}
+    return manifest.get('files', {})
+
+
+def save_manifest(output_dir, settings, files):
+    """
+    Write the manifest to an output directory.
+
+    :param output_dir:
+        Output directory of the build
+    :type output_dir:
+        `str`
+    :param settings:
+        Settings of the build
+    :type settings:
+        `dict`
+    :param files:
+        Entries for each built asset, by path relative to the output directory
+    :type files:
+        `dict`
+    """
+    manifest = {
+        'files': files,
+        'format': MANIFEST_FORMAT,
+        'settings': settings,
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, sort_keys=True, indent=2)
+
+
+def is_compressed_output(path):
+    """
+    Check if a file is the compressed output of an asset, rather than an asset.
+
+    :param path:
+        Location or name of the file
+    :type path:
+        `str`
+    :rtype:
+        `bool`
+    """
+    return path.endswith(tuple(COMPRESSED_EXTENSIONS.values()))
+
+
+def get_entry_outputs(entry, dest):
+    """
+    Get the location and size of each output of an asset recorded in the manifest.
+
+    :param entry:
+        The asset's entry in the manifest
+    :type entry:
+        `dict`
+    :param dest:
+        Location of the built asset
+    :type dest:
+        `str`
+    :rtype:
+        `list` of (`str`, `int`)
+    """
+    outputs = [(dest, entry.get('size'))]
+    if 'zsize' in entry:
+        outputs.append(('{0}.gz'.format(dest), entry['zsize']))
+    for encoding in sorted(entry.get('variants', {})):
+        outputs.append((
+            '{0}{1}'.format(dest, COMPRESSED_EXTENSIONS[encoding]),
+            entry['variants'][encoding]['size']
+        ))
+    if 'binary' in entry:
+        outputs.append(('{0}{1}'.format(dest, BINARY_EXTENSION), entry['binary']['size']))
+    return outputs
+
+
+def is_entry_current(entry, source_md5, dest, compress):
+    """
+    Check if the built outputs of an asset recorded in the manifest can be reused.
+
+    :param entry:
+        The asset's entry in the manifest, or None
+    :type entry:
+        `dict`
+    :param source_md5:
+        Hex MD5 digest of the source asset
+    :type source_md5:
+        `str`
+    :param dest:
+        Location of the built asset
+    :type dest:
+        `str`
+    :param compress:
+        True if the asset may also have compressed outputs
+    :type compress:
+        `bool`
+    :rtype:
+        `bool`
+    """
+    if entry is None or entry.get('source') != source_md5:
+        return False
+    outputs = get_entry_outputs(entry, dest)
+    if not compress and len(outputs) > 1:
+        return False
+    for (path, size) in outputs:
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            return False
+    return True
@@ -0,0 +1,141 @@
+"""
+Pack many small assets into one bundle, so a fresh install downloads them in one request.
+
+A bundle is the content of each member, one after another. Members are stored gzipped when the
+asset was compressed by `minify`, and as they are otherwise. Each member is compressed on its
+own, so any member can be read with an HTTP Range request of its bytes. The index of a bundle
+lists each member with its `name`, `offset` and `size` in the bundle, and its `encoding`,
+either `gzip` or `identity`. The index is recorded in the config alongside the bundle.
+
+Bundles are built into the `bundle` directory of the output directory, which is not scanned for
+assets.
+"""
+
+import gzip
+import os
+import shutil
+import tempfile
+
+import localize  # pylint:disable=E0401
+
+
+# Directory of bundles in the output directory, and the name of the bundle of assets
+BUNDLE_DIR = 'bundle'
+BUNDLE_NAME = 'assets.bundle'
+
+# Assets which download in at most this many bytes are bundled by default
+DEFAULT_MAX_MEMBER_SIZE = 64 * 1024
+
+
+def get_bundle_path(output_dir):
+    """
+    Get the location of the bundle of assets in an output directory.
+
+    :param output_dir:
+        Directory of minified assets
+    :type output_dir:
+        `str`
+    :rtype:
+        `str`
+    """
+    return os.path.join(output_dir, BUNDLE_DIR, BUNDLE_NAME)
+
+
+def select_members(build_files, max_member_size=DEFAULT_MAX_MEMBER_SIZE):
+    """
+    Select the assets to bundle: those which download in at most `max_member_size` bytes,
+    gzipped if they were compressed. Variants of assets for a locale are not bundled, since the
+    bundle is only listed in configs with every asset. Returns their paths relative to the
+    output directory, in order.
+
+    :param build_files:
+        Entries of the build manifest, by path relative to the output directory
+    :type build_files:
+        `dict`
+    :param max_member_size:
+        Largest asset to bundle, in bytes
+    :type max_member_size:
+        `int`
+    :rtype:
+        `list` of `str`
+    """
+    return sorted(
+        relative_path
+        for (relative_path, entry) in build_files.items()
+        if entry.get('zsize', entry['size']) <= max_member_size and
+        not localize.is_locale_variant(relative_path, build_files)
+    )
+
+
+def write_bundle(output_dir, members, bundle_path=None):
+    """
+    Write a bundle of assets from an output directory, replacing any existing bundle
+    atomically. Returns the index of the bundle.
+
+    :param output_dir:
+        Directory of minified assets
+    :type output_dir:
+        `str`
+    :param members:
+        Paths of the assets to bundle relative to `output_dir`, using `/`
+    :type members:
+        `list` of `str`
+    :param bundle_path:
+        Location to write the bundle, or None for the default location in `output_dir`
+    :type bundle_path:
+        `str`
+    :rtype:
+        `list` of `dict`
+    """
+    bundle_path = bundle_path or get_bundle_path(output_dir)
+    os.makedirs(os.path.dirname(bundle_path), exist_ok=True)
+    (handle, temp_path) = tempfile.mkstemp(dir=os.path.dirname(bundle_path))
+    index = []
+    offset = 0
+    try:
+        with os.fdopen(handle, 'wb') as bundle_file:
+            for relative_path in members:
+                path = os.path.join(output_dir, *relative_path.split('/'))
+                encoding = 'identity'
+                if os.path.exists('{0}.gz'.format(path)):
+                    path = '{0}.gz'.format(path)
+                    encoding = 'gzip'
+                with open(path, 'rb') as member_file:
+                    shutil.copyfileobj(member_file, bundle_file)
+                size = bundle_file.tell() - offset
+                index.append({
+                    'encoding': encoding,
+                    'name': '/{0}'.format(relative_path.split('/')[-1]),
+                    'offset': offset,
+                    'size': size,
+                })
+                offset += size
+        os.replace(temp_path, bundle_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return index
+
+
+def read_member(bundle_path, member):
+    """
+    Read the content of one member of a bundle, as the app would with a Range request.
+
+    :param bundle_path:
+        Location of the bundle
+    :type bundle_path:
+        `str`
+    :param member:
+        The member's entry in the index of the bundle
+    :type member:
+        `dict`
+    :rtype:
+        `bytes`
+    """
+    with open(bundle_path, 'rb') as bundle_file:
+        bundle_file.seek(member['offset'])
+        content = bundle_file.read(member['size'])
+    if member['encoding'] == 'gzip':
+        return gzip.decompress(content)
+    return content
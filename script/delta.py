@@ -0,0 +1,401 @@
+"""
+Deltas between two versions of an asset, so clients with the previous version only download what
+changed.
+
+- JSON assets are diffed into a JSON Patch (RFC 6902) of `add`, `remove` and `replace`
+  operations, with the format `json-patch`
+- Other assets are diffed into a binary delta of copy and insert instructions, with the format
+  `binary`
+
+A binary delta starts with DELTA_MAGIC and the size of the new version as a varint, followed by
+instructions until the end of the delta:
+
+- `0x01 <offset> <length>`: copy `length` bytes from `offset` in the previous version
+- `0x02 <length> <bytes>`: insert the next `length` bytes of the delta
+
+Every delta is applied to the previous version after it is built, and is only used if the
+result is identical to the new version.
+"""
+
+import copy
+import json
+
+
+# Formats of deltas
+DELTA_FORMATS = ('json-patch', 'binary')
+
+# Assets larger than this are not diffed, since both versions are held in memory
+DELTA_MAX_SIZE = 4 * 1024 * 1024
+
+# First bytes of a binary delta, and the instructions which follow
+DELTA_MAGIC = b'CGD\x01'
+OP_COPY = 0x01
+OP_INSERT = 0x02
+
+# Size of the blocks of the previous version which are matched in the new version. Shorter
+# matches are inserted instead of copied.
+BLOCK_SIZE = 32
+
+
+def escape_pointer_token(token):
+    """
+    Escape a key or index for a JSON Pointer.
+
+    :param token:
+        Key or index
+    :type token:
+        `str` or `int`
+    :rtype:
+        `str`
+    """
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+def parse_pointer(pointer):
+    """
+    Split a JSON Pointer into its unescaped tokens.
+
+    :param pointer:
+        JSON Pointer, such as `/stops/0/name`
+    :type pointer:
+        `str`
+    :rtype:
+        `list` of `str`
+    """
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise ValueError('Invalid JSON Pointer `{0}`'.format(pointer))
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def is_same_value(old, new):
+    """
+    Check if two JSON values are identical, so `true` and `1` are not considered equal.
+
+    :param old:
+        First value
+    :type old:
+        `object`
+    :param new:
+        Second value
+    :type new:
+        `object`
+    :rtype:
+        `bool`
+    """
+    return type(old) is type(new) and old == new
+
+
+def diff_json(old, new, path=''):
+    """
+    Build a JSON Patch which changes one JSON value into another. Objects are diffed by key, and
+    arrays element by element after removing their common first and last elements, so inserting
+    or removing elements of an array does not replace the rest of it.
+
+    :param old:
+        Previous value
+    :type old:
+        `object`
+    :param new:
+        New value
+    :type new:
+        `object`
+    :param path:
+        JSON Pointer to the values
+    :type path:
+        `str`
+    :rtype:
+        `list` of `dict`
+    """
+    # pylint:disable=R0912
+    if isinstance(old, dict) and isinstance(new, dict):
+        patch = []
+        for key in sorted(old):
+            if key not in new:
+                patch.append({'op': 'remove', 'path': '{0}/{1}'.format(
+                    path,
+                    escape_pointer_token(key)
+                )})
+        for key in sorted(new):
+            key_path = '{0}/{1}'.format(path, escape_pointer_token(key))
+            if key not in old:
+                patch.append({'op': 'add', 'path': key_path, 'value': new[key]})
+            else:
+                patch.extend(diff_json(old[key], new[key], key_path))
+        return patch
+
+    if isinstance(old, list) and isinstance(new, list):
+        prefix = 0
+        while prefix < min(len(old), len(new)) and is_same_value(old[prefix], new[prefix]):
+            prefix += 1
+        suffix = 0
+        while suffix < min(len(old), len(new)) - prefix and \
+                is_same_value(old[len(old) - suffix - 1], new[len(new) - suffix - 1]):
+            suffix += 1
+        old_changed = old[prefix:len(old) - suffix]
+        new_changed = new[prefix:len(new) - suffix]
+
+        patch = []
+        for index in range(min(len(old_changed), len(new_changed))):
+            patch.extend(diff_json(
+                old_changed[index],
+                new_changed[index],
+                '{0}/{1}'.format(path, prefix + index)
+            ))
+        # Elements are removed from the end, so the indices of the others do not change
+        for index in reversed(range(len(new_changed), len(old_changed))):
+            patch.append({'op': 'remove', 'path': '{0}/{1}'.format(path, prefix + index)})
+        for index in range(len(old_changed), len(new_changed)):
+            patch.append({
+                'op': 'add',
+                'path': '{0}/{1}'.format(path, prefix + index),
+                'value': new_changed[index],
+            })
+        return patch
+
+    if is_same_value(old, new):
+        return []
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+
+def apply_json_patch(document, patch):
+    """
+    Apply a JSON Patch of `add`, `remove` and `replace` operations. Returns the patched
+    document, without changing `document`.
+
+    :param document:
+        JSON value to patch
+    :type document:
+        `object`
+    :param patch:
+        Operations to apply, in order
+    :type patch:
+        `list` of `dict`
+    :rtype:
+        `object`
+    """
+    document = copy.deepcopy(document)
+    for operation in patch:
+        tokens = parse_pointer(operation['path'])
+        if not tokens:
+            if operation['op'] == 'remove':
+                raise ValueError('Cannot remove the root of a document')
+            document = copy.deepcopy(operation['value'])
+            continue
+
+        parent = document
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        token = tokens[-1]
+        if isinstance(parent, list):
+            index = len(parent) if token == '-' else int(token)
+            if operation['op'] == 'add':
+                parent.insert(index, copy.deepcopy(operation['value']))
+            elif operation['op'] == 'remove':
+                del parent[index]
+            elif operation['op'] == 'replace':
+                parent[index] = copy.deepcopy(operation['value'])
+            else:
+                raise ValueError('Unsupported operation `{0}`'.format(operation['op']))
+        else:
+            if operation['op'] in ('add', 'replace'):
+                parent[token] = copy.deepcopy(operation['value'])
+            elif operation['op'] == 'remove':
+                del parent[token]
+            else:
+                raise ValueError('Unsupported operation `{0}`'.format(operation['op']))
+    return document
+
+
+def encode_varint(value):
+    """
+    Encode a non-negative integer in 7 bit groups, least significant first.
+
+    :param value:
+        Integer to encode
+    :type value:
+        `int`
+    :rtype:
+        `bytes`
+    """
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def decode_varint(data, position):
+    """
+    Decode an integer encoded by `encode_varint`. Returns the integer and the position after it.
+
+    :param data:
+        Encoded data
+    :type data:
+        `bytes`
+    :param position:
+        Position of the integer in `data`
+    :type position:
+        `int`
+    :rtype:
+        `int`, `int`
+    """
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise ValueError('Truncated varint')
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def diff_binary(old, new):
+    """
+    Build a binary delta which changes one sequence of bytes into another. Blocks of BLOCK_SIZE
+    bytes from the previous version are found in the new version and extended as far as they
+    match, and are copied. Everything else is inserted.
+
+    :param old:
+        Previous version
+    :type old:
+        `bytes`
+    :param new:
+        New version
+    :type new:
+        `bytes`
+    :rtype:
+        `bytes`
+    """
+    blocks = {}
+    for offset in range(0, len(old) - BLOCK_SIZE + 1, BLOCK_SIZE):
+        blocks.setdefault(old[offset:offset + BLOCK_SIZE], offset)
+
+    delta = bytearray(DELTA_MAGIC)
+    delta += encode_varint(len(new))
+    insert_start = 0
+    position = 0
+    while position <= len(new) - BLOCK_SIZE:
+        offset = blocks.get(new[position:position + BLOCK_SIZE])
+        if offset is None:
+            position += 1
+            continue
+
+        # Extend the match backwards into bytes not yet copied, then forwards
+        start = position
+        while start > insert_start and offset > 0 and old[offset - 1] == new[start - 1]:
+            start -= 1
+            offset -= 1
+        end = position + BLOCK_SIZE
+        while end < len(new) and offset + end - start < len(old) and \
+                old[offset + end - start] == new[end]:
+            end += 1
+
+        if start > insert_start:
+            delta.append(OP_INSERT)
+            delta += encode_varint(start - insert_start)
+            delta += new[insert_start:start]
+        delta.append(OP_COPY)
+        delta += encode_varint(offset)
+        delta += encode_varint(end - start)
+        insert_start = position = end
+
+    if insert_start < len(new):
+        delta.append(OP_INSERT)
+        delta += encode_varint(len(new) - insert_start)
+        delta += new[insert_start:]
+    return bytes(delta)
+
+
+def apply_binary_delta(old, delta):
+    """
+    Apply a binary delta from `diff_binary` to the previous version. Returns the new version.
+
+    :param old:
+        Previous version
+    :type old:
+        `bytes`
+    :param delta:
+        Binary delta
+    :type delta:
+        `bytes`
+    :rtype:
+        `bytes`
+    """
+    if not delta.startswith(DELTA_MAGIC):
+        raise ValueError('Not a binary delta')
+    (size, position) = decode_varint(delta, len(DELTA_MAGIC))
+    new = bytearray()
+    while position < len(delta):
+        operation = delta[position]
+        if operation == OP_COPY:
+            (offset, position) = decode_varint(delta, position + 1)
+            (length, position) = decode_varint(delta, position)
+            if offset + length > len(old):
+                raise ValueError('Copy past the end of the previous version')
+            new += old[offset:offset + length]
+        elif operation == OP_INSERT:
+            (length, position) = decode_varint(delta, position + 1)
+            if position + length > len(delta):
+                raise ValueError('Truncated insert')
+            new += delta[position:position + length]
+            position += length
+        else:
+            raise ValueError('Unknown instruction {0}'.format(operation))
+    if len(new) != size:
+        raise ValueError('Delta built {0} bytes, expected {1}'.format(len(new), size))
+    return bytes(new)
+
+
+def build_delta(asset_type, old, new):
+    """
+    Build a delta from the previous version of an asset to its new version, and check that
+    applying it gives the new version. Returns the format and content of the delta, or None if
+    the versions cannot be diffed.
+
+    :param asset_type:
+        Type of the asset, such as 'json'
+    :type asset_type:
+        `str`
+    :param old:
+        Previous version
+    :type old:
+        `bytes`
+    :param new:
+        New version
+    :type new:
+        `bytes`
+    :rtype:
+        (`str`, `bytes`) or None
+    """
+    if len(old) > DELTA_MAX_SIZE or len(new) > DELTA_MAX_SIZE:
+        return None
+
+    if asset_type == 'json':
+        try:
+            old_json = json.loads(old.decode('utf-8'))
+            new_json = json.loads(new.decode('utf-8'))
+        except ValueError:
+            return None
+        patch = diff_json(old_json, new_json)
+        patched = apply_json_patch(old_json, patch)
+        if json.dumps(patched, sort_keys=True) != json.dumps(new_json, sort_keys=True):
+            return None
+        return 'json-patch', json.dumps(
+            patch,
+            ensure_ascii=False,
+            separators=(',', ':')
+        ).encode('utf-8')
+
+    delta = diff_binary(old, new)
+    if apply_binary_delta(old, delta) != new:
+        return None
+    return 'binary', delta
@@ -0,0 +1,484 @@
+"""
+Assets derived from other assets at build time, so the app can load data it would otherwise
+compute on the device.
+
+Each derived asset is built by `minify` from the built content of its sources, and is written
+to the output directory as a JSON asset of its own. Derived assets are versioned, compressed,
+released and listed in configs like any other asset, and are validated against their schema
+in `assets_schemas/json` by `schema_validate`.
+
+- `json/stop_index.json`: a grid of the transit and shuttle stops, so the stops nearest to a
+  location are found by looking up a few cells rather than scanning every stop
+- `json/shuttle_timetable.json`: the shuttle schedules with departures as sorted minutes after
+  midnight and dates as days since 1970-01-01, so the next departure is found with a binary
+  search rather than by parsing strings. The timetable is decoded and compared to the shuttle
+  schedules after it is built, and the build fails if they differ.
+- `json/search_index.json`: the names of the entities in SEARCH_INDEX_SOURCES in every locale,
+  folded to lower case without accents and split into terms. Terms are sorted, so the terms
+  starting with a prefix are found with a binary search, and each lists the entities whose
+  names contain it.
+"""
+
+import datetime
+import hashlib
+import json
+import math
+import re
+import unicodedata
+
+import delta  # pylint:disable=E0401
+
+
+# Size of the cells of the stop index, in degrees of latitude and longitude (about 550 m of
+# latitude)
+STOP_INDEX_CELL_SIZE = 0.005
+
+
+def get_stop_cell(latitude, longitude, cell_size=STOP_INDEX_CELL_SIZE):
+    """
+    Get the key of the cell of the stop index which contains a location, as its row and column
+    separated by ':'. Rows and columns are counted from latitude and longitude 0, so cells
+    south or west of them are negative.
+
+    :param latitude:
+        Latitude of the location
+    :type latitude:
+        `float`
+    :param longitude:
+        Longitude of the location
+    :type longitude:
+        `float`
+    :param cell_size:
+        Size of each cell, in degrees
+    :type cell_size:
+        `float`
+    :rtype:
+        `str`
+    """
+    return '{0}:{1}'.format(
+        int(math.floor(latitude / cell_size)),
+        int(math.floor(longitude / cell_size))
+    )
+
+
+def build_stop_index(sources, cell_size=STOP_INDEX_CELL_SIZE):
+    """
+    Build the stop index from the transit and shuttle assets. Stops are listed in order of
+    their source, ID and direction, and each cell lists the positions of its stops in that
+    list, in order. Shuttle stops are indexed once for each direction, at their location on
+    that route.
+
+    :param sources:
+        Content of the transit and shuttle assets, by path relative to the output directory,
+        or None for assets which do not exist
+    :type sources:
+        `dict`
+    :param cell_size:
+        Size of each cell, in degrees
+    :type cell_size:
+        `float`
+    :rtype:
+        `dict`
+    """
+    stops = []
+    transit = sources.get('json/transit.json') or {}
+    for (stop_id, details) in transit.get('stopDetails', {}).items():
+        stops.append({
+            'id': stop_id,
+            'latitude': details['latitude'],
+            'longitude': details['longitude'],
+            'source': 'transit',
+        })
+
+    shuttle = sources.get('json/shuttle.json') or {}
+    for stop in shuttle.get('stops', []):
+        for direction in ('incoming', 'outgoing'):
+            stops.append({
+                'direction': direction,
+                'id': stop['id'],
+                'latitude': stop[direction]['latitude'],
+                'longitude': stop[direction]['longitude'],
+                'source': 'shuttle',
+            })
+
+    stops.sort(key=lambda stop: (stop['source'], stop['id'], stop.get('direction', '')))
+    cells = {}
+    for (position, stop) in enumerate(stops):
+        cells.setdefault(
+            get_stop_cell(stop['latitude'], stop['longitude'], cell_size),
+            []
+        ).append(position)
+
+    return {
+        'cellSize': cell_size,
+        'cells': cells,
+        'stops': stops,
+    }
+
+
+# First day of the day ordinals in the shuttle timetable
+EPOCH_DATE = datetime.date(1970, 1, 1)
+
+
+def parse_minutes(time):
+    """
+    Get the number of minutes after midnight of a 24 hour time. Times past 24 hours are after
+    the following midnight.
+
+    :param time:
+        Time as `HH:MM`
+    :type time:
+        `str`
+    :rtype:
+        `int`
+    """
+    (hours, minutes) = time.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def format_minutes(minutes):
+    """
+    Get the 24 hour time of a number of minutes after midnight, the inverse of `parse_minutes`.
+
+    :param minutes:
+        Minutes after midnight
+    :type minutes:
+        `int`
+    :rtype:
+        `str`
+    """
+    return '{0:02d}:{1:02d}'.format(minutes // 60, minutes % 60)
+
+
+def parse_day(date):
+    """
+    Get the number of days from 1970-01-01 to a date.
+
+    :param date:
+        Date as `YYYY-MM-DD`
+    :type date:
+        `str`
+    :rtype:
+        `int`
+    """
+    return (datetime.datetime.strptime(date, '%Y-%m-%d').date() - EPOCH_DATE).days
+
+
+def format_day(day):
+    """
+    Get the date a number of days after 1970-01-01, the inverse of `parse_day`.
+
+    :param day:
+        Days after 1970-01-01
+    :type day:
+        `int`
+    :rtype:
+        `str`
+    """
+    return (EPOCH_DATE + datetime.timedelta(days=day)).isoformat()
+
+
+def get_shuttle_timetable_source(shuttle):
+    """
+    Get the parts of the shuttle schedules which are compiled into the shuttle timetable, with
+    departures in order, so they can be compared to a decoded timetable.
+
+    :param shuttle:
+        Content of the shuttle asset
+    :type shuttle:
+        `dict`
+    :rtype:
+        `list` of `dict`
+    """
+    return [
+        {
+            'directions': [
+                {
+                    'day_times': {
+                        days: sorted(times, key=parse_minutes)
+                        for (days, times) in direction['day_times'].items()
+                    },
+                    'id': direction['id'],
+                }
+                for direction in schedule['directions']
+            ],
+            'end_date': schedule['end_date'],
+            'excluded_dates': sorted(schedule['excluded_dates']),
+            'id': schedule.get('id'),
+            'start_date': schedule['start_date'],
+        }
+        for schedule in shuttle.get('schedules', [])
+    ]
+
+
+def decode_shuttle_timetable(timetable):
+    """
+    Decode the shuttle timetable into the form of `get_shuttle_timetable_source`.
+
+    :param timetable:
+        Shuttle timetable
+    :type timetable:
+        `dict`
+    :rtype:
+        `list` of `dict`
+    """
+    return [
+        {
+            'directions': [
+                {
+                    'day_times': {
+                        days: [format_minutes(minutes) for minutes in departures]
+                        for (days, departures) in direction['departures'].items()
+                    },
+                    'id': direction['id'],
+                }
+                for direction in schedule['directions']
+            ],
+            'end_date': format_day(schedule['endDay']),
+            'excluded_dates': [format_day(day) for day in schedule['excludedDays']],
+            'id': schedule.get('id'),
+            'start_date': format_day(schedule['startDay']),
+        }
+        for schedule in timetable['schedules']
+    ]
+
+
+def build_shuttle_timetable(sources):
+    """
+    Build the shuttle timetable from the shuttle asset. Schedules and their directions keep
+    their order, and the departures of each direction are listed by the days they apply to,
+    as sorted minutes after midnight. Raises a ValueError if the decoded timetable differs from
+    the shuttle schedules.
+
+    :param sources:
+        Content of the shuttle asset, by path relative to the output directory
+    :type sources:
+        `dict`
+    :rtype:
+        `dict`
+    """
+    shuttle = sources.get('json/shuttle.json') or {}
+    schedules = []
+    for schedule in shuttle.get('schedules', []):
+        compiled_schedule = {
+            'directions': [
+                {
+                    'departures': {
+                        days: sorted(parse_minutes(time) for time in times)
+                        for (days, times) in direction['day_times'].items()
+                    },
+                    'id': direction['id'],
+                }
+                for direction in schedule['directions']
+            ],
+            'endDay': parse_day(schedule['end_date']),
+            'excludedDays': sorted(parse_day(date) for date in schedule['excluded_dates']),
+            'startDay': parse_day(schedule['start_date']),
+        }
+        if 'id' in schedule:
+            compiled_schedule['id'] = schedule['id']
+        schedules.append(compiled_schedule)
+
+    timetable = {'schedules': schedules}
+    if decode_shuttle_timetable(timetable) != get_shuttle_timetable_source(shuttle):
+        raise ValueError('Shuttle timetable does not match the shuttle schedules')
+    return timetable
+
+
+# Assets whose named entities are indexed for search
+SEARCH_INDEX_SOURCES = (
+    'json/discover.json',
+    'json/faculties.json',
+    'json/housing.json',
+    'json/room_types.json',
+    'json/study_spots.json',
+    'json/university.json',
+    'json/useful_links.json',
+)
+
+# Keys of names in every locale, and of objects which are never searched, such as icons, whose
+# `name` is not displayed
+RE_NAME_KEY = re.compile(r'^name(_[a-z]+)?$')
+UNSEARCHED_KEYS = ('icon',)
+
+# Letters which are not decomposed into a base letter and accents
+FOLDED_LETTERS = {
+    'æ': 'ae',
+    'œ': 'oe',
+}
+
+# Characters which separate terms, after folding
+RE_TERM_SEPARATOR = re.compile(r'[^a-z0-9]+')
+
+
+def fold_text(text):
+    """
+    Fold text for search: lower case, without accents, and with ligatures such as `œ` spelled
+    out, so `Bibliothèque` and `bibliotheque` match.
+
+    :param text:
+        Text to fold
+    :type text:
+        `str`
+    :rtype:
+        `str`
+    """
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(
+        FOLDED_LETTERS.get(character, character)
+        for character in decomposed
+        if not unicodedata.combining(character)
+    )
+
+
+def get_search_terms(text):
+    """
+    Get the distinct terms of a name to index, folded by `fold_text`.
+
+    :param text:
+        Name to split
+    :type text:
+        `str`
+    :rtype:
+        `set` of `str`
+    """
+    return set(term for term in RE_TERM_SEPARATOR.split(fold_text(text)) if term)
+
+
+def find_named_entities(value, pointer=''):
+    """
+    Find the objects in a JSON value with a name in any locale. Returns a JSON Pointer to each
+    object, the object and its names, in document order. Keys are visited in sorted order.
+
+    :param value:
+        JSON value to search
+    :type value:
+        `object`
+    :param pointer:
+        JSON Pointer to the value
+    :type pointer:
+        `str`
+    :rtype:
+        `list` of (`str`, `dict`, `dict`)
+    """
+    entities = []
+    if isinstance(value, dict):
+        names = {
+            key: value[key]
+            for key in value
+            if RE_NAME_KEY.match(key) and isinstance(value[key], str)
+        }
+        if names:
+            entities.append((pointer, value, names))
+        for key in sorted(value):
+            if key not in UNSEARCHED_KEYS:
+                entities.extend(find_named_entities(value[key], '{0}/{1}'.format(
+                    pointer,
+                    delta.escape_pointer_token(key)
+                )))
+    elif isinstance(value, list):
+        for (index, item) in enumerate(value):
+            entities.extend(find_named_entities(item, '{0}/{1}'.format(pointer, index)))
+    return entities
+
+
+def build_search_index(sources):
+    """
+    Build the search index from the assets in SEARCH_INDEX_SOURCES. Entities are listed in order
+    of their asset, and in document order within it, by their asset, JSON Pointer and `id`
+    when they have one. Each term lists the positions of the entities with a name containing
+    it, in order.
+
+    :param sources:
+        Content of each asset, by path relative to the output directory, or None for assets
+        which do not exist
+    :type sources:
+        `dict`
+    :rtype:
+        `dict`
+    """
+    entities = []
+    postings = {}
+    for source in sorted(sources):
+        if sources[source] is None:
+            continue
+        for (pointer, value, names) in find_named_entities(sources[source]):
+            entity = {
+                'asset': '/{0}'.format(source.split('/')[-1]),
+                'path': pointer,
+            }
+            if isinstance(value.get('id'), str):
+                entity['id'] = value['id']
+            terms = set()
+            for name in names.values():
+                terms |= get_search_terms(name)
+            for term in terms:
+                postings.setdefault(term, []).append(len(entities))
+            entities.append(entity)
+
+    terms = sorted(postings)
+    return {
+        'entities': entities,
+        'postings': [postings[term] for term in terms],
+        'terms': terms,
+    }
+
+
+# Derived assets, by path relative to the output directory, with the paths of the assets they
+# are built from and the function which builds them
+DERIVED_ASSETS = {
+    'json/search_index.json': (SEARCH_INDEX_SOURCES, build_search_index),
+    'json/shuttle_timetable.json': (('json/shuttle.json',), build_shuttle_timetable),
+    'json/stop_index.json': (('json/shuttle.json', 'json/transit.json'), build_stop_index),
+}
+
+
+def get_sources_md5(sources, files):
+    """
+    Get a hex MD5 digest of the built content of the sources of a derived asset, which changes
+    when any of them changes. Returns None if none of the sources were built.
+
+    :param sources:
+        Paths of the sources relative to the output directory
+    :type sources:
+        `list` of `str`
+    :param files:
+        Entries of the build manifest, by path relative to the output directory
+    :type files:
+        `dict`
+    :rtype:
+        `str` or None
+    """
+    if not any(source in files for source in sources):
+        return None
+    md5 = hashlib.md5()
+    for source in sources:
+        md5.update('{0}:{1}\n'.format(
+            source,
+            files[source]['md5'] if source in files else ''
+        ).encode('utf-8'))
+    return md5.hexdigest()
+
+
+def build_derived_content(builder, sources):
+    """
+    Build the content of a derived asset from the content of its sources, as minified JSON.
+
+    :param builder:
+        Function which builds the derived asset, from `DERIVED_ASSETS`
+    :type builder:
+        `callable`
+    :param sources:
+        Content of each source, by path relative to the output directory, or None for sources
+        which do not exist
+    :type sources:
+        `dict`
+    :rtype:
+        `bytes`
+    """
+    return json.dumps(
+        builder(sources),
+        ensure_ascii=False,
+        separators=(',', ':'),
+        sort_keys=True
+    ).encode('utf-8')
@@ -0,0 +1,350 @@
+"""
+Watch a directory of assets and keep the dev assets, dev configs and app asset directories up
+to date as assets change. Only the assets which changed are minified, validated, staged and
+given new config entries.
+
+Changes are detected with inotify when `inotify_simple` is installed, and by polling the
+directory otherwise. Bursts of changes, such as an editor saving several files or switching
+branches, are debounced into one rebuild.
+"""
+
+import concurrent.futures
+import os
+import time
+
+import build_cache  # pylint:disable=E0401
+import minify  # pylint:disable=E0401
+import release_manager  # pylint:disable=E0401
+import schema_validate  # pylint:disable=E0401
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+# Seconds without further changes before rebuilding
+DEBOUNCE_SECONDS = 0.1
+
+# Seconds between scans of the directory when polling
+POLL_INTERVAL = 0.25
+
+
+def is_ignored_file(filename):
+    """
+    Check if a file should be ignored, such as hidden files and editor backups.
+
+    :param filename:
+        Name of the file
+    :type filename:
+        `str`
+    :rtype:
+        `bool`
+    """
+    return filename.startswith('.') or filename.endswith('~') or filename.endswith('.swp')
+
+
+def snapshot_dir(directory):
+    """
+    Get the size and modification time of each file in a directory and its subdirectories.
+
+    :param directory:
+        Directory to scan
+    :type directory:
+        `str`
+    :rtype:
+        `dict` of `str` to (`int`, `int`)
+    """
+    snapshot = {}
+    for (subdirectory, _, filenames) in os.walk(directory):
+        for filename in filenames:
+            if is_ignored_file(filename):
+                continue
+            path = os.path.join(subdirectory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[build_cache.get_relative_path(path, directory)] = (
+                stat.st_mtime_ns,
+                stat.st_size
+            )
+    return snapshot
+
+
+def diff_snapshots(old, new):
+    """
+    Get the files which were added, removed or changed between two snapshots.
+
+    :param old:
+        Earlier snapshot from `snapshot_dir`
+    :type old:
+        `dict`
+    :param new:
+        Later snapshot from `snapshot_dir`
+    :type new:
+        `dict`
+    :rtype:
+        `set` of `str`
+    """
+    return set(
+        path
+        for path in set(old) | set(new)
+        if old.get(path) != new.get(path)
+    )
+
+
+def add_watches(inotify, directory):
+    """
+    Watch a directory and all of its subdirectories with inotify. Directories already watched
+    are not watched twice.
+
+    :param inotify:
+        inotify instance
+    :type inotify:
+        :class:inotify_simple.INotify
+    :param directory:
+        Directory to watch
+    :type directory:
+        `str`
+    """
+    flags = inotify_simple.flags
+    mask = flags.CREATE | flags.DELETE | flags.MODIFY | flags.MOVED_FROM | flags.MOVED_TO | \
+        flags.CLOSE_WRITE
+    for (subdirectory, _, _) in os.walk(directory):
+        inotify.add_watch(subdirectory, mask)
+
+
+def wait_for_changes(directory, snapshot, inotify=None):
+    """
+    Wait until files in a directory change, and no more changes have been made for
+    DEBOUNCE_SECONDS. Returns the new snapshot of the directory and the files which changed.
+
+    :param directory:
+        Directory to watch
+    :type directory:
+        `str`
+    :param snapshot:
+        Snapshot of the directory from `snapshot_dir` when it was last rebuilt
+    :type snapshot:
+        `dict`
+    :param inotify:
+        inotify instance watching the directory, or None to poll
+    :type inotify:
+        :class:inotify_simple.INotify
+    :rtype:
+        `dict`, `set`
+    """
+    while True:
+        if inotify is not None:
+            inotify.read()
+            while inotify.read(timeout=int(DEBOUNCE_SECONDS * 1000)):
+                pass
+            add_watches(inotify, directory)
+        else:
+            time.sleep(POLL_INTERVAL)
+
+        new_snapshot = snapshot_dir(directory)
+        changed = diff_snapshots(snapshot, new_snapshot)
+        if not changed:
+            continue
+
+        # Wait for a burst of changes to finish
+        while inotify is None:
+            time.sleep(DEBOUNCE_SECONDS)
+            settled_snapshot = snapshot_dir(directory)
+            if settled_snapshot == new_snapshot:
+                break
+            changed |= diff_snapshots(new_snapshot, settled_snapshot)
+            new_snapshot = settled_snapshot
+        return new_snapshot, changed
+
+
+def validate_changed(source_dir, schema_dir, changed):
+    """
+    Validate the assets which changed against their schemas. Returns the paths of invalid
+    assets, relative to `source_dir`.
+
+    :param source_dir:
+        Directory of source assets
+    :type source_dir:
+        `str`
+    :param schema_dir:
+        The base directory of schema files
+    :type schema_dir:
+        `str`
+    :param changed:
+        Paths of assets which changed, relative to `source_dir`
+    :type changed:
+        `set`
+    :rtype:
+        `set` of `str`
+    """
+    failed = set()
+    for task in schema_validate.get_validation_tasks(source_dir, schema_dir):
+        relative_path = build_cache.get_relative_path(task[0], source_dir)
+        if relative_path not in changed or not os.path.exists(task[0]):
+            continue
+        error = schema_validate.validate_task(task, schema_dir)
+        if error is None:
+            print('  Success: {0}'.format(task[0]))
+        else:
+            failed.add(relative_path)
+            print('  Failed: `{0}`'.format(task[0]))
+            print('    {0}'.format(error))
+    return failed
+
+
+def rebuild(
+        source_dir,
+        dev_dir,
+        schema_dir,
+        dev_config_args,
+        entries,
+        changed=None,
+        executor=None,
+        invalid=None):
+    """
+    Validate the assets which changed, minify them into the dev asset directory, and update
+    the dev configs and app asset directories. Invalid assets keep their last valid build, and
+    new assets which are invalid are not built, until they are fixed.
+
+    :param source_dir:
+        Directory of source assets
+    :type source_dir:
+        `str`
+    :param dev_dir:
+        Directory of minified dev assets
+    :type dev_dir:
+        `str`
+    :param schema_dir:
+        The base directory of schema files
+    :type schema_dir:
+        `str`
+    :param dev_config_args:
+        Keyword arguments for `release_manager.build_dev_config`
+    :type dev_config_args:
+        `dict`
+    :param entries:
+        Config entries of each dev asset from the last rebuild, updated by this rebuild
+    :type entries:
+        `dict`
+    :param changed:
+        Paths of assets which changed, relative to `source_dir`, or None to rebuild all
+    :type changed:
+        `set`
+    :param executor:
+        Pool of processes to minify assets with, kept for every rebuild
+    :type executor:
+        :class:concurrent.futures.Executor
+    :param invalid:
+        Paths of assets which failed validation in earlier rebuilds, relative to `source_dir`,
+        updated by this rebuild
+    :type invalid:
+        `set`
+    """
+    # pylint:disable=R0913
+    if invalid is None:
+        invalid = set()
+    if changed is None:
+        if schema_validate.validate_all(source_dir, schema_dir) > 0:
+            print('Some assets are invalid')
+    else:
+        failed = validate_changed(source_dir, schema_dir, changed)
+        invalid -= changed
+        invalid |= failed
+        if failed:
+            print('{0} assets are invalid, keeping their last valid build'.format(len(failed)))
+            changed = changed - failed
+
+    build_manifest = build_cache.load_manifest(dev_dir)
+    previous_files = build_manifest['files'] if build_manifest else {}
+    files = minify.minify_assets(
+        source_dir,
+        dev_dir,
+        changed=changed,
+        excluded=invalid,
+        executor=executor
+    )
+    changed_outputs = None
+    if changed is not None:
+        changed_outputs = set(
+            path
+            for path in set(files) | set(previous_files)
+            if files.get(path) != previous_files.get(path)
+        )
+
+    release_manager.build_dev_config(
+        dev_dir,
+        changed=changed_outputs,
+        entries=entries,
+        **dev_config_args
+    )
+
+
+def watch(source_dir, dev_dir, schema_dir, dev_config_args):
+    """
+    Build the dev assets and configs, then rebuild them whenever assets change, until
+    interrupted. One pool of processes minifies assets for every rebuild, so rebuilds do not
+    wait for new processes to start.
+
+    :param source_dir:
+        Directory of source assets
+    :type source_dir:
+        `str`
+    :param dev_dir:
+        Directory of minified dev assets
+    :type dev_dir:
+        `str`
+    :param schema_dir:
+        The base directory of schema files
+    :type schema_dir:
+        `str`
+    :param dev_config_args:
+        Keyword arguments for `release_manager.build_dev_config`, other than the asset
+        directory
+    :type dev_config_args:
+        `dict`
+    """
+    schema_validate.load_base_schemas(schema_dir)
+    entries = {}
+    invalid = set()
+    snapshot = snapshot_dir(source_dir)
+    executor = concurrent.futures.ProcessPoolExecutor()
+    rebuild(source_dir, dev_dir, schema_dir, dev_config_args, entries, executor=executor)
+
+    inotify = None
+    if inotify_simple is not None:
+        inotify = inotify_simple.INotify()
+        add_watches(inotify, source_dir)
+    print('Watching `{0}` for changes{1}'.format(
+        source_dir,
+        '' if inotify is not None else ', polling every {0}s'.format(POLL_INTERVAL)
+    ))
+
+    try:
+        while True:
+            snapshot, changed = wait_for_changes(source_dir, snapshot, inotify)
+            start = time.perf_counter()
+            print('Changed: {0}'.format(', '.join(sorted(changed))))
+            try:
+                rebuild(
+                    source_dir,
+                    dev_dir,
+                    schema_dir,
+                    dev_config_args,
+                    entries,
+                    changed,
+                    executor,
+                    invalid
+                )
+            except (OSError, ValueError) as error:
+                print('Rebuild failed: {0}'.format(error))
+                continue
+            print('Rebuilt in {0:.3f}s'.format(time.perf_counter() - start))
+    except KeyboardInterrupt:
+        print('Stopped watching `{0}`'.format(source_dir))
+    finally:
+        if inotify is not None:
+            inotify.close()
+        executor.shutdown()
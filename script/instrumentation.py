@@ -0,0 +1,176 @@
+"""
+Instrumentation of releases: wall time spent in each phase, and peak memory. Phases are
+recorded in module state, like `schema_validate.VERBOSE`, so they can be timed without passing
+a recorder through every function.
+
+Phases may be entered from several threads at once. The seconds recorded for a phase are the
+total across all calls, so a phase entered concurrently by worker threads may record more
+seconds than the wall time of the release.
+"""
+
+import contextlib
+import cProfile
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Seconds and number of calls recorded for each phase, by name
+PHASES = {}
+PHASES_LOCK = threading.Lock()
+
+# Number of allocation sites to include in a profile report
+PROFILE_TOP_ALLOCATIONS = 25
+
+
+def reset():
+    """
+    Clear all recorded phases.
+    """
+    with PHASES_LOCK:
+        PHASES.clear()
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Record the wall time of a block of code as part of a phase.
+
+    :param name:
+        Name of the phase
+    :type name:
+        `str`
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with PHASES_LOCK:
+            recorded = PHASES.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            recorded['calls'] += 1
+            recorded['seconds'] += elapsed
+
+
+def get_phases():
+    """
+    Get a copy of the recorded phases.
+
+    :rtype:
+        `dict`
+    """
+    with PHASES_LOCK:
+        return {name: dict(recorded) for (name, recorded) in PHASES.items()}
+
+
+def get_peak_rss():
+    """
+    Get the peak resident memory of the process in bytes, or None if it is unavailable.
+
+    :rtype:
+        `int` or None
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, and in kilobytes elsewhere
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class Profiler:
+    """
+    Captures a cProfile profile and tracemalloc allocations while it is running.
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.snapshot = None
+        self.traced_peak = None
+
+    def start(self):
+        """
+        Begin profiling.
+        """
+        tracemalloc.start()
+        self.profile.enable()
+
+    def stop(self):
+        """
+        Stop profiling, keeping the allocations and peak traced memory.
+        """
+        self.profile.disable()
+        self.snapshot = tracemalloc.take_snapshot()
+        self.traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    def dump(self, path):
+        """
+        Write the cProfile stats, to be read with `pstats` or a viewer such as snakeviz.
+
+        :param path:
+            Location to write the stats
+        :type path:
+            `str`
+        """
+        self.profile.dump_stats(path)
+
+    def get_top_allocations(self, limit=PROFILE_TOP_ALLOCATIONS):
+        """
+        Get the lines which allocated the most memory still allocated when profiling stopped.
+
+        :param limit:
+            Number of lines to include
+        :type limit:
+            `int`
+        :rtype:
+            `list` of `dict`
+        """
+        if self.snapshot is None:
+            return []
+        return [
+            {
+                'count': stat.count,
+                'line': '{0}:{1}'.format(stat.traceback[0].filename, stat.traceback[0].lineno),
+                'size': stat.size,
+            }
+            for stat in self.snapshot.statistics('lineno')[:limit]
+        ]
+
+
+def build_report(total_seconds, storage_stats=None, profiler=None, **extra):
+    """
+    Build a report of the recorded phases, storage requests and peak memory.
+
+    :param total_seconds:
+        Wall time of the whole run
+    :type total_seconds:
+        `float`
+    :param storage_stats:
+        Requests, bytes and seconds for each storage operation, from
+        `storage.InstrumentedStorage`, or None
+    :type storage_stats:
+        `dict`
+    :param profiler:
+        Profiler which ran during the run, or None
+    :type profiler:
+        :class:Profiler
+    :rtype:
+        `dict`
+    """
+    report = {
+        'memory': {'peakRss': get_peak_rss()},
+        'phases': get_phases(),
+        'storage': storage_stats or {},
+        'totalSeconds': total_seconds,
+    }
+    if profiler is not None:
+        report['memory']['tracedPeak'] = profiler.traced_peak
+        report['memory']['topAllocations'] = profiler.get_top_allocations()
+    report.update(extra)
+    return report
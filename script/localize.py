@@ -0,0 +1,162 @@
+"""
+Split JSON assets into one variant for each locale, so the app only downloads its language.
+
+Localized fields are the keys with a locale suffix, such as `name_en` and `name_fr`. The variant
+of an asset for a locale keeps every field of the asset, except the fields of other locales
+which have a counterpart in the locale. A field only in another locale is kept, so the variant
+never has less content than the app shows for the locale.
+
+Variants are built by `minify` next to the asset, with the locale before the extension, such
+as `json/housing.en.json` for `json/housing.json`. Assets without localized fields have no
+variants. Configs are built once with every asset but no variants, and once for each locale
+with the variant of each asset in the locale in place of the asset, with the locale before the
+extension of the config's name.
+"""
+
+import json
+import re
+
+
+# Locales of the app
+LOCALES = ('en', 'fr')
+
+# Keys of localized fields, and names of variants for a locale
+RE_LOCALIZED_KEY = re.compile(r'^(.+)_({0})$'.format('|'.join(LOCALES)))
+RE_LOCALE_NAME = re.compile(r'^(.+)[.]({0})([.][a-z]+)$'.format('|'.join(LOCALES)))
+
+
+def get_locale_name(name, locale):
+    """
+    Get the name of the variant of an asset or config for a locale.
+
+    :param name:
+        Name or path of the asset or config, such as `json/housing.json`
+    :type name:
+        `str`
+    :param locale:
+        Locale of the variant
+    :type locale:
+        `str`
+    :rtype:
+        `str`
+    """
+    extension_position = name.rindex('.')
+    return '{0}.{1}{2}'.format(name[:extension_position], locale, name[extension_position:])
+
+
+def parse_locale_name(name):
+    """
+    Get the name of the asset or config which a variant is for, and its locale. Returns None
+    if the name does not have a locale.
+
+    :param name:
+        Name or path of the variant, such as `json/housing.en.json`
+    :type name:
+        `str`
+    :rtype:
+        (`str`, `str`) or None
+    """
+    match = RE_LOCALE_NAME.match(name)
+    if not match:
+        return None
+    return '{0}{1}'.format(match.group(1), match.group(3)), match.group(2)
+
+
+def is_locale_variant(name, names):
+    """
+    Check if an asset is the variant of another asset for a locale. Assets are only treated as
+    a variant when the asset they are for also exists, so assets which are only provided in one
+    language are kept.
+
+    :param name:
+        Name or path of the asset
+    :type name:
+        `str`
+    :param names:
+        Names or paths of every asset
+    :type names:
+        `set` of `str`
+    :rtype:
+        `bool`
+    """
+    parsed = parse_locale_name(name)
+    return parsed is not None and parsed[0] in names
+
+
+def project_locale(value, locale):
+    """
+    Get the variant of a JSON value for a locale, without the fields of other locales which
+    have a counterpart in the locale.
+
+    :param value:
+        JSON value
+    :type value:
+        `object`
+    :param locale:
+        Locale of the variant
+    :type locale:
+        `str`
+    :rtype:
+        `object`
+    """
+    if isinstance(value, list):
+        return [project_locale(item, locale) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    projected = {}
+    for key in value:
+        match = RE_LOCALIZED_KEY.match(key)
+        if match and match.group(2) != locale and \
+                '{0}_{1}'.format(match.group(1), locale) in value:
+            continue
+        projected[key] = project_locale(value[key], locale)
+    return projected
+
+
+def build_locale_content(content, locale):
+    """
+    Build the variant of a JSON asset for a locale, as minified JSON. Returns None if the asset
+    has no fields of other locales to remove.
+
+    :param content:
+        Content of the asset
+    :type content:
+        `object`
+    :param locale:
+        Locale of the variant
+    :type locale:
+        `str`
+    :rtype:
+        `bytes` or None
+    """
+    projected = project_locale(content, locale)
+    if projected == content:
+        return None
+    return json.dumps(projected, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def split_locale_files(files):
+    """
+    Split the file entries of a config into the entries for the config with every asset but no
+    variants, and for the config of each locale.
+
+    :param files:
+        File entries of the config, in order
+    :type files:
+        `list` of `dict`
+    :rtype:
+        `list` of `dict`, `dict` of `str` to `list` of `dict`
+    """
+    names = set(file['name'] for file in files)
+    variants = {
+        parse_locale_name(file['name']): file
+        for file in files
+        if is_locale_variant(file['name'], names)
+    }
+    base_files = [file for file in files if not is_locale_variant(file['name'], names)]
+    locale_files = {
+        locale: [variants.get((file['name'], locale), file) for file in base_files]
+        for locale in LOCALES
+    }
+    return base_files, locale_files
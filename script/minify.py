@@ -0,0 +1,650 @@
+#!/usr/bin/env python3
+
+"""
+Copy a directory of assets to a new directory, minify the copied assets and compress them.
+
+Assets are compressed with gzip, and with brotli and zstd when the optional `brotli` and
+`zstandard` packages are installed. Compressed outputs which are not smaller than the asset,
+such as for most images, are not kept.
+
+Assets in `derived.DERIVED_ASSETS` are then built from the built assets they are derived from,
+and JSON assets with localized fields are split into a variant for each locale by `localize`.
+With `--binary`, JSON assets are also encoded by `binary_json`, and the encoding is kept when it
+is smaller than the asset.
+"""
+
+import concurrent.futures
+import contextlib
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+import binary_json  # pylint:disable=E0401
+import build_cache  # pylint:disable=E0401
+import derived  # pylint:disable=E0401
+import localize  # pylint:disable=E0401
+from schema_validate import strip_comments  # pylint:disable=E0401
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Directories of assets which are compressed, and the extension of assets in each which are
+# also minified
+COMPRESSED_DIRS = {
+    'json': '.json',
+    'image': None,
+    'text': None,
+}
+
+# Default gzip compression level
+DEFAULT_COMPRESS_LEVEL = 9
+
+# Brotli quality and zstd level of compressed outputs
+BROTLI_QUALITY = 11
+ZSTD_LEVEL = 19
+
+
+def minify_json(content):
+    """
+    Minify JSON content, removing any comments and insignificant whitespace.
+
+    :param content:
+        JSON content to minify
+    :type content:
+        `bytes`
+    :rtype:
+        `bytes`
+    """
+    parsed = json.loads(strip_comments(content.decode('utf-8')))
+    return json.dumps(parsed, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def get_encodings():
+    """
+    Get the encodings of the compressed outputs which can be built. gzip is always available,
+    and brotli and zstd when their packages are installed.
+
+    :rtype:
+        `list` of `str`
+    """
+    encodings = ['gzip']
+    if brotli is not None:
+        encodings.append('br')
+    if zstandard is not None:
+        encodings.append('zstd')
+    return sorted(encodings)
+
+
+def open_compressed_output(stack, path, encoding, compress_level=DEFAULT_COMPRESS_LEVEL):
+    """
+    Open a compressed output of an asset, which is finished and closed by `stack`. Returns a
+    function which compresses and writes one chunk of the asset.
+
+    :param stack:
+        Stack to close the output with
+    :type stack:
+        :class:contextlib.ExitStack
+    :param path:
+        Location of the compressed output
+    :type path:
+        `str`
+    :param encoding:
+        One of `get_encodings()`
+    :type encoding:
+        `str`
+    :param compress_level:
+        gzip compression level, from 1 to 9
+    :type compress_level:
+        `int`
+    :rtype:
+        `callable`
+    """
+    output_file = stack.enter_context(open(path, 'wb'))
+    if encoding == 'gzip':
+        return stack.enter_context(gzip.GzipFile(
+            filename='',
+            mode='wb',
+            compresslevel=compress_level,
+            fileobj=output_file,
+            mtime=0
+        )).write
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        stack.callback(lambda: output_file.write(compressor.finish()))
+        return lambda chunk: output_file.write(compressor.process(chunk))
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    stack.callback(lambda: output_file.write(compressor.flush()))
+    return lambda chunk: output_file.write(compressor.compress(chunk))
+
+
+def write_outputs(chunks, dest, compress, compress_level=DEFAULT_COMPRESS_LEVEL, binary=False):
+    """
+    Write the content of an asset to its output, and to compressed outputs if requested, one
+    chunk at a time so large assets are never held in memory. A gzipped output which is not
+    smaller than the asset is removed, as is any other compressed output which is not smaller
+    than both the asset and its gzipped output, and so is the binary encoding if it is not
+    smaller than the asset. Returns the MD5 and size of each output, for the build manifest.
+
+    :param chunks:
+        Content of the asset
+    :type chunks:
+        iterable of `bytes`
+    :param dest:
+        Location to write the asset
+    :type dest:
+        `str`
+    :param compress:
+        True to also write compressed copies of the asset to `dest` + '.gz', '.br' and '.zst'
+    :type compress:
+        `bool`
+    :param compress_level:
+        gzip compression level, from 1 to 9
+    :type compress_level:
+        `int`
+    :param binary:
+        True to also write the binary encoding of the asset as JSON to `dest` + '.cgb'. The
+        content is then held in memory, so `chunks` must be a list.
+    :type binary:
+        `bool`
+    :rtype:
+        `dict`
+    """
+    # pylint:disable=R0914
+    binary_content = binary_json.build_binary(b''.join(chunks)) if binary else None
+    md5 = hashlib.md5()
+    size = 0
+    encodings = get_encodings() if compress else []
+    with contextlib.ExitStack() as stack:
+        dest_file = stack.enter_context(open(dest, 'wb'))
+        compressed_writers = [
+            open_compressed_output(
+                stack,
+                '{0}{1}'.format(dest, build_cache.COMPRESSED_EXTENSIONS[encoding]),
+                encoding,
+                compress_level
+            )
+            for encoding in encodings
+        ]
+        for chunk in chunks:
+            md5.update(chunk)
+            size += len(chunk)
+            dest_file.write(chunk)
+            for write_compressed in compressed_writers:
+                write_compressed(chunk)
+
+    entry = {
+        'md5': md5.hexdigest(),
+        'size': size,
+    }
+    # gzip is checked first, since other encodings are only kept if they are smaller than it
+    for encoding in sorted(
+            build_cache.COMPRESSED_EXTENSIONS,
+            key=lambda name: (name != 'gzip', name)):
+        compressed_dest = '{0}{1}'.format(dest, build_cache.COMPRESSED_EXTENSIONS[encoding])
+        max_size = size if encoding == 'gzip' else entry.get('zsize', size)
+        if encoding not in encodings or os.path.getsize(compressed_dest) >= max_size:
+            if os.path.exists(compressed_dest):
+                os.remove(compressed_dest)
+            continue
+        compressed_md5 = build_cache.get_file_md5(compressed_dest)
+        compressed_size = os.path.getsize(compressed_dest)
+        if encoding == 'gzip':
+            entry['zmd5'] = compressed_md5
+            entry['zsize'] = compressed_size
+        else:
+            entry.setdefault('variants', {})[encoding] = {
+                'md5': compressed_md5,
+                'size': compressed_size,
+            }
+
+    binary_dest = '{0}{1}'.format(dest, build_cache.BINARY_EXTENSION)
+    if binary_content is not None and len(binary_content) < size:
+        with open(binary_dest, 'wb') as binary_file:
+            binary_file.write(binary_content)
+        entry['binary'] = {
+            'md5': hashlib.md5(binary_content).hexdigest(),
+            'size': len(binary_content),
+        }
+    elif os.path.exists(binary_dest):
+        os.remove(binary_dest)
+    return entry
+
+
+def minify_asset(
+        source,
+        dest,
+        minify,
+        compress,
+        compress_level=DEFAULT_COMPRESS_LEVEL,
+        cached_entry=None,
+        binary=False):
+    """
+    Copy an asset, minifying and compressing it if requested, unless its outputs from a
+    previous build can be reused. Returns the asset's entry for the build manifest and whether
+    it was rebuilt. Runs in a worker process.
+
+    :param source:
+        Location of the asset
+    :type source:
+        `str`
+    :param dest:
+        Location to write the copied asset
+    :type dest:
+        `str`
+    :param minify:
+        True to minify the asset as JSON
+    :type minify:
+        `bool`
+    :param compress:
+        True to also write compressed copies of the asset
+    :type compress:
+        `bool`
+    :param compress_level:
+        gzip compression level, from 1 to 9
+    :type compress_level:
+        `int`
+    :param cached_entry:
+        The asset's entry in the manifest of the previous build, or None
+    :type cached_entry:
+        `dict`
+    :param binary:
+        True to also write the binary encoding of the asset, if it is minified
+    :type binary:
+        `bool`
+    :rtype:
+        `dict`, `bool`
+    """
+    # pylint:disable=R0913
+    source_md5 = build_cache.get_file_md5(source)
+    if build_cache.is_entry_current(cached_entry, source_md5, dest, compress):
+        return cached_entry, False
+
+    if minify:
+        with open(source, 'rb') as source_file:
+            chunks = [minify_json(source_file.read())]
+        entry = write_outputs(chunks, dest, compress, compress_level, binary)
+    else:
+        with open(source, 'rb') as source_file:
+            chunks = iter(lambda: source_file.read(build_cache.HASH_CHUNK_SIZE), b'')
+            entry = write_outputs(chunks, dest, compress, compress_level)
+    entry['source'] = source_md5
+    return entry, True
+
+
+def get_asset_tasks(asset_dir, output_dir):
+    """
+    Get the assets to copy from the asset directory, and whether each should be minified and
+    compressed. Only assets directly inside one of COMPRESSED_DIRS are minified or compressed.
+
+    :param asset_dir:
+        Directory of assets to copy
+    :type asset_dir:
+        `str`
+    :param output_dir:
+        Directory to copy assets to
+    :type output_dir:
+        `str`
+    :rtype:
+        `list` of (`str`, `str`, `bool`, `bool`)
+    """
+    tasks = []
+    for (directory, _, filenames) in os.walk(asset_dir):
+        relative_dir = os.path.relpath(directory, asset_dir)
+        compressed = relative_dir in COMPRESSED_DIRS
+        for filename in sorted(filenames):
+            minify = compressed and COMPRESSED_DIRS[relative_dir] is not None and \
+                filename.endswith(COMPRESSED_DIRS[relative_dir])
+            tasks.append((
+                os.path.join(directory, filename),
+                os.path.normpath(os.path.join(output_dir, relative_dir, filename)),
+                minify,
+                compressed,
+            ))
+    tasks.sort()
+    return tasks
+
+
+def remove_stale_outputs(output_dir, cached_files, files):
+    """
+    Delete the outputs of assets from a previous build which are no longer in the build.
+
+    :param output_dir:
+        Output directory of the build
+    :type output_dir:
+        `str`
+    :param cached_files:
+        Entries of the previous build's manifest
+    :type cached_files:
+        `dict`
+    :param files:
+        Entries of the current build's manifest
+    :type files:
+        `dict`
+    """
+    for relative_path in sorted(set(cached_files) - set(files)):
+        dest = os.path.join(output_dir, *relative_path.split('/'))
+        stale_outputs = [dest] + [
+            '{0}{1}'.format(dest, extension)
+            for extension in sorted(build_cache.COMPRESSED_EXTENSIONS.values()) +
+            [build_cache.BINARY_EXTENSION]
+        ]
+        for stale_output in stale_outputs:
+            if os.path.exists(stale_output):
+                print('Removing stale output `{0}`'.format(stale_output))
+                os.remove(stale_output)
+
+
+def build_derived_assets(
+        output_dir,
+        files,
+        cached_files,
+        compress_level=DEFAULT_COMPRESS_LEVEL,
+        binary=False):
+    """
+    Build the assets derived from the assets in the output directory, unless none of their
+    sources changed since the last build. Derived assets whose sources were all removed are not
+    built, and assets with the same path as a derived asset are never replaced. Adds the entry
+    of each derived asset to `files`, and returns the paths of those which were rebuilt.
+
+    :param output_dir:
+        Output directory of the build
+    :type output_dir:
+        `str`
+    :param files:
+        Entries of the current build's manifest, by path relative to the output directory
+    :type files:
+        `dict`
+    :param cached_files:
+        Entries of the previous build's manifest
+    :type cached_files:
+        `dict`
+    :param compress_level:
+        gzip compression level, from 1 to 9
+    :type compress_level:
+        `int`
+    :param binary:
+        True to also write the binary encoding of each asset
+    :type binary:
+        `bool`
+    :rtype:
+        `list` of `str`
+    """
+    # pylint:disable=R0914
+    rebuilt = []
+    for relative_path in sorted(derived.DERIVED_ASSETS):
+        (sources, builder) = derived.DERIVED_ASSETS[relative_path]
+        sources_md5 = derived.get_sources_md5(sources, files)
+        if sources_md5 is None or relative_path in files:
+            continue
+
+        dest = os.path.join(output_dir, *relative_path.split('/'))
+        cached_entry = cached_files.get(relative_path)
+        if build_cache.is_entry_current(cached_entry, sources_md5, dest, True):
+            files[relative_path] = cached_entry
+            continue
+
+        source_content = {}
+        for source in sources:
+            source_content[source] = None
+            if source in files:
+                with open(os.path.join(output_dir, *source.split('/')), 'rb') as source_file:
+                    source_content[source] = json.loads(source_file.read().decode('utf-8'))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        entry = write_outputs(
+            [derived.build_derived_content(builder, source_content)],
+            dest,
+            True,
+            compress_level,
+            binary
+        )
+        entry['source'] = sources_md5
+        files[relative_path] = entry
+        rebuilt.append(relative_path)
+    return rebuilt
+
+
+def build_locale_assets(
+        output_dir,
+        files,
+        cached_files,
+        compress_level=DEFAULT_COMPRESS_LEVEL,
+        binary=False):
+    """
+    Build the variant of each JSON asset in the output directory for each locale, unless the
+    asset did not change since the last build. The locales an asset has variants for are
+    recorded in its entry as `locales`, so assets without localized fields are not parsed
+    again until they change. Assets with the same path as a variant are never replaced. Adds
+    the entry of each variant to `files`, and returns the paths of those which were rebuilt.
+
+    :param output_dir:
+        Output directory of the build
+    :type output_dir:
+        `str`
+    :param files:
+        Entries of the current build's manifest, by path relative to the output directory
+    :type files:
+        `dict`
+    :param cached_files:
+        Entries of the previous build's manifest
+    :type cached_files:
+        `dict`
+    :param compress_level:
+        gzip compression level, from 1 to 9
+    :type compress_level:
+        `int`
+    :param binary:
+        True to also write the binary encoding of each asset
+    :type binary:
+        `bool`
+    :rtype:
+        `list` of `str`
+    """
+    # pylint:disable=R0914
+    rebuilt = []
+    for relative_path in sorted(files):
+        entry = files[relative_path]
+        if not relative_path.endswith('.json') or \
+                localize.parse_locale_name(relative_path) is not None:
+            continue
+
+        content = None
+        locales = []
+        for locale in entry.get('locales', localize.LOCALES):
+            locale_path = localize.get_locale_name(relative_path, locale)
+            if locale_path in files:
+                continue
+            dest = os.path.join(output_dir, *locale_path.split('/'))
+            cached_entry = cached_files.get(locale_path)
+            if build_cache.is_entry_current(cached_entry, entry['md5'], dest, True):
+                files[locale_path] = cached_entry
+                locales.append(locale)
+                continue
+
+            if content is None:
+                with open(os.path.join(output_dir, *relative_path.split('/')), 'rb') as file:
+                    content = json.loads(file.read().decode('utf-8'))
+            locale_content = localize.build_locale_content(content, locale)
+            if locale_content is None:
+                continue
+            locale_entry = write_outputs([locale_content], dest, True, compress_level, binary)
+            locale_entry['source'] = entry['md5']
+            files[locale_path] = locale_entry
+            locales.append(locale)
+            rebuilt.append(locale_path)
+        entry['locales'] = locales
+    return rebuilt
+
+
+def minify_assets(
+        asset_dir,
+        output_dir,
+        compress_level=DEFAULT_COMPRESS_LEVEL,
+        processes=None,
+        changed=None,
+        binary=False,
+        excluded=None,
+        executor=None):
+    """
+    Copy all assets to the output directory, minifying JSON assets and compressing the assets
+    in COMPRESSED_DIRS, then build the derived assets and the variants of assets for each
+    locale. Assets are processed in parallel across a pool of processes, which callers building
+    repeatedly can keep for every build. Assets which have not changed since the last build
+    into the output directory are not rebuilt. Returns the entries of the build manifest, by
+    path relative to the output directory.
+
+    When the assets which changed are already known, `changed` skips hashing the others: their
+    entries from the last build are reused as they are. Assets in `excluded` are never built:
+    they keep their last build, and are left out if they have none.
+
+    :param asset_dir:
+        Directory of assets to copy
+    :type asset_dir:
+        `str`
+    :param output_dir:
+        Directory to copy assets to
+    :type output_dir:
+        `str`
+    :param compress_level:
+        gzip compression level, from 1 to 9
+    :type compress_level:
+        `int`
+    :param processes:
+        Number of worker processes, or None to use one per CPU
+    :type processes:
+        `int`
+    :param changed:
+        Paths of assets relative to `asset_dir`, using `/`, which may have changed since the
+        last build, or None to check every asset
+    :type changed:
+        `set`
+    :param binary:
+        True to also encode JSON assets with `binary_json`
+    :type binary:
+        `bool`
+    :param excluded:
+        Paths of assets relative to `asset_dir`, using `/`, which should not be built, such as
+        assets which failed validation, or None to build every asset
+    :type excluded:
+        `set`
+    :param executor:
+        Pool of processes to build assets with, or None to create one for this build
+    :type executor:
+        :class:concurrent.futures.Executor
+    :rtype:
+        `dict`
+    """
+    # pylint:disable=R0912,R0913,R0914
+    settings = {'binary': binary, 'compress_level': compress_level, 'encodings': get_encodings()}
+    cached_files = build_cache.get_cached_files(output_dir, settings)
+    if cached_files is None:
+        if os.path.exists(output_dir):
+            print('No usable build cache, cleaning output directory `{0}`'.format(output_dir))
+            shutil.rmtree(output_dir)
+        cached_files = {}
+
+    tasks = get_asset_tasks(asset_dir, output_dir)
+    for directory in sorted(set(os.path.dirname(task[1]) for task in tasks)):
+        os.makedirs(directory, exist_ok=True)
+
+    files = {}
+    with contextlib.ExitStack() as stack:
+        if executor is None:
+            executor = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+            )
+        futures = []
+        for task in tasks:
+            (source, dest, minify, compress) = task
+            relative_path = build_cache.get_relative_path(dest, output_dir)
+            source_path = build_cache.get_relative_path(source, asset_dir)
+            if excluded is not None and source_path in excluded:
+                if relative_path in cached_files:
+                    files[relative_path] = cached_files[relative_path]
+                continue
+            if changed is not None and relative_path in cached_files and \
+                    source_path not in changed:
+                files[relative_path] = cached_files[relative_path]
+                continue
+            futures.append((task, relative_path, executor.submit(
+                minify_asset,
+                source,
+                dest,
+                minify,
+                compress,
+                compress_level,
+                cached_files.get(relative_path),
+                binary
+            )))
+
+        rebuilt_count = 0
+        for (task, relative_path, future) in futures:
+            entry, rebuilt = future.result()
+            files[relative_path] = entry
+            if not rebuilt:
+                continue
+            rebuilt_count += 1
+            if task[2]:
+                print('Minified `{0}`'.format(task[1]))
+            elif 'zsize' in entry or 'variants' in entry:
+                print('Compressed `{0}`'.format(task[1]))
+            else:
+                print('Copied `{0}`'.format(task[1]))
+
+    for relative_path in build_derived_assets(
+            output_dir,
+            files,
+            cached_files,
+            compress_level,
+            binary):
+        rebuilt_count += 1
+        print('Derived `{0}`'.format(os.path.join(output_dir, *relative_path.split('/'))))
+    for relative_path in build_locale_assets(
+            output_dir,
+            files,
+            cached_files,
+            compress_level,
+            binary):
+        rebuilt_count += 1
+        print('Localized `{0}`'.format(os.path.join(output_dir, *relative_path.split('/'))))
+
+    remove_stale_outputs(output_dir, cached_files, files)
+    build_cache.save_manifest(output_dir, settings, files)
+    print('Built {0} of {1} assets, reused {2} from the build cache'.format(
+        rebuilt_count,
+        len(files),
+        len(files) - rebuilt_count
+    ))
+    return files
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: ./minify.py <asset_dir> <output_dir> [--level <1-9>] [--processes <n>] '
+              '[--binary]')
+        sys.exit(2)
+
+    COMPRESS_LEVEL = DEFAULT_COMPRESS_LEVEL
+    PROCESSES = None
+    if '--level' in sys.argv:
+        COMPRESS_LEVEL = int(sys.argv[sys.argv.index('--level') + 1])
+    if '--processes' in sys.argv:
+        PROCESSES = int(sys.argv[sys.argv.index('--processes') + 1])
+
+    minify_assets(
+        sys.argv[1],
+        sys.argv[2],
+        compress_level=COMPRESS_LEVEL,
+        processes=PROCESSES,
+        binary='--binary' in sys.argv
+    )
@@ -0,0 +1,648 @@
+"""
+Release assets to a storage bucket by version: compare each local asset to its existing version,
+upload it with its compressed variants if it changed, and publish a delta from its previous
+version when that is smaller.
+"""
+
+import os
+
+import build_cache  # pylint:disable=E0401
+import delta  # pylint:disable=E0401
+import instrumentation  # pylint:disable=E0401
+import release_upload  # pylint:disable=E0401
+
+
+# Types of assets
+ASSET_TYPES = {
+    'json': ['.json'],
+    'image': ['.png', '.gif', '.jpg'],
+    'text': ['.txt'],
+    'bundle': ['.bundle'],
+    'binary': ['.cgb'],
+}
+
+# Prefix of deltas between versions of assets
+DELTA_PREFIX = 'deltas/'
+
+# MIME type of each format of delta
+DELTA_CONTENT_TYPES = {
+    'json-patch': 'application/json-patch+json; charset=utf-8',
+    'binary': 'application/octet-stream',
+}
+
+
+def get_asset_type(asset_name):
+    """
+    Gets the asset type from ASSET_TYPES of an asset given its name.
+
+    :param asset_name:
+        Name of the asset
+    :type: asset_name:
+        `str`
+    :rtype:
+        `str` or None
+    """
+    filetype = asset_name[asset_name.rfind('.'):].lower()
+    for asset_type in ASSET_TYPES:
+        if filetype in ASSET_TYPES[asset_type]:
+            return asset_type
+    return None
+
+
+def get_content_type(asset_name, asset_type):
+    """
+    Get the MIME type to serve an asset with.
+
+    :param asset_name:
+        Filename of the asset
+    :type asset_name:
+        `str`
+    :param asset_type:
+        Type of the asset
+    :type asset_type:
+        `str`
+    :rtype:
+        `str`
+    """
+    if asset_type == 'image':
+        if asset_name[-3:] == 'png':
+            return 'image/png'
+        elif asset_name[-3:] == 'jpg':
+            return 'image/jpeg'
+        elif asset_name[-3:] == 'gif':
+            return 'image/gif'
+    elif asset_type == 'text':
+        return 'text/plain; charset=utf-8'
+    elif asset_type in ('binary', 'bundle'):
+        return 'application/octet-stream'
+    return 'application/json; charset=utf-8'
+
+
+def get_asset_digests(asset_path, build_entry, hash_gzipped=False):
+    """
+    Get the location of the gzipped output of an asset, or None if it has none, and the hex MD5
+    digests of the asset and its gzipped output. Digests are taken from the build manifest.
+    When the asset has no entry, the asset is hashed, and so is its gzipped output if
+    `hash_gzipped`, otherwise its digest is None.
+
+    :param asset_path:
+        Location of the asset
+    :type asset_path:
+        `str`
+    :param build_entry:
+        The asset's entry in the build manifest, or None
+    :type build_entry:
+        `dict`
+    :param hash_gzipped:
+        True to hash the gzipped output of an asset with no entry
+    :type hash_gzipped:
+        `bool`
+    :rtype:
+        `str`, `str`, `str`
+    """
+    asset_zpath = '{0}.gz'.format(asset_path)
+    if not os.path.exists(asset_zpath):
+        asset_zpath = None
+    if build_entry is not None:
+        return asset_zpath, build_entry['md5'], build_entry.get('zmd5')
+    with instrumentation.phase('hash'):
+        asset_md5 = build_cache.get_file_md5(asset_path)
+        asset_zmd5 = None
+        if hash_gzipped and asset_zpath is not None:
+            asset_zmd5 = build_cache.get_file_md5(asset_zpath)
+    return asset_zpath, asset_md5, asset_zmd5
+
+
+def get_asset_variants(asset_path, build_entry):
+    """
+    Get the compressed variants of an asset other than gzip, as the encoding, location and hex
+    MD5 digest of each. Digests are taken from the build manifest, and are None when the asset
+    has no entry.
+
+    :param asset_path:
+        Location of the asset
+    :type asset_path:
+        `str`
+    :param build_entry:
+        The asset's entry in the build manifest, or None
+    :type build_entry:
+        `dict`
+    :rtype:
+        `list` of (`str`, `str`, `str`)
+    """
+    variants = []
+    for encoding in sorted(build_cache.COMPRESSED_EXTENSIONS):
+        if encoding == 'gzip':
+            continue
+        variant_path = '{0}{1}'.format(asset_path, build_cache.COMPRESSED_EXTENSIONS[encoding])
+        if build_entry is not None:
+            if encoding in build_entry.get('variants', {}):
+                variants.append((
+                    encoding,
+                    variant_path,
+                    build_entry['variants'][encoding]['md5']
+                ))
+        elif os.path.exists(variant_path):
+            variants.append((encoding, variant_path, None))
+    return variants
+
+
+def get_encoded_asset_name(asset_name):
+    """
+    Get the name of the asset a file encodes: the JSON asset for its binary encoding from
+    `binary_json`, or the file itself for any other file.
+
+    :param asset_name:
+        Name of the file
+    :type asset_name:
+        `str`
+    :rtype:
+        `str`
+    """
+    if get_asset_type(asset_name) == 'binary':
+        return asset_name[:-len(build_cache.BINARY_EXTENSION)]
+    return asset_name
+
+
+def update_asset(
+        bucket,
+        name,
+        asset_type,
+        path,
+        version,
+        zpath=None,
+        upload_file=True,
+        content_md5=None,
+        zcontent_md5=None,
+        retries=release_upload.DEFAULT_RETRIES,
+        variants=None,
+        existing_encodings=()):
+    """
+    Upload an asset to the bucket, overriding existing versions. Returns the size, URL and
+    version of the asset, of its zipped content if it has any, and of its other compressed
+    variants. Variants which are not in the bucket yet are uploaded even if the asset is not.
+
+    :param bucket:
+        Bucket to upload to
+    :type bucket:
+        :class:storage.Storage
+    :param name:
+        Filename of the asset
+    :type name:
+        `str`
+    :param asset_type:
+        Type of the asset
+    :type asset_type:
+        `str`
+    :param path:
+        Location of the asset
+    :type path:
+        `str`
+    :param version:
+        Version number for asset
+    :type version:
+        `int`
+    :param zpath:
+        Location of the zipped asset, or None
+    :type zpath:
+        `str`
+    :param upload_file:
+        True to upload the file, false to skip
+    :type upload_file:
+        `bool`
+    :param content_md5:
+        Hex MD5 digest of the asset, if already known
+    :type content_md5:
+        `str`
+    :param zcontent_md5:
+        Hex MD5 digest of the zipped asset, if already known
+    :type zcontent_md5:
+        `str`
+    :param retries:
+        Number of times to retry each failed request
+    :type retries:
+        `int`
+    :param variants:
+        Compressed variants of the asset from `get_asset_variants`
+    :type variants:
+        `list`
+    :param existing_encodings:
+        Encodings of the variants of the asset already in the bucket
+    :type existing_encodings:
+        `list` of `str`
+    :rtype:
+        `dict`
+    """
+    # pylint:disable=R0913,R0914
+    content_type = get_content_type(name, asset_type)
+
+    base_object = release_upload.put_or_head_asset_object(
+        bucket,
+        'assets{0}'.format(name),
+        path,
+        version,
+        upload_file,
+        retries,
+        content_md5=content_md5,
+        content_type=content_type
+    )
+
+    updated_asset = {
+        'size': base_object['size'],
+        'url': bucket.url('assets{0}'.format(name), base_object['versionId']),
+        'version': base_object['version'],
+    }
+
+    if zpath:
+        zipped_object = release_upload.put_or_head_asset_object(
+            bucket,
+            'assets{0}.gz'.format(name),
+            zpath,
+            version,
+            upload_file,
+            retries,
+            content_md5=zcontent_md5,
+            content_type=content_type,
+            content_encoding='gzip'
+        )
+        updated_asset['zsize'] = zipped_object['size']
+        updated_asset['zurl'] = bucket.url(
+            'assets{0}.gz'.format(name),
+            zipped_object['versionId']
+        )
+
+    for (encoding, variant_path, variant_md5) in variants or []:
+        variant_key = 'assets{0}{1}'.format(name, build_cache.COMPRESSED_EXTENSIONS[encoding])
+        variant_object = release_upload.put_or_head_asset_object(
+            bucket,
+            variant_key,
+            variant_path,
+            base_object['version'],
+            upload_file or encoding not in existing_encodings,
+            retries,
+            content_md5=variant_md5,
+            content_type=content_type,
+            content_encoding=encoding
+        )
+        updated_asset.setdefault('variants', []).append({
+            'encoding': encoding,
+            'size': variant_object['size'],
+            'url': bucket.url(variant_key, variant_object['versionId']),
+        })
+
+    return updated_asset
+
+
+def parse_existing_asset(item, existing_assets):
+    """
+    Record the listing details of an asset and add it to the existing assets. Only the metadata
+    returned by the listing is used, so the body of the asset is never downloaded.
+
+    :param item:
+        An object summary from the bucket listing
+    :type item:
+        :class:storage.ObjectSummary
+    :param existing_assets:
+        The existing assets
+    :type existing_assets:
+        `dict`
+    """
+    item_key = item.key[6:]
+    for encoding in sorted(build_cache.COMPRESSED_EXTENSIONS):
+        extension = build_cache.COMPRESSED_EXTENSIONS[encoding]
+        if item_key.endswith(extension):
+            existing_asset = existing_assets[item_key[:-len(extension)]]
+            existing_asset['encodings'].append(encoding)
+            existing_asset['zipped'] = existing_asset['zipped'] or encoding == 'gzip'
+            return
+
+    existing_assets[item_key] = {
+        'encodings': [],
+        'etag': item.etag,
+        'size': item.size,
+        'zipped': False,
+    }
+    print('Parsed existing asset `{0}`'.format(item_key))
+
+
+def get_existing_asset_metadata(bucket, name):
+    """
+    Get the user metadata of an asset in the bucket with a HEAD request.
+
+    :param bucket:
+        Bucket containing the asset
+    :type bucket:
+        :class:storage.Storage
+    :param name:
+        Name of the asset, with a leading slash
+    :type name:
+        `str`
+    :rtype:
+        `dict`
+    """
+    return bucket.head('assets{0}'.format(name))['metadata']
+
+
+def is_existing_asset_unchanged(bucket, name, content_md5, existing_asset):
+    """
+    Check if an asset in the bucket has the same content as a local asset, without downloading
+    it. The ETag of an object uploaded in a single request is the MD5 of its content. Objects
+    uploaded in multiple parts have a different ETag, so the MD5 recorded in their metadata at
+    upload is compared instead.
+
+    :param bucket:
+        Bucket containing the asset
+    :type bucket:
+        :class:storage.Storage
+    :param name:
+        Name of the asset, with a leading slash
+    :type name:
+        `str`
+    :param content_md5:
+        Hex MD5 digest of the local asset
+    :type content_md5:
+        `str`
+    :param existing_asset:
+        Details of the asset from `parse_existing_asset`
+    :type existing_asset:
+        `dict`
+    :rtype:
+        `bool`
+    """
+    if '-' not in existing_asset['etag']:
+        return existing_asset['etag'] == content_md5
+    return get_existing_asset_metadata(bucket, name).get('md5') == content_md5
+
+
+def get_delta_key(asset_name, from_md5, to_md5, delta_format):
+    """
+    Get the key of a delta between two versions of an asset. Deltas are keyed by the MD5 of the
+    content they apply to and build rather than by version, since a failed release can reuse
+    version numbers for different content, so the content of a delta never changes.
+
+    :param asset_name:
+        Filename of the asset
+    :type asset_name:
+        `str`
+    :param from_md5:
+        Hex MD5 of the content the delta applies to
+    :type from_md5:
+        `str`
+    :param to_md5:
+        Hex MD5 of the content the delta builds
+    :type to_md5:
+        `str`
+    :param delta_format:
+        One of `delta.DELTA_FORMATS`
+    :type delta_format:
+        `str`
+    :rtype:
+        `str`
+    """
+    return '{0}{1}.{2}-{3}.{4}'.format(
+        DELTA_PREFIX,
+        asset_name,
+        from_md5,
+        to_md5,
+        'patch.json' if delta_format == 'json-patch' else 'delta'
+    )
+
+
+def get_previous_content(bucket, key, path, retries):
+    """
+    Download the version of an asset in the bucket, to build a delta to the local asset.
+    Returns None if the local asset is too large to diff.
+
+    :param bucket:
+        Bucket containing the asset
+    :type bucket:
+        :class:storage.Storage
+    :param key:
+        Key of the asset in the bucket
+    :type key:
+        `str`
+    :param path:
+        Location of the local asset
+    :type path:
+        `str`
+    :param retries:
+        Number of times to retry each failed request
+    :type retries:
+        `int`
+    :rtype:
+        `bytes` or None
+    """
+    if os.path.getsize(path) > delta.DELTA_MAX_SIZE:
+        return None
+    with instrumentation.phase('delta'):
+        return release_upload.call_with_retries(retries, bucket.get, key)
+
+
+def release_asset_delta(
+        bucket,
+        asset_name,
+        previous_content,
+        path,
+        from_version,
+        built_asset,
+        retries=release_upload.DEFAULT_RETRIES,
+        content_addressed=False):
+    """
+    Build a delta from the previous version of an asset to its new version, and upload it if
+    it is smaller than the asset, or any of its compressed variants. Returns the delta's entry
+    for the config, or None if there is no smaller delta.
+
+    :param bucket:
+        Bucket to upload to
+    :type bucket:
+        :class:storage.Storage
+    :param asset_name:
+        Filename of the asset
+    :type asset_name:
+        `str`
+    :param previous_content:
+        Content of the previous version, from `get_previous_content`
+    :type previous_content:
+        `bytes`
+    :param path:
+        Location of the new version
+    :type path:
+        `str`
+    :param from_version:
+        Version of `previous_content`
+    :type from_version:
+        `int`
+    :param built_asset:
+        Details of the new version of the asset for a config
+    :type built_asset:
+        `dict`
+    :param retries:
+        Number of times to retry each failed request
+    :type retries:
+        `int`
+    :param content_addressed:
+        True if assets are addressed by their key alone, rather than by version ID
+    :type content_addressed:
+        `bool`
+    :rtype:
+        `dict` or None
+    """
+    # pylint:disable=R0913,R0914
+    with instrumentation.phase('delta'):
+        with open(path, 'rb') as asset_file:
+            content = asset_file.read()
+        built_delta = delta.build_delta(built_asset['type'], previous_content, content)
+    full_size = min(
+        [built_asset['size'], built_asset.get('zsize', built_asset['size'])] +
+        [variant['size'] for variant in built_asset.get('variants', [])]
+    )
+    if built_delta is None or len(built_delta[1]) >= full_size:
+        return None
+
+    (delta_format, delta_content) = built_delta
+    key = get_delta_key(
+        asset_name,
+        release_upload.get_content_md5(previous_content),
+        release_upload.get_content_md5(content),
+        delta_format
+    )
+    print('Uploading delta `{0}`'.format(key))
+    with instrumentation.phase('upload'):
+        response = release_upload.call_with_retries(
+            retries,
+            bucket.put,
+            key,
+            delta_content,
+            content_type=DELTA_CONTENT_TYPES[delta_format],
+            public=True,
+            cache_control=release_upload.IMMUTABLE_CACHE_CONTROL
+        )
+    return {
+        'format': delta_format,
+        'fromVersion': from_version,
+        'size': len(delta_content),
+        'url': bucket.url(key, None if content_addressed else response['versionId']),
+    }
+
+
+def release_asset(
+        bucket,
+        asset_folder,
+        asset_name,
+        existing_asset,
+        retries=release_upload.DEFAULT_RETRIES,
+        build_entry=None,
+        deltas=False):
+    """
+    Compare a local asset to its existing version in the bucket and upload it if it has
+    changed. Returns the details of the asset for a config. Safe to call from worker threads.
+
+    :param bucket:
+        Bucket to upload to
+    :type bucket:
+        :class:storage.Storage
+    :param asset_folder:
+        Directory containing the asset
+    :type asset_folder:
+        `str`
+    :param asset_name:
+        Filename of the asset
+    :type asset_name:
+        `str`
+    :param existing_asset:
+        Details of the asset already in the bucket from `parse_existing_asset`, or None
+    :type existing_asset:
+        `dict`
+    :param retries:
+        Number of times to retry each failed request
+    :type retries:
+        `int`
+    :param build_entry:
+        The asset's entry in the build manifest, to avoid hashing it again, or None
+    :type build_entry:
+        `dict`
+    :param deltas:
+        True to publish a delta from the previous version of the asset, if it changed
+    :type deltas:
+        `bool`
+    :rtype:
+        `dict`
+    """
+    # pylint:disable=R0913,R0914
+    slash_asset_name = '/{}'.format(asset_name)
+    asset_type = get_asset_type(asset_name)
+
+    last_version = 0
+    upload_file = True
+    previous_content = None
+    asset_path = os.path.join(asset_folder, asset_name)
+    (asset_zpath, asset_md5, asset_zmd5) = get_asset_digests(asset_path, build_entry)
+    if existing_asset is not None:
+        with instrumentation.phase('diff'):
+            if release_upload.call_with_retries(
+                    retries,
+                    is_existing_asset_unchanged,
+                    bucket,
+                    slash_asset_name,
+                    asset_md5,
+                    existing_asset):
+                upload_file = False
+            else:
+                last_version = int(release_upload.call_with_retries(
+                    retries,
+                    get_existing_asset_metadata,
+                    bucket,
+                    slash_asset_name
+                )['version'])
+        # The previous version is overwritten by the upload, so it is downloaded first
+        if upload_file and deltas:
+            previous_content = get_previous_content(
+                bucket,
+                'assets{0}'.format(slash_asset_name),
+                asset_path,
+                retries
+            )
+
+    with instrumentation.phase('upload' if upload_file else 'head'):
+        asset_details = update_asset(
+            bucket,
+            slash_asset_name,
+            asset_type,
+            asset_path,
+            last_version + 1,
+            zpath=asset_zpath,
+            upload_file=upload_file,
+            content_md5=asset_md5,
+            zcontent_md5=asset_zmd5,
+            retries=retries,
+            variants=get_asset_variants(asset_path, build_entry),
+            existing_encodings=existing_asset['encodings'] if existing_asset else ()
+        )
+    built_asset = {
+        'name': slash_asset_name,
+        'size': asset_details['size'],
+        'type': asset_type,
+        'url': asset_details['url'],
+        'version': asset_details['version'],
+    }
+
+    if 'zurl' in asset_details and 'zsize' in asset_details:
+        built_asset['zsize'] = asset_details['zsize']
+        built_asset['zurl'] = asset_details['zurl']
+    if 'variants' in asset_details:
+        built_asset['variants'] = asset_details['variants']
+
+    if previous_content is not None:
+        delta_entry = release_asset_delta(
+            bucket,
+            asset_name,
+            previous_content,
+            asset_path,
+            last_version,
+            built_asset,
+            retries
+        )
+        if delta_entry is not None:
+            built_asset['deltas'] = [delta_entry]
+
+    return built_asset
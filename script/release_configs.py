@@ -0,0 +1,502 @@
+"""
+Build, update and upload the configs of releases, and keep the config index recording the most
+recent config version.
+"""
+
+import concurrent.futures
+import json
+import re
+import time
+
+import instrumentation  # pylint:disable=E0401
+import localize  # pylint:disable=E0401
+import release_upload  # pylint:disable=E0401
+import storage  # pylint:disable=E0401
+
+
+# Keys of config files in the bucket, by version
+RE_CONFIG_KEY = re.compile(r'^config/([0-9]+)[.]([0-9]+)[.]([0-9]+)[.]json$')
+
+# Key of the object recording the most recent config version, so it can be found without
+# listing the bucket. Kept outside of `config/` so it is never mistaken for a config.
+CONFIG_INDEX_KEY = 'index/config.json'
+
+
+def build_empty_config(desc_en='', desc_fr=''):
+    """
+    Get a basic empty config. For consistency.
+
+    :rtype:
+        `dict`
+    """
+    return {
+        'files': [],
+        'lastUpdatedAt': int(time.time()),
+        'whatsNew': {
+            'description_en': desc_en,
+            'description_fr': desc_fr,
+        },
+    }
+
+
+def get_total_config_size(config):
+    """
+    Given a config file, determine the total size of assets, zipped assets, and the total of both.
+
+    :param config:
+        The config file to parse
+    :type config:
+        `dict`
+    :rtype:
+        `int`, `int`, `int`
+    """
+    total_base_size = total_zipped_size = 0
+    for asset_details in config['files']:
+        total_base_size += asset_details['size']
+        if 'zsize' in asset_details:
+            total_zipped_size += asset_details['zsize']
+    return total_base_size, total_zipped_size, total_base_size + total_zipped_size
+
+
+def parse_config_version(key):
+    """
+    Get the version of a config from its key in the bucket, as a tuple of 3 integers which
+    can be compared directly. Returns None if the key is not a config.
+
+    :param key:
+        Key of an object in the bucket
+    :type key:
+        `str`
+    :rtype:
+        (`int`, `int`, `int`) or None
+    """
+    match = RE_CONFIG_KEY.match(key)
+    if not match:
+        return None
+    return tuple(int(part) for part in match.groups())
+
+
+def get_config_index_version(bucket):
+    """
+    Get the most recent config version recorded in the config index. Returns None if the
+    bucket has no config index.
+
+    :param bucket:
+        the bucket to examine
+    :type bucket:
+        :class:storage.Storage
+    :rtype:
+        (`int`, `int`, `int`) or None
+    """
+    try:
+        index_content = bucket.get(CONFIG_INDEX_KEY)
+    except storage.ObjectNotFoundError:
+        return None
+    latest = json.loads(index_content.decode('utf-8'))['latest']
+    return parse_config_version('config/{0}.json'.format(latest))
+
+
+def get_most_recent_config(bucket):
+    """
+    Given a bucket, find the most recent config file version in that bucket and return its
+    version as an array of 3 integers. If no config files are found, returns [0, 0, 0].
+    The version is read from the config index, or found by listing the configs in the bucket
+    if there is no index yet.
+
+    :param bucket:
+        the bucket to examine
+    :type bucket:
+        :class:storage.Storage
+    :rtype:
+        `list` of `int`
+    """
+    max_version = get_config_index_version(bucket)
+    if max_version is None:
+        print('No config index found, listing configs')
+        max_version = (0, 0, 0)
+        for item in bucket.list('config/'):
+            item_version = parse_config_version(item.key)
+            if item_version is not None and item_version > max_version:
+                max_version = item_version
+    print('Found most recent config version: {0}'.format(list(max_version)))
+    return list(max_version)
+
+
+def update_config_index(bucket, version):
+    """
+    Record a config version in the config index, if there is no index yet or the version is
+    more recent than the version already recorded. Raises ValueError if the version is not a
+    major.minor.patch version.
+
+    :param bucket:
+        the bucket containing the config index
+    :type bucket:
+        :class:storage.Storage
+    :param version:
+        The major.minor.patch version of a config which was uploaded
+    :type version:
+        `str`
+    """
+    parsed_version = parse_config_version('config/{0}.json'.format(version))
+    if parsed_version is None:
+        raise ValueError('`version` must match "X.Y.Z"')
+    index_version = get_config_index_version(bucket)
+    if index_version is not None and parsed_version <= index_version:
+        return
+    print('Updating config index `{0}` to {1}'.format(CONFIG_INDEX_KEY, version))
+    bucket.put(
+        CONFIG_INDEX_KEY,
+        json.dumps({'latest': version, 'updatedAt': int(time.time())}),
+        content_type='application/json; charset=utf-8',
+        cache_control=release_upload.CONFIG_CACHE_CONTROL
+    )
+
+
+def get_release_config_version(bucket, version):
+    """
+    Gets a string for the config version to build.
+
+    :param bucket:
+        the s3 bucket to examine for the most recent config version, if necessary
+    :type bucket:
+        :class:storage.Storage
+    :param version:
+        Either the major.minor.patch build number for the config, or
+        'major', 'minor', or 'patch' to update from the most recent config version
+    :type version:
+        `str`
+    """
+    if re.match(r'[0-9]+[.][0-9]+[.][0-9]+$', version):
+        return version
+
+    last_version = get_most_recent_config(bucket)
+    if version == 'major':
+        last_version[0] = last_version[0] + 1
+        last_version[1] = 0
+        last_version[2] = 0
+    elif version == 'minor':
+        last_version[1] = last_version[1] + 1
+        last_version[2] = 0
+    elif version == 'patch':
+        last_version[2] = last_version[2] + 1
+    else:
+        raise ValueError('`version` must be one of "major", "minor", "patch", or match "X.Y.Z"')
+
+    last_version = [str(x) for x in last_version]
+    return '.'.join(last_version)
+
+
+def index_config_files(configs):
+    """
+    Build an index from asset names to the configs and file entries which contain them, so
+    compatible updates only visit the entries for the assets being updated.
+
+    :param configs:
+        Existing configs
+    :type configs:
+        `dict`
+    :rtype:
+        `dict` of `str` to `list` of (`str`, `dict`)
+    """
+    config_index = {}
+    for config_key in sorted(configs):
+        for file in configs[config_key]['content']['files']:
+            config_index.setdefault(file['name'], []).append((config_key, file))
+    return config_index
+
+
+def is_bundle_current(bundle_entry, file_versions):
+    """
+    Check if the members of a bundle are the versions of the assets in a config.
+
+    :param bundle_entry:
+        Config entry of the bundle
+    :type bundle_entry:
+        `dict`
+    :param file_versions:
+        Version of each asset in the config, by name
+    :type file_versions:
+        `dict`
+    :rtype:
+        `bool`
+    """
+    return all(
+        file_versions.get(member['name']) == member['version']
+        for member in bundle_entry['members']
+    )
+
+
+def update_compatible_bundles(updated_assets, config):
+    """
+    Update the bundles of a config after its files were updated to new versions. A bundle is
+    replaced by its new version if every member of the new version is in the config at the
+    same version, and is left out of the config if its members are no longer the versions in
+    the config, so the app downloads the files instead.
+
+    :param updated_assets:
+        Details of each asset for a config, by asset name
+    :type updated_assets:
+        `dict`
+    :param config:
+        Content of the config, with its files updated
+    :type config:
+        `dict`
+    """
+    file_versions = {file['name']: file['version'] for file in config['files']}
+    bundles = []
+    for bundle_entry in config.get('bundles', []):
+        updated_bundle = updated_assets.get(bundle_entry['name'])
+        if updated_bundle is not None and \
+                updated_bundle['version'] == bundle_entry['version'] + 1 and \
+                is_bundle_current(updated_bundle, file_versions):
+            bundles.append(updated_bundle)
+        elif is_bundle_current(bundle_entry, file_versions):
+            bundles.append(bundle_entry)
+    if bundles:
+        config['bundles'] = bundles
+    else:
+        config.pop('bundles', None)
+
+
+def update_compatible_configs(updated_assets, configs, config_index=None):
+    """
+    Update any existing configs which contain the previous version of an asset to point to its
+    new version, along with their bundles. Configs which are changed are marked as updated.
+
+    :param updated_assets:
+        Details of each asset for a config, by asset name
+    :type updated_assets:
+        `dict`
+    :param configs:
+        Existing configs to check and update
+    :type configs:
+        `dict`
+    :param config_index:
+        Index of the file entries in `configs` from `index_config_files`, or None to build it
+    :type config_index:
+        `dict`
+    """
+    if config_index is None:
+        config_index = index_config_files(configs)
+
+    updated_at = int(time.time())
+    updated_keys = set()
+    for name in sorted(updated_assets):
+        updated_asset = updated_assets[name]
+        version = updated_asset['version']
+        for (config_key, file) in config_index.get(name, []):
+            if file['version'] != version - 1:
+                continue
+            file['size'] = updated_asset['size']
+            file['url'] = updated_asset['url']
+            file['version'] = version
+            if 'zsize' in file:
+                if 'zsize' in updated_asset:
+                    file['zsize'] = updated_asset['zsize']
+                    file['zurl'] = updated_asset['zurl']
+                else:
+                    file.pop('zsize', None)
+                    file.pop('zurl', None)
+            for field in ('binary', 'deltas', 'variants'):
+                if field in updated_asset:
+                    file[field] = updated_asset[field]
+                else:
+                    file.pop(field, None)
+            configs[config_key]['updated'] = True
+            configs[config_key]['content']['lastUpdatedAt'] = updated_at
+            updated_keys.add(config_key)
+
+    for config_key in sorted(updated_keys):
+        if 'bundles' in configs[config_key]['content']:
+            update_compatible_bundles(updated_assets, configs[config_key]['content'])
+
+
+def parse_existing_config(bucket, key):
+    """
+    Download and parse the content of a config. Returns the details of the config.
+
+    :param bucket:
+        Bucket containing the config
+    :type bucket:
+        :class:storage.Storage
+    :param key:
+        Key of the config
+    :type key:
+        `str`
+    :rtype:
+        `dict`
+    """
+    parsed_config = {
+        'content': json.loads(bucket.get(key).decode('utf-8')),
+        'key': key,
+        'updated': False,
+    }
+    print('Parsed existing config `{0}`'.format(key))
+    return parsed_config
+
+
+def parse_existing_configs(
+        bucket,
+        concurrency=release_upload.DEFAULT_CONCURRENCY,
+        retries=release_upload.DEFAULT_RETRIES):
+    """
+    Download and parse all configs in the bucket concurrently. Returns a dict of the details of
+    each config, by key.
+
+    :param bucket:
+        Bucket containing the configs
+    :type bucket:
+        :class:storage.Storage
+    :param concurrency:
+        Maximum number of configs to download at once
+    :type concurrency:
+        `int`
+    :param retries:
+        Number of times to retry each failed request
+    :type retries:
+        `int`
+    :rtype:
+        `dict`
+    """
+    config_keys = sorted(
+        item.key
+        for item in bucket.list('config/')
+        if parse_config_version((localize.parse_locale_name(item.key) or (item.key,))[0])
+        is not None
+    )
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [
+            executor.submit(
+                release_upload.call_with_retries,
+                retries,
+                parse_existing_config,
+                bucket,
+                key
+            )
+            for key in config_keys
+        ]
+        return {key: future.result() for (key, future) in zip(config_keys, futures)}
+
+
+def build_release_config(assets, version, description, locale=None):
+    """
+    Build a config for release. The config with every asset lists no variants of assets for a
+    locale, and the config for a locale lists the variant of each asset for the locale in place
+    of the asset, without bundles.
+
+    :param bucket:
+        A bucket to retrieve existing assets and configs from
+    :type bucket:
+        :class:storage.Storage
+    :param assets:
+        Asset names and details for the config
+    :type assets:
+        `dict`
+    :param version:
+        Version for config
+    :type version:
+        `int`
+    :param description:
+        Description of the update
+    :type description:
+        `dict`
+    :param locale:
+        Locale of the config, or None for the config with every asset
+    :type locale:
+        `str`
+    :rtype:
+        `str`, `dict`
+    """
+    with instrumentation.phase('config_build'):
+        config = build_empty_config(desc_en=description['en'], desc_fr=description['fr'])
+        for asset in assets:
+            if assets[asset]['type'] == 'bundle':
+                config.setdefault('bundles', []).append(assets[asset])
+            else:
+                config['files'].append(assets[asset])
+        config['files'], locale_files = localize.split_locale_files(config['files'])
+        if locale is not None:
+            config['files'] = locale_files[locale]
+            config.pop('bundles', None)
+    config_key = 'config/{0}.json'.format(version)
+    if locale is not None:
+        config_key = localize.get_locale_name(config_key, locale)
+    config_details = {
+        'content': config,
+        'key': config_key,
+        'updated': True,
+    }
+    print('Built config file `{0}`'.format(config_key))
+    total_base_size, total_zipped_size, total_size = get_total_config_size(config)
+    print('Config total download size: {0}/{1} ({2})'.format(
+        total_base_size / 1000,
+        total_zipped_size / 1000,
+        total_size / 1000
+    ))
+    return config_key, config_details
+
+
+def upload_config(bucket, config_details):
+    """
+    Upload a config to the bucket.
+
+    :param bucket:
+        Bucket to upload to
+    :type bucket:
+        :class:storage.Storage
+    :param config_details:
+        Details of the config
+    :type config_details:
+        `dict`
+    """
+    print('Uploading config `{0}`'.format(config_details['key']))
+    bucket.put(
+        config_details['key'],
+        json.dumps(config_details['content']),
+        content_type='application/json; charset=utf-8',
+        public=True,
+        cache_control=release_upload.CONFIG_CACHE_CONTROL
+    )
+
+
+def update_changed_configs(
+        bucket,
+        configs,
+        concurrency=release_upload.DEFAULT_CONCURRENCY,
+        retries=release_upload.DEFAULT_RETRIES):
+    """
+    Update only config files in `configs` which have the key 'updated' set to True. Configs
+    are uploaded concurrently.
+
+    :param bucket:
+        Bucket which all configs exist in
+    :type bucket:
+        :class:storage.Storage
+    :param configs:
+        Dictionary of config names and details
+    :type configs:
+        `dict`
+    :param concurrency:
+        Maximum number of configs to upload at once
+    :type concurrency:
+        `int`
+    :param retries:
+        Number of times to retry each failed request
+    :type retries:
+        `int`
+    """
+    updated_configs = [configs[config] for config in sorted(configs) if configs[config]['updated']]
+    with instrumentation.phase('config_upload'), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [
+            executor.submit(
+                release_upload.call_with_retries,
+                retries,
+                upload_config,
+                bucket,
+                config_details
+            )
+            for config_details in updated_configs
+        ]
+        for future in futures:
+            future.result()
@@ -1,69 +1,40 @@
 #!/usr/bin/env python3
 
 """
-Update the S3 bucket with new config files and assets.
+Update a storage bucket with new config files and assets, or build the dev configs of a
+directory of assets.
+
+- `release_assets` releases assets by version, with their deltas
+- `release_objects` releases content-addressed assets and keeps the asset index
+- `release_configs` builds and uploads configs and keeps the config index
+- `release_upload` uploads assets with retries and multipart uploads
 """
 
+import concurrent.futures
 import glob
 import json
 import os
-import re
-import shutil
-import subprocess
 import sys
 import time
 
-import boto3
-
-
-# Types of assets
-ASSET_TYPES = {
-    'json': ['.json'],
-    'image': ['.png', '.gif', '.jpg'],
-    'text': ['.txt'],
-}
-
-
-def build_empty_config(desc_en='', desc_fr=''):
-    """
-    Get a basic empty config. For consistency.
-
-    :rtype:
-        `dict`
-    """
-    return {
-        'files': [],
-        'lastUpdatedAt': int(time.time()),
-        'whatsNew': {
-            'description_en': desc_en,
-            'description_fr': desc_fr,
-        },
-    }
-
-
-def get_total_config_size(config):
-    """
-    Given a config file, determine the total size of assets, zipped assets, and the total of both.
-
-    :param config:
-        The config file to parse
-    :type config:
-        `dict`
-    :rtype:
-        `int`, `int`, `int`
-    """
-    total_base_size = total_zipped_size = 0
-    for asset_details in config['files']:
-        total_base_size += asset_details['size']
-        if 'zsize' in asset_details:
-            total_zipped_size += asset_details['zsize']
-    return total_base_size, total_zipped_size, total_base_size + total_zipped_size
+import build_cache  # pylint:disable=E0401
+import bundle  # pylint:disable=E0401
+import instrumentation  # pylint:disable=E0401
+import localize  # pylint:disable=E0401
+import minify  # pylint:disable=E0401
+import release_assets  # pylint:disable=E0401
+import release_configs  # pylint:disable=E0401
+import release_objects  # pylint:disable=E0401
+import release_upload  # pylint:disable=E0401
+import staging  # pylint:disable=E0401
+import storage  # pylint:disable=E0401
 
 
 def get_all_assets(asset_dir):
     """
     Get all available asset names in the base directory and the subdirectory they are in.
-    First item in tuple is the asset directory, second is the asset name.
+    First item in tuple is the asset directory, second is the asset name. Config files built
+    into the `config` directory and bundles built into the `bundle` directory are not assets.
 
     :param asset_dir:
         Base directory to begin search from
@@ -73,36 +44,192 @@ def get_all_assets(asset_dir):
         `list` of (`str`, `str`)
     """
     assets = []
+    config_dir = os.path.join(asset_dir, 'config', '')
+    bundle_dir = os.path.join(asset_dir, bundle.BUNDLE_DIR, '')
     for file_path in glob.iglob(os.path.join(asset_dir, '**', '*'), recursive=True):
         directory, filename = file_path[:file_path.rfind(os.path.sep) + 1], \
                               file_path[file_path.rfind(os.path.sep) + 1:]
+        if os.path.normpath(directory) in (os.path.normpath(config_dir),
+                                           os.path.normpath(bundle_dir)):
+            continue
         if filename.find('.') > 0 and 'config' not in filename:
             assets.append((directory, filename))
     assets.sort(key=lambda s: s[1])
     return assets
 
 
-def get_asset_type(asset_name):
+def attach_binary_files(files):
+    """
+    Move the entries of the binary encodings of JSON assets, released like other assets, into
+    the entries of the assets they encode as `binary`, with their size and URL. Encodings of
+    assets which are not in the files are dropped.
+
+    :param files:
+        Entries of assets for a config, in order
+    :type files:
+        `list` of `dict`
+    :rtype:
+        `list` of `dict`
+    """
+    binary_files = {
+        release_assets.get_encoded_asset_name(file['name']): file
+        for file in files
+        if file['type'] == 'binary'
+    }
+    attached_files = []
+    for file in files:
+        if file['type'] == 'binary':
+            continue
+        if file['name'] in binary_files:
+            file = dict(file, binary={
+                'size': binary_files[file['name']]['size'],
+                'url': binary_files[file['name']]['url'],
+            })
+        attached_files.append(file)
+    return attached_files
+
+
+def build_bundle_entry(bundle_asset, bundle_index, member_assets):
+    """
+    Build the config entry of a bundle from its entry as an asset, adding its index with the
+    version of each member.
+
+    :param bundle_asset:
+        Details of the bundle for a config
+    :type bundle_asset:
+        `dict`
+    :param bundle_index:
+        Index of the bundle from `bundle.write_bundle`
+    :type bundle_index:
+        `list` of `dict`
+    :param member_assets:
+        Details of each asset for a config, by name
+    :type member_assets:
+        `dict`
+    :rtype:
+        `dict`
     """
-    Gets the asset type from ASSET_TYPES of an asset given its name.
+    bundle_entry = dict(bundle_asset)
+    bundle_entry['members'] = [
+        dict(member, version=member_assets[member['name']]['version'])
+        for member in bundle_index
+    ]
+    return bundle_entry
 
+
+def build_dev_file_entries(asset_dir, asset_folder, asset_name, build_files):
+    """
+    Build the entries of a dev asset for the iOS and Android dev configs.
+
+    :param asset_dir:
+        Location of assets in filesystem
+    :type asset_dir:
+        `str`
+    :param asset_folder:
+        Directory containing the asset
+    :type asset_folder:
+        `str`
     :param asset_name:
-        Name of the asset
-    :type: asset_name:
+        Filename of the asset
+    :type asset_name:
         `str`
+    :param build_files:
+        Entries of the build manifest of `asset_dir`
+    :type build_files:
+        `dict`
     :rtype:
-        `str` or None
+        `dict`, `dict`
     """
-    filetype = asset_name[asset_name.rfind('.'):].lower()
-    for asset_type in ASSET_TYPES:
-        if filetype in ASSET_TYPES[asset_type]:
-            return asset_type
-    return None
+    asset_type = release_assets.get_asset_type(asset_name)
+    build_entry = build_files.get(build_cache.get_relative_path(
+        os.path.join(asset_folder, asset_name),
+        asset_dir
+    ))
+    variants = []
+    binary_size = None
+    if build_entry is not None:
+        asset_size = build_entry['size']
+        binary_size = build_entry.get('binary', {}).get('size')
+        asset_zsize = build_entry.get('zsize')
+        variants = [
+            (encoding, build_entry['variants'][encoding]['size'])
+            for encoding in sorted(build_entry.get('variants', {}))
+        ]
+    else:
+        asset_size = os.path.getsize(os.path.join(asset_folder, asset_name))
+        asset_zsize = None
+        zipped_asset = os.path.join(asset_folder, '{}.gz'.format(asset_name))
+        if os.path.exists(zipped_asset):
+            asset_zsize = os.path.getsize(zipped_asset)
+
+    file_ios = {
+        'name': '/{}'.format(asset_name),
+        'size': asset_size,
+        'type': asset_type,
+        'url': 'http://localhost:8080/{0}/{1}'.format(asset_type, asset_name),
+        'version': 1,
+    }
+    file_android = {
+        'name': '/{}'.format(asset_name),
+        'size': asset_size,
+        'type': asset_type,
+        'url': 'http://10.0.2.2:8080/{0}/{1}'.format(asset_type, asset_name),
+        'version': 1,
+    }
 
+    if asset_zsize is not None:
+        file_ios['zurl'] = 'http://localhost:8080/{0}/{1}'.format(
+            asset_type,
+            '{}.gz'.format(asset_name)
+        )
+        file_ios['zsize'] = asset_zsize
+    if variants:
+        file_ios['variants'] = [
+            {
+                'encoding': encoding,
+                'size': variant_size,
+                'url': 'http://localhost:8080/{0}/{1}{2}'.format(
+                    asset_type,
+                    asset_name,
+                    build_cache.COMPRESSED_EXTENSIONS[encoding]
+                ),
+            }
+            for (encoding, variant_size) in variants
+        ]
+    if binary_size is not None:
+        for (file, host) in ((file_ios, 'localhost'), (file_android, '10.0.2.2')):
+            file['binary'] = {
+                'size': binary_size,
+                'url': 'http://{0}:8080/{1}/{2}{3}'.format(
+                    host,
+                    asset_type,
+                    asset_name,
+                    build_cache.BINARY_EXTENSION
+                ),
+            }
+
+    return file_ios, file_android
 
-def build_dev_config(asset_dir, output_dir, app_config_dir, filename, description):
+
+def build_dev_config(
+        asset_dir,
+        output_dir,
+        app_config_dir,
+        filename,
+        description,
+        staging_mode='auto',
+        changed=None,
+        entries=None,
+        bundle_max_size=None):
     """
-    Builds a config for a dev environment.
+    Builds a config for a dev environment. Assets are staged into the app asset directories
+    with `staging`, so only assets which changed are staged again, and they are linked rather
+    than copied where possible. With `bundle_max_size`, small assets are also packed into a
+    bundle, which is rebuilt on every build. A config is also built for each locale, with the
+    variant of each asset for the locale, which are not staged.
+
+    To rebuild after only some assets changed, pass the assets which changed and the `entries`
+    from the previous build. Entries of the other assets are reused without examining them.
 
     :param asset_dir:
         Location of assets in filesystem
@@ -124,65 +251,123 @@ def build_dev_config(asset_dir, output_dir, app_config_dir, filename, descriptio
         Description of the update
     :type description:
         `dict`
+    :param staging_mode:
+        How to stage assets into the app asset directories, one of `staging.STAGING_MODES`
+    :type staging_mode:
+        `str`
+    :param changed:
+        Paths of assets relative to `asset_dir`, using `/`, which may have changed since the
+        last build, or None to rebuild every entry
+    :type changed:
+        `set`
+    :param entries:
+        Entries of each asset for the iOS and Android configs, by path relative to
+        `asset_dir`. Updated with the entries of this build.
+    :type entries:
+        `dict`
+    :param bundle_max_size:
+        Largest asset to bundle in bytes, or None to not bundle assets
+    :type bundle_max_size:
+        `int`
     """
-    # pylint:disable=R0914
+    # pylint:disable=R0912,R0913,R0914,R0915
     assets = get_all_assets(asset_dir)
     print('Retrieved {0} assets'.format(len(assets)))
 
     print('Creating output directory `{0}`'.format(output_dir))
-    os.makedirs(output_dir)
-    for platform in app_config_dir:
-        print('Creating app asset directory `{0}`'.format(app_config_dir[platform]))
-        if os.path.exists(app_config_dir[platform]):
-            shutil.rmtree(app_config_dir[platform])
-        os.makedirs(app_config_dir[platform])
-    config_ios = build_empty_config(desc_en=description['en'], desc_fr=description['fr'])
-    config_android = build_empty_config(desc_en=description['en'], desc_fr=description['fr'])
-
-    for dev_asset in assets:
-        asset_folder = dev_asset[0]
-        asset_name = dev_asset[1]
-        if asset_name[-3:] == '.gz':
+    os.makedirs(output_dir, exist_ok=True)
+    staged_files = {}
+    staged_changed = None if changed is None else set()
+    config_ios = release_configs.build_empty_config(
+        desc_en=description['en'],
+        desc_fr=description['fr']
+    )
+    config_android = release_configs.build_empty_config(
+        desc_en=description['en'],
+        desc_fr=description['fr']
+    )
+    if entries is None:
+        entries = {}
+
+    # Sizes of assets built by `minify` are recorded in its build manifest
+    build_manifest = build_cache.load_manifest(asset_dir)
+    build_files = build_manifest['files'] if build_manifest else {}
+
+    built_entries = {}
+    asset_names = set(asset_name for (_, asset_name) in assets)
+    for (asset_folder, asset_name) in assets:
+        if build_cache.is_compressed_output(asset_name) or \
+                release_assets.get_asset_type(asset_name) == 'binary':
             continue
 
-        asset_type = get_asset_type(dev_asset[1])
-        asset_zurl_exists = os.path.exists(os.path.join(asset_folder, '{}.gz'.format(asset_name)))
-
-        for platform in app_config_dir:
-            if not os.path.exists(os.path.join(app_config_dir[platform], asset_type)):
-                os.makedirs(os.path.join(app_config_dir[platform], asset_type))
-            shutil.copy(
-                os.path.join(asset_folder, asset_name),
-                os.path.join(app_config_dir[platform], asset_type, asset_name)
-            )
-
-        file_ios = {
-            'name': '/{}'.format(asset_name),
-            'size': os.path.getsize(os.path.join(asset_folder, asset_name)),
-            'type': asset_type,
-            'url': 'http://localhost:8080/{0}/{1}'.format(asset_type, asset_name),
-            'version': 1,
-        }
-        file_android = {
-            'name': '/{}'.format(asset_name),
-            'size': os.path.getsize(os.path.join(asset_folder, asset_name)),
-            'type': asset_type,
-            'url': 'http://10.0.2.2:8080/{0}/{1}'.format(asset_type, asset_name),
-            'version': 1,
-        }
-
-        if asset_zurl_exists:
-            file_ios['zurl'] = 'http://localhost:8080/{0}/{1}'.format(
-                asset_type,
-                '{}.gz'.format(asset_name)
+        relative_path = build_cache.get_relative_path(
+            os.path.join(asset_folder, asset_name),
+            asset_dir
+        )
+        staged_path = None
+        if not localize.is_locale_variant(asset_name, asset_names):
+            staged_path = '{0}/{1}'.format(release_assets.get_asset_type(asset_name), asset_name)
+            staged_files[staged_path] = os.path.join(asset_folder, asset_name)
+        if changed is None or relative_path in changed or relative_path not in entries:
+            built_entries[relative_path] = build_dev_file_entries(
+                asset_dir,
+                asset_folder,
+                asset_name,
+                build_files
             )
-            file_ios['zsize'] = os.path.getsize(os.path.join(asset_folder,
-                                                             '{}.gz'.format(asset_name)))
-
-        config_ios['files'].append(file_ios)
-        config_android['files'].append(file_android)
+            if staged_changed is not None and staged_path is not None:
+                staged_changed.add(staged_path)
+        else:
+            built_entries[relative_path] = entries[relative_path]
+
+        config_ios['files'].append(built_entries[relative_path][0])
+        config_android['files'].append(built_entries[relative_path][1])
+    entries.clear()
+    entries.update(built_entries)
+    config_ios['files'], locale_files_ios = localize.split_locale_files(config_ios['files'])
+    config_android['files'], locale_files_android = localize.split_locale_files(
+        config_android['files']
+    )
 
-    total_base_size, total_zipped_size, total_size = get_total_config_size(config_ios)
+    if bundle_max_size is not None:
+        bundle_index = bundle.write_bundle(
+            asset_dir,
+            bundle.select_members(build_files, bundle_max_size)
+        )
+        print('Bundled {0} assets into `{1}`'.format(
+            len(bundle_index),
+            bundle.get_bundle_path(asset_dir)
+        ))
+        bundle_ios, bundle_android = build_dev_file_entries(
+            asset_dir,
+            os.path.dirname(bundle.get_bundle_path(asset_dir)),
+            bundle.BUNDLE_NAME,
+            build_files
+        )
+        for (config, bundle_asset) in ((config_ios, bundle_ios), (config_android, bundle_android)):
+            config['bundles'] = [build_bundle_entry(
+                bundle_asset,
+                bundle_index,
+                {file['name']: file for file in config['files']}
+            )]
+
+    for platform in sorted(app_config_dir):
+        print('Staging assets in app asset directory `{0}`'.format(app_config_dir[platform]))
+        staged_counts = staging.stage_files(
+            staged_files,
+            app_config_dir[platform],
+            staging_mode,
+            staged_changed
+        )
+        print('Staged {0}'.format(', '.join(
+            '{0} {1}'.format(staged_counts[mode], mode)
+            for mode in sorted(staged_counts)
+            if staged_counts[mode] > 0
+        ) or 'no assets'))
+
+    total_base_size, total_zipped_size, total_size = release_configs.get_total_config_size(
+        config_ios
+    )
     print('Config total download size: {0}/{1} ({2})'.format(
         total_base_size / 1000,
         total_zipped_size / 1000,
@@ -210,271 +395,49 @@ def build_dev_config(asset_dir, output_dir, app_config_dir, filename, descriptio
         with open(os.path.join(app_config_dir['android'], 'base_config.json'), 'w') as config_file:
             json.dump(config_android, config_file, sort_keys=True, ensure_ascii=False, indent=2)
 
+    # Bundles are built from assets, not their variants, so they are not in locale configs
+    for locale in localize.LOCALES:
+        for (platform_filename, config, locale_files) in (
+                (filename_ios, config_ios, locale_files_ios),
+                (filename_android, config_android, locale_files_android)):
+            locale_config = dict(config, files=locale_files[locale])
+            locale_config.pop('bundles', None)
+            locale_filename = localize.get_locale_name(platform_filename, locale)
+            print('Dumping `{0}` config to `{1}{2}`'.format(locale, output_dir, locale_filename))
+            with open(os.path.join(output_dir, locale_filename), 'w') as config_file:
+                json.dump(locale_config, config_file, sort_keys=True, ensure_ascii=False, indent=2)
 
-def get_most_recent_config(bucket):
-    """
-    Given an S3 bucket, find the most recent config file version in that bucket and return its
-    version as an array of 3 integers. If no config files are found, returns [0, 0, 0].
 
-    :param bucket:
-        the S3 bucket to examine
-    :type bucket:
-        :class:S3.Bucket
-    :rtype:
-        `list` of `int`
-    """
-    objects = bucket.objects.all()
-    max_version = [0, 0, 0]
-    for item in objects:
-        if item.key[:7] != 'config/' or len(item.key) <= 7:
-            continue
-        item_version = list(map(int, item.key.split('/')[1].split('.')[:3]))
-        for i, _ in enumerate(item_version):
-            if item_version[i] > max_version[i]:
-                max_version = item_version
-                break
-    print('Found most recent config version: {0}'.format(max_version))
-    return max_version
-
-
-def get_release_config_version(bucket, version):
-    """
-    Gets a string for the config version to build.
-
-    :param bucket:
-        the s3 bucket to examine for the most recent config version, if necessary
-    :type bucket:
-        :class:S3.Bucket
-    :param version:
-        Either the major.minor.patch build number for the config, or
-        'major', 'minor', or 'patch' to update from the most recent config version
-    :type version:
-        `str`
-    """
-    if re.match(r'[0-9]+[.][0-9]+[.][0-9]+', version):
-        return version
-
-    last_version = get_most_recent_config(bucket)
-    if version == 'major':
-        last_version[0] = last_version[0] + 1
-        last_version[1] = 0
-        last_version[2] = 0
-    elif version == 'minor':
-        last_version[1] = last_version[1] + 1
-        last_version[2] = 0
-    elif version == 'patch':
-        last_version[2] = last_version[2] + 1
-    else:
-        raise ValueError('`version` must be one of "major", "minor", "patch", or match "X.Y.Z"')
-
-    last_version = [str(x) for x in last_version]
-    return '.'.join(last_version)
-
-
-def update_asset(
+def update_changed_assets(
         bucket,
-        name,
-        asset_type,
-        content,
-        version,
-        zcontent=None,
+        asset_dir,
+        output_dir,
+        only,
         compatible=False,
-        configs={},
-        upload_file=True):
-    """
-    Upload an asset to S3 bucket. Override existing versions, and update any config files
-    that contain the asset. Returns the URL to access the asset.
-
-    :param bucket:
-        S3 bucket to upload to
-    :type bucket:
-        :class:S3.Bucket
-    :param dir:
-        Directory containing asset
-    :type dir:
-        `str`
-    :param name:
-        Filename of the asset
-    :type name:
-        `str`
-    :param asset_type:
-        Type of the asset
-    :type asset_type:
-        `str`
-    :param content:
-        Content of the asset
-    :type content:
-        `str`
-    :param version:
-        Version number for asset
-    :type version:
-        `int`
-    :param zcontent:
-        Zipped content of the asset
-    :type zcontent:
-        `str`
-    :param compatible:
-        If True, then previous configs will be checked if they contain the file and their
-        versions updated
-    :type compatible:
-        `bool`
-    :param configs:
-        List of existing configs to check and update
-    :type:
-        `list` of `json`
-    :param upload_file:
-        True to upload the file, false to skip
-    :type upload_file:
-        `bool`
-    :rtype:
-        `str`
-    """
-    # pylint:disable=W0102,R0912,R0913,R0914
-    global S3      # pylint:disable=W0603
-    global REGION  # pylint:disable=W0603
-
-    content_type = 'application/json; charset=utf-8'
-    if asset_type == 'image':
-        if name[-3:] == 'png':
-            content_type = 'image/png'
-        elif name[-3:] == 'jpg':
-            content_type = 'image/jpeg'
-        elif name[-3:] == 'gif':
-            content_type = 'image/gif'
-    elif asset_type == 'text':
-        content_type = 'text/plain; charset=utf-8'
-
-    object_kwargs = {
-        'ACL': 'public-read',
-        'ContentType': content_type,
-        'Metadata': {
-            'version': str(version),
-        },
-    }
-
-    if upload_file:
-        print('Uploading asset `{0}`'.format('assets{0}'.format(name)))
-        bucket.put_object(Key='assets{0}'.format(name), Body=content, **object_kwargs)
-
-    base_object = S3.Object(bucket.name, 'assets{0}'.format(name)).get()
-    size = base_object['ContentLength']
-    version = int(base_object['Metadata']['version'])
-    url = 'https://s3.{0}.amazonaws.com/{1}/assets{2}?versionId={3}'.format(
-        REGION,
-        bucket.name,
-        name,
-        base_object['VersionId']
-    )
-
-    updated_asset = {
-        'size': size,
-        'url': url,
-        'version': version,
-    }
-
-    if zcontent:
-        if upload_file:
-            print('Uploading asset `{0}`'.format('assets{0}.gz'.format(name)))
-            bucket.put_object(
-                Key='assets{0}.gz'.format(name),
-                Body=zcontent,
-                ContentEncoding='gzip',
-                **object_kwargs
-            )
-        zipped_object = S3.Object(bucket.name, 'assets{0}.gz'.format(name)).get()
-        updated_asset['zsize'] = zipped_object['ContentLength']
-        updated_asset['zurl'] = 'https://s3.{}.amazonaws.com/{}/assets{}.gz?versionId={}'.format(
-            REGION,
-            bucket.name,
-            name,
-            zipped_object['VersionId']
-        )
-
-    if compatible:
-        for config in configs:
-            updated = False
-            for file in configs[config]['content']['files']:
-                if file['name'] != name or file['version'] != version - 1:
-                    continue
-                file['size'] = updated_asset['size']
-                file['url'] = updated_asset['url']
-                file['version'] = version
-                if 'zsize' in file:
-                    if 'zsize' in updated_asset:
-                        file['zsize'] = updated_asset['zsize']
-                        file['zurl'] = updated_asset['zurl']
-                    else:
-                        file.pop('zsize', None)
-                        file.pop('zurl', None)
-                updated = True
-            if updated:
-                configs[config]['updated'] = True
-                configs[config]['content']['lastUpdatedAt'] = int(time.time())
-    return updated_asset
-
-
-def parse_existing_config(item, existing_configs):
-    """
-    Parse the content of a config and add it to the existing configs.
-
-    :param item:
-        An object from S3
-    :type item:
-        :class:S3.Object
-    :param existing_configs:
-        The existing configs
-    :type existing_configs:
-        `dict`
-    """
-    item_key = item.key
-    existing_config = item.get()
-    existing_configs[item_key] = {
-        'content': json.loads(existing_config['Body'].read()),
-        'key': item_key,
-        'updated': False,
-    }
-    print('Parsed existing config `{0}`'.format(item_key))
-
-
-def parse_existing_asset(item, existing_assets):
-    """
-    Parse the content of an asset and add it to the existing assets.
-
-    :param item:
-        An object from S3
-    :type item:
-        :class:S3.Object
-    :param existing_assets:
-        The existing assets
-    :type existing_assets:
-        `dict`
-    """
-    item_key = item.key[6:]
-    if item_key[-3:] == '.gz':
-        item_key = item_key[:-3]
-        existing_assets[item_key]['zipped'] = True
-        return
-
-    existing_asset = item.get()
-    existing_assets[item_key] = {
-        'content': existing_asset['Body'].read(),
-        'version': existing_asset['Metadata']['version'],
-        'versionId': existing_asset['VersionId'],
-        'zipped': False,
-    }
-    print('Parsed existing asset `{0}`'.format(item_key))
-
-
-def update_changed_assets(bucket, asset_dir, output_dir, only, compatible=False):
+        concurrency=release_upload.DEFAULT_CONCURRENCY,
+        retries=release_upload.DEFAULT_RETRIES,
+        content_addressed=False,
+        deltas=False,
+        bundle_max_size=None,
+        binary=False):
     """
     Update assets which have changed from those versions already in the bucket. Also upload new
     assets not yet in the bucket. Returns a dict with updated assets and a dict of configs which
-    may or may not have been updated due to the new assets.
+    may or may not have been updated due to the new assets. Existing configs are only retrieved
+    when `compatible` is True.
+
+    Assets are uploaded to fixed keys and addressed by version ID, or, when `content_addressed`
+    is True, stored under the MD5 of their content with immutable cache headers. The version and
+    MD5 of each content-addressed asset are recorded in the asset index. With `deltas`, each
+    changed asset also gets a delta from its previous version, when the delta is smaller. With
+    `bundle_max_size`, small assets are also packed into a bundle, which is released like any
+    other asset. With `binary`, JSON assets are also encoded by `binary_json`, and each encoding
+    is released like any other asset, then listed in the entry of the asset it encodes.
 
     :param bucket:
-        An S3 bucket to retrieve existing assets and configs from
+        A bucket to retrieve existing assets and configs from
     :type bucket:
-        :class:S3.Bucket
+        :class:storage.Storage
     :param asset_dir:
         Asset directory
     :type asset_dir:
@@ -491,237 +454,393 @@ def update_changed_assets(bucket, asset_dir, output_dir, only, compatible=False)
         If True, update existing configs to accept the new version.
     :type compatible:
         `bool`
+    :param concurrency:
+        Maximum number of assets to compare and upload at once
+    :type concurrency:
+        `int`
+    :param retries:
+        Number of times to retry each failed request
+    :type retries:
+        `int`
+    :param content_addressed:
+        True to store assets by the MD5 of their content
+    :type content_addressed:
+        `bool`
+    :param deltas:
+        True to publish deltas from the previous version of each changed asset
+    :type deltas:
+        `bool`
+    :param bundle_max_size:
+        Largest asset to bundle in bytes, or None to not bundle assets
+    :type bundle_max_size:
+        `int`
+    :param binary:
+        True to publish the binary encoding of JSON assets, when it is smaller than the asset
+    :type binary:
+        `bool`
     :rtype:
         `dict`, `dict`
     """
-    # pylint:disable=R0914
-    # Minify assets
-    print('Cleaning output directory `{0}'.format(output_dir))
-    if os.path.exists(output_dir):
-        shutil.rmtree(output_dir)
-    print('Beginning minify subprocess, from `{0}` to `{1}`'.format(asset_dir, output_dir))
-    subprocess.run(['./script/minify.sh', asset_dir, output_dir])
-
-    # Get existing assets from bucket
-    bucket_objects = bucket.objects.all()
-    existing_assets = {}
+    # pylint:disable=R0912,R0913,R0914,R0915
+    # Minify assets, reusing unchanged assets from the last build into the output directory
+    print('Minifying assets, from `{0}` to `{1}`'.format(asset_dir, output_dir))
+    with instrumentation.phase('minify'):
+        build_files = minify.minify_assets(asset_dir, output_dir, binary=binary)
+
+    # Existing configs are only needed to apply compatible updates
     existing_configs = {}
-    for item in bucket_objects:
-        if item.key[:7] == 'config/' and len(item.key) > 7:
-            parse_existing_config(item, existing_configs)
-        elif item.key[:7] == 'assets/' and len(item.key) > 7:
-            parse_existing_asset(item, existing_assets)
+    config_index = {}
+    if compatible:
+        with instrumentation.phase('configs'):
+            existing_configs = release_configs.parse_existing_configs(bucket, concurrency, retries)
+            config_index = release_configs.index_config_files(existing_configs)
+
+    # Get existing assets from bucket, comparing by content hash rather than content. Assets at
+    # fixed keys are only needed by content-addressed releases to continue their versions, until
+    # the asset index exists.
+    asset_index = None
+    claimed_keys = set()
+    existing_assets = {}
+    with instrumentation.phase('listing'):
+        if content_addressed:
+            asset_index = release_objects.get_asset_index(bucket)
+            claimed_keys.update(
+                item.key
+                for item in bucket.list(release_objects.CONTENT_ADDRESSED_PREFIX)
+            )
+        if asset_index is None:
+            for item in bucket.list('assets/'):
+                if len(item.key) > 7:
+                    release_assets.parse_existing_asset(item, existing_assets)
 
     # Get local assets and filter for only those specified to be updated
     assets = get_all_assets(output_dir)
-    assets = [x for x in assets if only is None or '/{}'.format(x[1]) in only]
+    assets = [
+        x for x in assets
+        if only is None or '/{}'.format(release_assets.get_encoded_asset_name(x[1])) in only
+    ]
+    assets = [x for x in assets if not build_cache.is_compressed_output(x[1])]
     print('Retrieved {0} assets'.format(len(assets)))
 
-    changed_assets = {}
-    for existing_asset in assets:
-        asset_folder = existing_asset[0]
-        asset_name = existing_asset[1]
-        slash_asset_name = '/{}'.format(asset_name)
-        asset_type = get_asset_type(existing_asset[1])
-
-        if asset_name[-3:] == '.gz':
-            continue
-
-        last_version = 0
-        asset_content = None
-        asset_zcontent = None
-        upload_file = True
-        with open(os.path.join(asset_folder, asset_name), 'rb') as asset_file:
-            asset_content = asset_file.read()
-        if os.path.exists(os.path.join(asset_folder, '{}.gz'.format(asset_name))):
-            with open(os.path.join(asset_folder, '{}.gz'.format(asset_name)), 'rb') as asset_zfile:
-                asset_zcontent = asset_zfile.read()
-        if slash_asset_name in existing_assets:
-            if existing_assets[slash_asset_name]['content'] == asset_content:
-                upload_file = False
+    # The bundle is built from every asset, so it is not built when only some are updated
+    bundle_index = None
+    if bundle_max_size is not None and only is None:
+        with instrumentation.phase('bundle'):
+            bundle_index = bundle.write_bundle(
+                output_dir,
+                bundle.select_members(build_files, bundle_max_size)
+            )
+        print('Bundled {0} assets into `{1}`'.format(
+            len(bundle_index),
+            bundle.get_bundle_path(output_dir)
+        ))
+        assets.append((
+            os.path.dirname(bundle.get_bundle_path(output_dir)) + os.path.sep,
+            bundle.BUNDLE_NAME
+        ))
+
+    # Requests are made concurrently, but results are collected in asset order so the
+    # config is the same as a serial release
+    with instrumentation.phase('assets'), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = []
+        for (asset_folder, asset_name) in assets:
+            slash_asset_name = '/{}'.format(asset_name)
+            build_entry = build_files.get(build_cache.get_relative_path(
+                os.path.join(asset_folder, asset_name),
+                output_dir
+            ))
+            # Binary encodings are listed without the deltas of the asset they encode
+            asset_deltas = deltas and release_assets.get_asset_type(asset_name) != 'binary'
+            if content_addressed:
+                futures.append(executor.submit(
+                    release_objects.release_content_addressed_asset,
+                    bucket,
+                    asset_folder,
+                    asset_name,
+                    (asset_index or {}).get(slash_asset_name),
+                    existing_assets.get(slash_asset_name),
+                    claimed_keys,
+                    retries,
+                    build_entry,
+                    asset_deltas
+                ))
             else:
-                last_version = int(existing_assets[slash_asset_name]['version'])
-
-        asset_details = update_asset(
-            bucket,
-            slash_asset_name,
-            asset_type,
-            asset_content,
-            last_version + 1,
-            zcontent=asset_zcontent,
-            compatible=compatible,
-            configs=existing_configs,
-            upload_file=upload_file
+                futures.append(executor.submit(
+                    release_assets.release_asset,
+                    bucket,
+                    asset_folder,
+                    asset_name,
+                    existing_assets.get(slash_asset_name),
+                    retries,
+                    build_entry,
+                    asset_deltas
+                ))
+
+        changed_assets = {}
+        index_entries = {}
+        for future in futures:
+            if content_addressed:
+                built_asset, index_entries[built_asset['name']] = future.result()
+            else:
+                built_asset = future.result()
+            changed_assets[built_asset['name']] = built_asset
+
+    if bundle_index is not None:
+        bundle_name = '/{0}'.format(bundle.BUNDLE_NAME)
+        changed_assets[bundle_name] = build_bundle_entry(
+            changed_assets[bundle_name],
+            bundle_index,
+            changed_assets
         )
-        built_asset = {
-            'name': slash_asset_name,
-            'size': asset_details['size'],
-            'type': asset_type,
-            'url': asset_details['url'],
-            'version': asset_details['version'],
-        }
-
-        if 'zurl' in asset_details and 'zsize' in asset_details:
-            built_asset['zsize'] = asset_details['zsize']
-            built_asset['zurl'] = asset_details['zurl']
-
-        changed_assets[slash_asset_name] = built_asset
-
-    return changed_assets, existing_configs
-
-
-def build_release_config(assets, version, description):
-    """
-    Build a config for release.
-
-    :param bucket:
-        An S3 bucket to retrieve existing assets and configs from
-    :type bucket:
-        :class:S3.Bucket
-    :param assets:
-        Asset names and details for the config
-    :type assets:
-        `dict`
-    :param version:
-        Version for config
-    :type version:
-        `int`
-    :param description:
-        Description of the update
-    :type description:
-        `dict`
-    :rtype:
-        `str`, `dict`
-    """
-    config = build_empty_config(desc_en=description['en'], desc_fr=description['fr'])
-    for release_asset in assets:
-        config['files'].append(assets[release_asset])
-    config_key = 'config/{0}.json'.format(version)
-    config_details = {
-        'content': config,
-        'key': config_key,
-        'updated': True,
+    changed_assets = {
+        changed_asset['name']: changed_asset
+        for changed_asset in attach_binary_files(list(changed_assets.values()))
     }
-    print('Built config file `{0}`'.format(config_key))
-    total_base_size, total_zipped_size, total_size = get_total_config_size(config)
-    print('Config total download size: {0}/{1} ({2})'.format(
-        total_base_size / 1000,
-        total_zipped_size / 1000,
-        total_size / 1000
-    ))
-    return config_key, config_details
 
+    if content_addressed:
+        updated_index = dict(asset_index or {})
+        updated_index.update(index_entries)
+        if updated_index != asset_index:
+            release_objects.update_asset_index(bucket, updated_index)
 
-def update_changed_configs(bucket, configs):
-    """
-    Update only config files in `configs` which have the key 'updated' set to True.
+    if compatible:
+        with instrumentation.phase('compatible'):
+            release_configs.update_compatible_configs(
+                changed_assets,
+                existing_configs,
+                config_index
+            )
 
-    :param bucket:
-        S3 bucket which all configs exist in
-    :type bucket:
-        :class:S3.Bucket
-    :param configs:
-        Dictionary of config names and details
-    :type configs:
-        `dict`
-    """
-    for config in configs:
-        if not configs[config]['updated']:
-            continue
-        print('Uploading config `{0}`'.format(configs[config]['key']))
-        bucket.put_object(
-            Key=configs[config]['key'],
-            Body=json.dumps(configs[config]['content']),
-            ACL='public-read'
-        )
+    return changed_assets, existing_configs
 
 
 DESCRIPTION = {'en': '', 'fr': ''}
+REGION = storage.DEFAULT_REGION
+STORAGE_TYPE = 's3'
+
+
+if __name__ == '__main__':
+    # Input validation
+    if len(sys.argv) >= 2 and sys.argv[1] == '--dev':
+        DEV_ASSET_DIR = '../assets_dev/' if len(sys.argv) < 3 else sys.argv[2]
+        DEV_OUTPUT_DIR = '../assets_dev/config' if len(sys.argv) < 4 else sys.argv[3]
+        DEV_FILENAME = 'public.json' if len(sys.argv) < 5 else sys.argv[4]
+        DEV_APP_DIR = {}
+        if '--ios' in sys.argv:
+            DEV_APP_DIR['ios'] = sys.argv[sys.argv.index('--ios') + 1]
+        if '--android' in sys.argv:
+            DEV_APP_DIR['android'] = sys.argv[sys.argv.index('--android') + 1]
+        DEV_STAGING_MODE = 'auto'
+        if '--stage' in sys.argv:
+            DEV_STAGING_MODE = sys.argv[sys.argv.index('--stage') + 1]
+        DEV_BUNDLE_MAX_SIZE = None
+        if '--bundle' in sys.argv:
+            DEV_BUNDLE_MAX_SIZE = bundle.DEFAULT_MAX_MEMBER_SIZE
+        if '--bundle-max-size' in sys.argv:
+            DEV_BUNDLE_MAX_SIZE = int(sys.argv[sys.argv.index('--bundle-max-size') + 1])
+        if '--desc' in sys.argv:
+            DESC_IDX = sys.argv.index('--desc')
+            DESCRIPTION = {'en': sys.argv[DESC_IDX + 1], 'fr': sys.argv[DESC_IDX + 2]}
+        else:
+            DESCRIPTION = {'en': 'Test update.', 'fr': 'Mise à jour test.'}
+
+        if '--watch' in sys.argv:
+            import dev_watch  # pylint:disable=E0401
+            DEV_SCHEMA_DIR = '../assets_schemas/'
+            if '--schemas' in sys.argv:
+                DEV_SCHEMA_DIR = sys.argv[sys.argv.index('--schemas') + 1]
+            dev_watch.watch(
+                sys.argv[sys.argv.index('--watch') + 1],
+                DEV_ASSET_DIR,
+                DEV_SCHEMA_DIR,
+                {
+                    'app_config_dir': DEV_APP_DIR,
+                    'bundle_max_size': DEV_BUNDLE_MAX_SIZE,
+                    'description': DESCRIPTION,
+                    'filename': DEV_FILENAME,
+                    'output_dir': DEV_OUTPUT_DIR,
+                    'staging_mode': DEV_STAGING_MODE,
+                }
+            )
+            exit()
+
+        build_dev_config(
+            DEV_ASSET_DIR,
+            DEV_OUTPUT_DIR,
+            DEV_APP_DIR,
+            DEV_FILENAME,
+            DESCRIPTION,
+            staging_mode=DEV_STAGING_MODE,
+            bundle_max_size=DEV_BUNDLE_MAX_SIZE
+        )
+        exit()
+    elif len(sys.argv) < 5:
+        print('\n\tCampus Guide - Release Manager')
+        print('\tUsage:   release_manager.py', end='')
+        print(' <bucket_name> <asset_dir> <output_dir> <#.#.#|major|minor|patch> [options]')
+        print('\tAlt:     release_manager.py', end='')
+        print(' --dev <asset_dir> <config_dir> <config_name>', end='')
+        print(' [--ios <config_dir>]', end='')
+        print(' [--android <config_dir>]', end='')
+        print(' [--stage <{0}>]'.format('|'.join(staging.STAGING_MODES)), end='')
+        print(' [--bundle]', end='')
+        print(' [--watch <source_dir> [--schemas <schema_dir>]]')
+        print('\tExample: release_manager.py', end='')
+        print(' <bucket_name> assets/ assets_release/ patch [options]')
+        print('\tOptions:')
+        print('\t--dev\t\t\tBuild a config file for dev based on the given directory')
+        print('\t--watch <source_dir>\tWith --dev, minify assets from the source directory', end='')
+        print(' and rebuild when they change')
+        print('\t--no-new-config\t\tPush changed assets and only update configs which exist')
+        print('\t--only <name1,...>\tUpdate only assets with the given names. ', end='')
+        print('Otherwise, update all')
+        print('\t--region <region>\tAWS region')
+        print('\t--storage <type>\tStorage backend: {0} (default s3).'.format(
+            ', '.join(storage.STORAGE_TYPES)), end='')
+        print(' For local storage, <bucket_name> is a directory')
+        print('\t--compatible\t\tSpecify that assets changed are compatible with existing configs')
+        print('\t--desc <en> <fr>\tEnglish and French descriptions of the config changes')
+        print('\t--content-addressed\tStore assets by content hash, with immutable caching')
+        print('\t--deltas\t\tPublish deltas from the previous version of changed assets')
+        print('\t--bundle\t\tPack small assets into one bundle, for --dev or a release')
+        print('\t--bundle-max-size <bytes>\tLargest asset to bundle (default {0})'.format(
+            bundle.DEFAULT_MAX_MEMBER_SIZE))
+        print('\t--binary\t\tPublish a binary encoding of JSON assets, when it is smaller')
+        print('\t--concurrency <n>\tNumber of assets to upload at once (default {0})'.format(
+            release_upload.DEFAULT_CONCURRENCY))
+        print('\t--retries <n>\t\tNumber of times to retry a failed request (default {0})'.format(
+            release_upload.DEFAULT_RETRIES))
+        print('\t--multipart-threshold <bytes>\tUpload assets at least this large in parts', end='')
+        print(' (default {0})'.format(release_upload.MULTIPART_THRESHOLD))
+        print('\t--report <path>\t\tWrite timings, storage requests and memory use as JSON')
+        print('\t--profile <path>\tWrite cProfile stats, and add allocations to the report')
+        print()
+        exit()
+
+    # Parse arguments
+    BUCKET_NAME = sys.argv[1]
+    ASSET_DIR = sys.argv[2]
+    OUTPUT_DIR = sys.argv[3]
+    NEW_VERSION = sys.argv[4]
+    BUILD_CONFIG = True
+    ONLY_UPGRADE = None
+    COMPATIBLE = False
+    CONCURRENCY = release_upload.DEFAULT_CONCURRENCY
+    RETRIES = release_upload.DEFAULT_RETRIES
+    REPORT_PATH = None
+    PROFILE_PATH = None
+    CONTENT_ADDRESSED = False
+    DELTAS = False
+    BUNDLE_MAX_SIZE = None
+    BINARY = False
+
+    SKIP_ARGS = 0
+    if len(sys.argv) > 5:
+        for (index, arg) in enumerate(sys.argv[5:], start=5):
+            if SKIP_ARGS > 0:
+                SKIP_ARGS -= 1
+                continue
+
+            if arg == '--only':
+                SKIP_ARGS = 1
+                ONLY_UPGRADE = set(sys.argv[index + 1].split(','))
+            elif arg == '--region':
+                SKIP_ARGS = 1
+                REGION = sys.argv[index + 1]
+            elif arg == '--storage':
+                SKIP_ARGS = 1
+                STORAGE_TYPE = sys.argv[index + 1]
+            elif arg == '--no-new-config':
+                BUILD_CONFIG = False
+            elif arg == '--compatible':
+                COMPATIBLE = True
+            elif arg == '--content-addressed':
+                CONTENT_ADDRESSED = True
+            elif arg == '--deltas':
+                DELTAS = True
+            elif arg == '--bundle':
+                BUNDLE_MAX_SIZE = BUNDLE_MAX_SIZE or bundle.DEFAULT_MAX_MEMBER_SIZE
+            elif arg == '--bundle-max-size':
+                SKIP_ARGS = 1
+                BUNDLE_MAX_SIZE = int(sys.argv[index + 1])
+            elif arg == '--binary':
+                BINARY = True
+            elif arg == '--desc':
+                DESCRIPTION = {
+                    'en': sys.argv[index + 1],
+                    'fr': sys.argv[index + 2],
+                }
+                SKIP_ARGS = 2
+            elif arg == '--concurrency':
+                SKIP_ARGS = 1
+                CONCURRENCY = int(sys.argv[index + 1])
+            elif arg == '--retries':
+                SKIP_ARGS = 1
+                RETRIES = int(sys.argv[index + 1])
+            elif arg == '--multipart-threshold':
+                SKIP_ARGS = 1
+                release_upload.MULTIPART_THRESHOLD = int(sys.argv[index + 1])
+            elif arg == '--report':
+                SKIP_ARGS = 1
+                REPORT_PATH = sys.argv[index + 1]
+            elif arg == '--profile':
+                SKIP_ARGS = 1
+                PROFILE_PATH = sys.argv[index + 1]
+
+    BUCKET = storage.InstrumentedStorage(storage.open_storage(STORAGE_TYPE, BUCKET_NAME, REGION))
+    PROFILER = None
+    if PROFILE_PATH is not None:
+        PROFILER = instrumentation.Profiler()
+        PROFILER.start()
+    START_TIME = time.perf_counter()
+
+    UPDATED_ASSETS, UPDATED_CONFIGS = update_changed_assets(
+        BUCKET,
+        ASSET_DIR,
+        OUTPUT_DIR,
+        ONLY_UPGRADE,
+        compatible=COMPATIBLE,
+        concurrency=CONCURRENCY,
+        retries=RETRIES,
+        content_addressed=CONTENT_ADDRESSED,
+        deltas=DELTAS,
+        bundle_max_size=BUNDLE_MAX_SIZE,
+        binary=BINARY
+    )
 
-
-# Input validation
-if len(sys.argv) >= 2 and sys.argv[1] == '--dev':
-    DEV_ASSET_DIR = '../assets_dev/' if len(sys.argv) < 3 else sys.argv[2]
-    DEV_OUTPUT_DIR = '../assets_dev/config' if len(sys.argv) < 4 else sys.argv[3]
-    DEV_FILENAME = 'public.json' if len(sys.argv) < 5 else sys.argv[4]
-    DEV_APP_DIR = {}
-    if '--ios' in sys.argv:
-        DEV_APP_DIR['ios'] = sys.argv[sys.argv.index('--ios') + 1]
-    if '--android' in sys.argv:
-        DEV_APP_DIR['android'] = sys.argv[sys.argv.index('--android') + 1]
-    if '--desc' in sys.argv:
-        DESC_IDX = sys.argv.index('--desc')
-        DESCRIPTION = {'en': sys.argv[DESC_IDX + 1], 'fr': sys.argv[DESC_IDX + 2]}
-    else:
-        DESCRIPTION = {'en': 'Test update.', 'fr': 'Mise à jour test.'}
-
-    build_dev_config(DEV_ASSET_DIR, DEV_OUTPUT_DIR, DEV_APP_DIR, DEV_FILENAME, DESCRIPTION)
-    exit()
-elif len(sys.argv) < 5:
-    print('\n\tCampus Guide - Release Manager')
-    print('\tUsage:   release_manager.py', end='')
-    print(' <bucket_name> <asset_dir> <output_dir> <#.#.#|major|minor|patch> [options]')
-    print('\tAlt:     release_manager.py', end='')
-    print(' --dev <asset_dir> <config_dir> <config_name>', end='')
-    print(' [--ios <config_dir>]', end='')
-    print(' [--android <config_dir>]')
-    print('\tExample: release_manager.py', end='')
-    print(' <bucket_name> assets/ assets_release/ patch [options]')
-    print('\tOptions:')
-    print('\t--dev\t\t\tBuild a config file for dev based on the given directory')
-    print('\t--no-new-config\t\tPush changed assets and only update configs which exist')
-    print('\t--only <name1,...>\tUpdate only assets with the given names. Otherwise, update all')
-    print('\t--region <region>\tAWS region')
-    print('\t--compatible\t\tSpecify that assets changed are compatible with existing configs')
-    print('\t--desc <en> <fr>\tEnglish and French descriptions of the config changes')
-    print()
-    exit()
-
-# Parse arguments
-BUCKET_NAME = sys.argv[1]
-ASSET_DIR = sys.argv[2]
-OUTPUT_DIR = sys.argv[3]
-NEW_VERSION = sys.argv[4]
-BUILD_CONFIG = True
-REGION = 'ca-central-1'
-ONLY_UPGRADE = None
-COMPATIBLE = False
-
-SKIP_ARGS = 0
-if len(sys.argv) > 5:
-    for (index, arg) in enumerate(sys.argv[5:]):
-        if SKIP_ARGS > 0:
-            SKIP_ARGS -= 1
-            continue
-
-        if arg == '--only':
-            SKIP_ARGS = 1
-            ONLY_UPGRADE = set()
-            for asset in sys.argv[index + 1].split(','):
-                ONLY_UPGRADE.add(asset)
-        elif arg == '--region':
-            SKIP_ARGS = 1
-            REGION = sys.argv[index + 1]
-        elif arg == '--no-new-config':
-            BUILD_CONFIG = False
-        elif arg == '--compatible':
-            COMPATIBLE = True
-        elif arg == '--desc':
-            DESCRIPTION = {
-                'en': sys.argv[index + 1],
-                'fr': sys.argv[index + 2],
-            }
-            SKIP_ARGS = 2
-
-S3 = boto3.resource('s3')
-BUCKET = S3.Bucket(BUCKET_NAME)
-
-UPDATED_ASSETS, UPDATED_CONFIGS = update_changed_assets(
-    BUCKET, ASSET_DIR, OUTPUT_DIR, ONLY_UPGRADE, compatible=COMPATIBLE)
-
-if COMPATIBLE:
-    update_changed_configs(BUCKET, UPDATED_CONFIGS)
-if BUILD_CONFIG:
-    CONFIG_VERSION = get_release_config_version(BUCKET, NEW_VERSION)
-    CONFIG_KEY, CONFIG_DETAILS = build_release_config(UPDATED_ASSETS, CONFIG_VERSION, DESCRIPTION)
-    update_changed_configs(BUCKET, {CONFIG_KEY: CONFIG_DETAILS})
+    if COMPATIBLE:
+        release_configs.update_changed_configs(
+            BUCKET,
+            UPDATED_CONFIGS,
+            concurrency=CONCURRENCY,
+            retries=RETRIES
+        )
+    if BUILD_CONFIG:
+        CONFIG_VERSION = release_configs.get_release_config_version(BUCKET, NEW_VERSION)
+        RELEASE_CONFIGS = dict(
+            release_configs.build_release_config(
+                UPDATED_ASSETS,
+                CONFIG_VERSION,
+                DESCRIPTION,
+                locale=locale
+            )
+            for locale in (None,) + localize.LOCALES
+        )
+        release_configs.update_changed_configs(BUCKET, RELEASE_CONFIGS, retries=RETRIES)
+        release_configs.update_config_index(BUCKET, CONFIG_VERSION)
+
+    TOTAL_SECONDS = time.perf_counter() - START_TIME
+    if PROFILER is not None:
+        PROFILER.stop()
+        PROFILER.dump(PROFILE_PATH)
+        print('Wrote profile to `{0}`'.format(PROFILE_PATH))
+    if REPORT_PATH is not None:
+        with open(REPORT_PATH, 'w') as report_file:
+            json.dump(
+                instrumentation.build_report(TOTAL_SECONDS, BUCKET.get_stats(), PROFILER),
+                report_file,
+                sort_keys=True,
+                indent=2
+            )
+        print('Wrote report to `{0}`'.format(REPORT_PATH))
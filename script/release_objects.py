@@ -0,0 +1,333 @@
+"""
+Release content-addressed assets, which are stored by the MD5 of their content and uploaded with
+immutable caching. The version and MD5 of each asset by name are recorded in the asset index, so
+a release does not need to download assets to find which ones changed.
+"""
+
+import json
+import os
+import threading
+import time
+
+import build_cache  # pylint:disable=E0401
+import instrumentation  # pylint:disable=E0401
+import release_assets  # pylint:disable=E0401
+import release_upload  # pylint:disable=E0401
+import storage  # pylint:disable=E0401
+
+
+# Prefix of content-addressed assets, which are stored by the MD5 of their content, and the key
+# of the object recording the version and MD5 of each content-addressed asset by name
+CONTENT_ADDRESSED_PREFIX = 'objects/'
+ASSET_INDEX_KEY = 'index/assets.json'
+
+# Keys of content-addressed objects which exist or are being uploaded by this release
+CLAIMED_KEYS_LOCK = threading.Lock()
+
+
+def get_content_addressed_key(asset_name, content_md5, encoding=None):
+    """
+    Get the key of a content-addressed asset. The extension of the asset is kept so the object
+    is served with the right type, and assets with identical content share one object.
+
+    :param asset_name:
+        Filename of the asset
+    :type asset_name:
+        `str`
+    :param content_md5:
+        Hex MD5 digest of the content of the object
+    :type content_md5:
+        `str`
+    :param encoding:
+        Encoding of a compressed variant of the asset, or None for the asset
+    :type encoding:
+        `str`
+    :rtype:
+        `str`
+    """
+    return '{0}{1}{2}{3}'.format(
+        CONTENT_ADDRESSED_PREFIX,
+        content_md5,
+        os.path.splitext(asset_name)[1],
+        build_cache.COMPRESSED_EXTENSIONS[encoding] if encoding else ''
+    )
+
+
+def claim_object_key(key, claimed_keys):
+    """
+    Claim a content-addressed object to upload. Returns False if the object is already in the
+    bucket or another asset has claimed it, so identical content is only uploaded once.
+
+    :param key:
+        Key of the object
+    :type key:
+        `str`
+    :param claimed_keys:
+        Keys of objects in the bucket or already claimed. Updated with `key`.
+    :type claimed_keys:
+        `set`
+    :rtype:
+        `bool`
+    """
+    with CLAIMED_KEYS_LOCK:
+        if key in claimed_keys:
+            return False
+        claimed_keys.add(key)
+        return True
+
+
+def get_asset_index(bucket):
+    """
+    Get the version and MD5 of each content-addressed asset, by name. Returns None if the
+    bucket has no asset index yet.
+
+    :param bucket:
+        the bucket to examine
+    :type bucket:
+        :class:storage.Storage
+    :rtype:
+        `dict` or None
+    """
+    try:
+        index_content = bucket.get(ASSET_INDEX_KEY)
+    except storage.ObjectNotFoundError:
+        return None
+    return json.loads(index_content.decode('utf-8'))['assets']
+
+
+def update_asset_index(bucket, asset_index):
+    """
+    Replace the asset index.
+
+    :param bucket:
+        the bucket containing the asset index
+    :type bucket:
+        :class:storage.Storage
+    :param asset_index:
+        Version and MD5 of each content-addressed asset, by name
+    :type asset_index:
+        `dict`
+    """
+    print('Updating asset index `{0}`'.format(ASSET_INDEX_KEY))
+    bucket.put(
+        ASSET_INDEX_KEY,
+        json.dumps({'assets': asset_index, 'updatedAt': int(time.time())}, sort_keys=True),
+        content_type='application/json; charset=utf-8',
+        cache_control=release_upload.CONFIG_CACHE_CONTROL
+    )
+
+
+def put_content_addressed_object(bucket, key, path, upload, retries, **object_kwargs):
+    """
+    Upload a content-addressed object if it has been claimed for upload. Returns the size of
+    the object, which is the size of the local file since the content is the same.
+
+    :param bucket:
+        Bucket to upload to
+    :type bucket:
+        :class:storage.Storage
+    :param key:
+        Key of the object
+    :type key:
+        `str`
+    :param path:
+        Location of the file
+    :type path:
+        `str`
+    :param upload:
+        True to upload the object, false if it is already in the bucket
+    :type upload:
+        `bool`
+    :param retries:
+        Number of times to retry each failed request
+    :type retries:
+        `int`
+    :rtype:
+        `int`
+    """
+    if not upload:
+        return os.path.getsize(path)
+    return release_upload.upload_asset_file(
+        bucket,
+        key,
+        path,
+        retries,
+        public=True,
+        cache_control=release_upload.IMMUTABLE_CACHE_CONTROL,
+        **object_kwargs
+    )['size']
+
+
+def release_content_addressed_asset(
+        bucket,
+        asset_folder,
+        asset_name,
+        index_entry,
+        existing_asset,
+        claimed_keys,
+        retries=release_upload.DEFAULT_RETRIES,
+        build_entry=None,
+        deltas=False):
+    """
+    Release an asset under a key derived from its content, uploading it only if no object in
+    the bucket has the same content. The version of the asset only increases when its content
+    changes. Returns the details of the asset for a config, and its entry in the asset index.
+    Safe to call from worker threads.
+
+    :param bucket:
+        Bucket to upload to
+    :type bucket:
+        :class:storage.Storage
+    :param asset_folder:
+        Directory containing the asset
+    :type asset_folder:
+        `str`
+    :param asset_name:
+        Filename of the asset
+    :type asset_name:
+        `str`
+    :param index_entry:
+        The asset's entry in the asset index, or None
+    :type index_entry:
+        `dict`
+    :param existing_asset:
+        Details of the asset at its fixed key from `release_assets.parse_existing_asset`, to
+        continue its version when it is first content-addressed, or None
+    :type existing_asset:
+        `dict`
+    :param claimed_keys:
+        Keys of content-addressed objects in the bucket or claimed by other assets
+    :type claimed_keys:
+        `set`
+    :param retries:
+        Number of times to retry each failed request
+    :type retries:
+        `int`
+    :param build_entry:
+        The asset's entry in the build manifest, to avoid hashing it again, or None
+    :type build_entry:
+        `dict`
+    :param deltas:
+        True to publish a delta from the previous version of the asset, if it changed
+    :type deltas:
+        `bool`
+    :rtype:
+        `dict`, `dict`
+    """
+    # pylint:disable=R0913,R0914
+    slash_asset_name = '/{}'.format(asset_name)
+    asset_type = release_assets.get_asset_type(asset_name)
+    content_type = release_assets.get_content_type(asset_name, asset_type)
+    asset_path = os.path.join(asset_folder, asset_name)
+    (asset_zpath, asset_md5, asset_zmd5) = release_assets.get_asset_digests(
+        asset_path,
+        build_entry,
+        hash_gzipped=True
+    )
+
+    with instrumentation.phase('diff'):
+        if index_entry is not None:
+            version = index_entry['version']
+            unchanged = index_entry['md5'] == asset_md5
+        elif existing_asset is not None:
+            version = int(release_upload.call_with_retries(
+                retries,
+                release_assets.get_existing_asset_metadata,
+                bucket,
+                slash_asset_name
+            )['version'])
+            unchanged = release_upload.call_with_retries(
+                retries,
+                release_assets.is_existing_asset_unchanged,
+                bucket,
+                slash_asset_name,
+                asset_md5,
+                existing_asset
+            )
+        else:
+            version = 0
+            unchanged = False
+
+    previous_content = None
+    if not unchanged and version > 0 and deltas:
+        previous_content = release_assets.get_previous_content(
+            bucket,
+            get_content_addressed_key(asset_name, index_entry['md5'])
+            if index_entry is not None else 'assets{0}'.format(slash_asset_name),
+            asset_path,
+            retries
+        )
+    if not unchanged:
+        version += 1
+
+    key = get_content_addressed_key(asset_name, asset_md5)
+    upload = claim_object_key(key, claimed_keys)
+    with instrumentation.phase('upload' if upload else 'head'):
+        built_asset = {
+            'name': slash_asset_name,
+            'size': put_content_addressed_object(
+                bucket,
+                key,
+                asset_path,
+                upload,
+                retries,
+                metadata={'md5': asset_md5},
+                content_type=content_type
+            ),
+            'type': asset_type,
+            'url': bucket.url(key, None),
+            'version': version,
+        }
+
+    if asset_zpath:
+        zkey = get_content_addressed_key(asset_name, asset_zmd5, encoding='gzip')
+        zupload = claim_object_key(zkey, claimed_keys)
+        with instrumentation.phase('upload' if zupload else 'head'):
+            built_asset['zsize'] = put_content_addressed_object(
+                bucket,
+                zkey,
+                asset_zpath,
+                zupload,
+                retries,
+                metadata={'md5': asset_zmd5},
+                content_type=content_type,
+                content_encoding='gzip'
+            )
+        built_asset['zurl'] = bucket.url(zkey, None)
+
+    variants = release_assets.get_asset_variants(asset_path, build_entry)
+    for (encoding, variant_path, variant_md5) in variants:
+        variant_md5 = variant_md5 or build_cache.get_file_md5(variant_path)
+        variant_key = get_content_addressed_key(asset_name, variant_md5, encoding=encoding)
+        variant_upload = claim_object_key(variant_key, claimed_keys)
+        with instrumentation.phase('upload' if variant_upload else 'head'):
+            built_asset.setdefault('variants', []).append({
+                'encoding': encoding,
+                'size': put_content_addressed_object(
+                    bucket,
+                    variant_key,
+                    variant_path,
+                    variant_upload,
+                    retries,
+                    metadata={'md5': variant_md5},
+                    content_type=content_type,
+                    content_encoding=encoding
+                ),
+                'url': bucket.url(variant_key, None),
+            })
+
+    if previous_content is not None:
+        delta_entry = release_assets.release_asset_delta(
+            bucket,
+            asset_name,
+            previous_content,
+            asset_path,
+            version - 1,
+            built_asset,
+            retries,
+            content_addressed=True
+        )
+        if delta_entry is not None:
+            built_asset['deltas'] = [delta_entry]
+
+    return built_asset, {'md5': asset_md5, 'version': version}
@@ -0,0 +1,341 @@
+"""
+Upload assets to a storage bucket for releases. Failed requests are retried with backoff, and
+large assets are uploaded in parts from their files, so they are never held in memory.
+"""
+
+import concurrent.futures
+import hashlib
+import os
+import random
+import time
+
+import build_cache  # pylint:disable=E0401
+import storage  # pylint:disable=E0401
+
+
+# Default number of assets to upload at once
+DEFAULT_CONCURRENCY = 8
+
+# Default number of times to retry a failed request, and the base delay between attempts
+DEFAULT_RETRIES = 4
+RETRY_BACKOFF = 0.5
+
+# Assets at least this many bytes are uploaded in parts, with parts of at least
+# MULTIPART_PART_SIZE bytes. S3 allows at most MULTIPART_MAX_PARTS parts, of at least 5 MiB
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+MULTIPART_MAX_PARTS = 10000
+
+# Number of parts of each asset to upload at once. At most this many parts of each asset being
+# uploaded are held in memory.
+DEFAULT_PART_CONCURRENCY = 4
+
+# Cache-Control of content-addressed assets, which never change once uploaded, and of configs
+# and indexes, which are replaced by every release
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+CONFIG_CACHE_CONTROL = 'public, max-age=60, must-revalidate'
+
+
+def get_content_md5(content):
+    """
+    Get the hex MD5 digest of some content, as S3 reports it in the ETag of objects uploaded
+    in a single request.
+
+    :param content:
+        Content to hash
+    :type content:
+        `bytes`
+    :rtype:
+        `str`
+    """
+    return hashlib.md5(content).hexdigest()
+
+
+def call_with_retries(retries, func, *args, **kwargs):
+    """
+    Call a function which makes a request to storage, retrying with exponential backoff and jitter
+    if the request fails with an error which may succeed if it is retried. Returns the result of
+    the function.
+
+    :param retries:
+        Number of times to retry the request before raising the error
+    :type retries:
+        `int`
+    :param func:
+        Function to call
+    :type func:
+        `callable`
+    """
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except storage.RETRYABLE_ERRORS as error:
+            if attempt >= retries or not storage.is_retryable_error(error):
+                raise
+            delay = RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5)
+            print('Request failed ({0}), retrying in {1:.2f}s'.format(error, delay))
+            time.sleep(delay)
+            attempt += 1
+
+
+def read_file_part(path, offset, size):
+    """
+    Read part of a file.
+
+    :param path:
+        Location of the file
+    :type path:
+        `str`
+    :param offset:
+        Position of the part in the file
+    :type offset:
+        `int`
+    :param size:
+        Size of the part
+    :type size:
+        `int`
+    :rtype:
+        `bytes`
+    """
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        return file.read(size)
+
+
+def upload_file_part(bucket, key, upload_id, part_number, path, offset, size):
+    """
+    Read one part of a file and upload it as part of a multipart upload. Returns the ETag of
+    the part.
+
+    :param bucket:
+        Bucket to upload to
+    :type bucket:
+        :class:storage.Storage
+    :param key:
+        Key of the object
+    :type key:
+        `str`
+    :param upload_id:
+        ID of the multipart upload
+    :type upload_id:
+        `str`
+    :param part_number:
+        Position of the part in the object, from 1
+    :type part_number:
+        `int`
+    :param path:
+        Location of the file
+    :type path:
+        `str`
+    :param offset:
+        Position of the part in the file
+    :type offset:
+        `int`
+    :param size:
+        Size of the part
+    :type size:
+        `int`
+    :rtype:
+        `str`
+    """
+    # pylint:disable=R0913
+    return bucket.put_part(key, upload_id, part_number, read_file_part(path, offset, size))
+
+
+def upload_file_single(bucket, key, path, **object_kwargs):
+    """
+    Upload a file in one request, streaming it from disk.
+
+    :param bucket:
+        Bucket to upload to
+    :type bucket:
+        :class:storage.Storage
+    :param key:
+        Key of the object
+    :type key:
+        `str`
+    :param path:
+        Location of the file
+    :type path:
+        `str`
+    :rtype:
+        `dict`
+    """
+    with open(path, 'rb') as file:
+        return bucket.put(key, file, **object_kwargs)
+
+
+def upload_file_multipart(bucket, key, path, size, retries, **object_kwargs):
+    """
+    Upload a file in parts, uploading DEFAULT_PART_CONCURRENCY parts at once. Each part is read
+    from disk only when it is uploaded. The upload is aborted if any part fails.
+
+    :param bucket:
+        Bucket to upload to
+    :type bucket:
+        :class:storage.Storage
+    :param key:
+        Key of the object
+    :type key:
+        `str`
+    :param path:
+        Location of the file
+    :type path:
+        `str`
+    :param size:
+        Size of the file
+    :type size:
+        `int`
+    :param retries:
+        Number of times to retry each failed request
+    :type retries:
+        `int`
+    :rtype:
+        `dict`
+    """
+    part_size = max(MULTIPART_PART_SIZE, -(-size // MULTIPART_MAX_PARTS))
+    upload_id = call_with_retries(retries, bucket.start_multipart, key, **object_kwargs)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=DEFAULT_PART_CONCURRENCY) as executor:
+            futures = [
+                executor.submit(
+                    call_with_retries,
+                    retries,
+                    upload_file_part,
+                    bucket,
+                    key,
+                    upload_id,
+                    part_number,
+                    path,
+                    offset,
+                    min(part_size, size - offset)
+                )
+                for (part_number, offset) in enumerate(range(0, size, part_size), start=1)
+            ]
+            part_etags = [future.result() for future in futures]
+        return call_with_retries(retries, bucket.complete_multipart, key, upload_id, part_etags)
+    except BaseException:
+        bucket.abort_multipart(key, upload_id)
+        raise
+
+
+def upload_asset_file(bucket, key, path, retries, **object_kwargs):
+    """
+    Upload a file, streaming it from disk, and in parts if it has at least MULTIPART_THRESHOLD
+    bytes. Returns the 'etag', 'versionId' and 'size' of the new object.
+
+    :param bucket:
+        Bucket to upload to
+    :type bucket:
+        :class:storage.Storage
+    :param key:
+        Key of the object
+    :type key:
+        `str`
+    :param path:
+        Location of the file
+    :type path:
+        `str`
+    :param retries:
+        Number of times to retry each failed request
+    :type retries:
+        `int`
+    :rtype:
+        `dict`
+    """
+    size = os.path.getsize(path)
+    if size >= MULTIPART_THRESHOLD:
+        print('Uploading asset `{0}` in parts'.format(key))
+        response = upload_file_multipart(bucket, key, path, size, retries, **object_kwargs)
+    else:
+        print('Uploading asset `{0}`'.format(key))
+        response = call_with_retries(retries, upload_file_single, bucket, key, path,
+                                     **object_kwargs)
+    return dict(response, size=size)
+
+
+def put_or_head_asset_object(
+        bucket,
+        key,
+        path,
+        version,
+        upload_file,
+        retries,
+        content_md5=None,
+        content_type=None,
+        content_encoding=None):
+    """
+    Upload a file to the bucket, or retrieve the metadata of the existing object if it is not
+    being uploaded. Returns the size, version and storage version ID of the object. Files are
+    streamed from disk, and files of at least MULTIPART_THRESHOLD bytes are uploaded in parts,
+    so memory use does not grow with the size of the file. The details of an uploaded object
+    come from the local file and the response to the upload, so the object is never downloaded.
+
+    :param bucket:
+        Bucket to upload to
+    :type bucket:
+        :class:storage.Storage
+    :param key:
+        Key of the object
+    :type key:
+        `str`
+    :param path:
+        Location of the file to upload
+    :type path:
+        `str`
+    :param version:
+        Version number for the object
+    :type version:
+        `int`
+    :param upload_file:
+        True to upload the object, false to retrieve the existing object's metadata
+    :type upload_file:
+        `bool`
+    :param retries:
+        Number of times to retry each failed request
+    :type retries:
+        `int`
+    :param content_md5:
+        Hex MD5 digest of the file, if already known
+    :type content_md5:
+        `str`
+    :param content_type:
+        MIME type of the object
+    :type content_type:
+        `str`
+    :param content_encoding:
+        Encoding of the object, such as 'gzip'
+    :type content_encoding:
+        `str`
+    :rtype:
+        `dict`
+    """
+    # pylint:disable=R0913
+    if not upload_file:
+        head = call_with_retries(retries, bucket.head, key)
+        return {
+            'size': head['size'],
+            'version': int(head['metadata']['version']),
+            'versionId': head['versionId'],
+        }
+
+    response = upload_asset_file(
+        bucket,
+        key,
+        path,
+        retries,
+        metadata={
+            'md5': content_md5 or build_cache.get_file_md5(path),
+            'version': str(version),
+        },
+        content_type=content_type,
+        content_encoding=content_encoding,
+        public=True
+    )
+    return {
+        'size': response['size'],
+        'version': version,
+        'versionId': response['versionId'],
+    }
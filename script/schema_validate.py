@@ -4,38 +4,63 @@
 Validate configuration files using the provided schemas.
 """
 
+import concurrent.futures
+import hashlib
+import itertools
 import json
 import os
 import re
 import sys
+import time
 import jsonschema
 
+# Optional, only used to compile FAST_SCHEMAS with --fast
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None  # pylint:disable=C0103
+
 RE_LANGUAGE = re.compile(r'[.][a-z]+$')
-RE_COMMENT = re.compile(r'^\s*[/]{2}.*$', flags=re.MULTILINE)
+# Matches either a string, which is kept as is, or a comment to the end of its line
+RE_COMMENT = re.compile(r'("(?:[^"\\\n]|\\.)*")|[/]{2}[^\n]*')
+RE_WHITESPACE = re.compile(r'[ \t\n\r]*')
 
 VERBOSE = False
 SUCCESS_CODE = 0
 
-if '-v' in sys.argv:
-    VERBOSE = True
-    sys.argv.remove('-v')
+# Base schemas, by their ID
+STORE = {}
 
-if '--verbose' in sys.argv:
-    VERBOSE = True
-    sys.argv.remove('--verbose')
+# Compiled validators, by schema location
+VALIDATORS = {}
 
-if len(sys.argv) < 3:
-    print('Usage: ./schema_validate.py <asset_dir> <schema_dir>')
-    SUCCESS_CODE = 2
-    sys.exit(SUCCESS_CODE)
+# Hashes of schemas and the base schemas they reference, by schema location
+SCHEMA_HASHES = {}
 
-# Import base schemas
-STORE = {}
-BASE_SCHEMA_DIR = os.path.join(sys.argv[2], '__base__')
-for base_schema_name in os.listdir(BASE_SCHEMA_DIR):
-    with open(os.path.join(BASE_SCHEMA_DIR, base_schema_name)) as base_schema_raw:
-        base_schema = json.load(base_schema_raw)
-        STORE[base_schema['id']] = base_schema
+# Default location of the cache of valid files, format of the cache, and the number of seconds
+# an unused entry is kept in the cache
+DEFAULT_CACHE_PATH = '.schema_validate_cache.json'
+CACHE_FORMAT = 1
+CACHE_EXPIRY = 30 * 24 * 60 * 60
+
+# Schemas of large assets which are worth compiling to code with `fastjsonschema`
+FAST_SCHEMAS = ('shuttle.schema.json', 'transit.schema.json')
+
+
+def load_base_schemas(schema_dir):
+    """
+    Import the base schemas which other schemas reference into `STORE`.
+
+    :param schema_dir:
+        The base directory of schema files
+    :type schema_dir:
+        `str`
+    """
+    base_schema_dir = os.path.join(schema_dir, '__base__')
+    for base_schema_name in os.listdir(base_schema_dir):
+        with open(os.path.join(base_schema_dir, base_schema_name)) as base_schema_raw:
+            base_schema = json.load(base_schema_raw)
+            STORE[base_schema['id']] = base_schema
 
 
 def set_success_code(code):
@@ -53,7 +78,9 @@ def set_success_code(code):
 
 def strip_comments(str_in):
     """
-    Remove single line comments from a multiline string.
+    Remove single line comments from a multiline string in a single pass. Comment markers
+    inside of strings, such as in URLs, are ignored. Only the comments themselves are removed,
+    so every remaining character keeps its line and column.
 
     :param str_in:
         Input string
@@ -62,22 +89,82 @@ def strip_comments(str_in):
     :rtype:
         `str`
     """
-    comment = re.search(RE_COMMENT, str_in)
-    while comment:
-        str_in = str_in[:comment.span()[0]] + str_in[comment.span()[1] + 1:]
-        comment = re.search(RE_COMMENT, str_in)
-    return str_in
+    return RE_COMMENT.sub(lambda match: match.group(1) or '', str_in)
 
 
-def validate(config, schema_path, schema_name):
+def locate_json_path(str_in, path):
     """
-    Validate a single configuration file using the schema at the provided path,
-    with the provided name.
+    Find the position of the value at a path of keys and indices in a JSON string, skipping
+    over any values before it. Returns None if the path cannot be found.
 
-    :param config:
-        Location of the config file
-    :type config:
+    :param str_in:
+        JSON string, without comments
+    :type str_in:
         `str`
+    :param path:
+        Keys and indices leading to the value
+    :type path:
+        iterable of `str` or `int`
+    :rtype:
+        `int` or None
+    """
+    decoder = json.JSONDecoder()
+    position = RE_WHITESPACE.match(str_in, 0).end()
+    try:
+        for part in path:
+            if str_in[position] == '{':
+                position = RE_WHITESPACE.match(str_in, position + 1).end()
+                while str_in[position] == '"':
+                    key, position = json.decoder.scanstring(str_in, position + 1)
+                    position = RE_WHITESPACE.match(str_in, position).end() + 1
+                    position = RE_WHITESPACE.match(str_in, position).end()
+                    if key == part:
+                        break
+                    position = decoder.raw_decode(str_in, position)[1]
+                    position = RE_WHITESPACE.match(str_in, position).end() + 1
+                    position = RE_WHITESPACE.match(str_in, position).end()
+                else:
+                    return None
+            elif str_in[position] == '[' and isinstance(part, int):
+                position = RE_WHITESPACE.match(str_in, position + 1).end()
+                for _ in range(part):
+                    position = decoder.raw_decode(str_in, position)[1]
+                    position = RE_WHITESPACE.match(str_in, position).end() + 1
+                    position = RE_WHITESPACE.match(str_in, position).end()
+            else:
+                return None
+    except (IndexError, ValueError):
+        return None
+    return position
+
+
+def get_line_and_column(str_in, position):
+    """
+    Get the 1-based line and column of a position in a string.
+
+    :param str_in:
+        Input string
+    :type str_in:
+        `str`
+    :param position:
+        Index in the string
+    :type position:
+        `int`
+    :rtype:
+        `int`, `int`
+    """
+    line = str_in.count('\n', 0, position) + 1
+    column = position - str_in.rfind('\n', 0, position)
+    return line, column
+
+
+def load_schema_validator(schema_path, schema_name, fast=False):
+    """
+    Get a validator for the schema at the provided path, with the provided name. Validators are
+    compiled once per schema and cached for each following file. If `fast` is True and the schema
+    is one of FAST_SCHEMAS, a code-generated validator is also compiled when `fastjsonschema`
+    is available.
+
     :param schema_path:
         Location of the schema
     :type schema_path:
@@ -86,10 +173,18 @@ def validate(config, schema_path, schema_name):
         Name of the schema file
     :type schema_name:
         `str`
+    :param fast:
+        True to compile a code-generated validator for FAST_SCHEMAS
+    :type fast:
+        `bool`
+    :rtype:
+        :class:jsonschema.Draft4Validator, `callable` or None
     """
-    config_json = schema_json = None
-    with open(config) as file:
-        config_json = json.loads(strip_comments(file.read()))
+    cache_key = (os.path.join(schema_path, schema_name), fast)
+    if cache_key in VALIDATORS:
+        return VALIDATORS[cache_key]
+
+    schema_json = None
     with open(os.path.join(schema_path, schema_name)) as file:
         schema_json = json.loads(file.read())
 
@@ -98,20 +193,102 @@ def validate(config, schema_path, schema_name):
         schema_json,
         STORE,
     )
+    validator = jsonschema.Draft4Validator(schema_json, resolver=resolver)
+
+    fast_validator = None
+    if fast and fastjsonschema is not None and schema_name in FAST_SCHEMAS:
+        fast_validator = fastjsonschema.compile(
+            schema_json,
+            handlers={'http': STORE.__getitem__, 'https': STORE.__getitem__},
+        )
+
+    VALIDATORS[cache_key] = (validator, fast_validator)
+    return VALIDATORS[cache_key]
+
+
+def validate(config, schema_path, schema_name, fast=False):
+    """
+    Validate a single configuration file using the schema at the provided path,
+    with the provided name. Returns an error message if the file is invalid, or None.
+
+    :param config:
+        Location of the config file
+    :type config:
+        `str`
+    :param schema_path:
+        Location of the schema
+    :type schema_path:
+        `str`
+    :param schema_name:
+        Name of the schema file
+    :type schema_name:
+        `str`
+    :param fast:
+        True to use a code-generated validator for FAST_SCHEMAS, if available
+    :type fast:
+        `bool`
+    :rtype:
+        `str` or None
+    """
+    config_str = config_json = None
+    with open(config) as file:
+        config_str = strip_comments(file.read())
+    try:
+        config_json = json.loads(config_str)
+    except ValueError as error:
+        return 'Invalid JSON: {0}'.format(error)
+
+    validator, fast_validator = load_schema_validator(schema_path, schema_name, fast)
+    if fast_validator is not None:
+        try:
+            fast_validator(config_json)
+            return None
+        except fastjsonschema.JsonSchemaException:
+            # Fall through for a consistent error message
+            pass
 
     try:
-        jsonschema.Draft4Validator(schema_json, resolver=resolver).validate(config_json)
-        if VERBOSE:
-            print('  Success: {0}'.format(config))
+        validator.validate(config_json)
+        return None
     except jsonschema.ValidationError as error:
-        set_success_code(1)
-        print('  Failed: `{0}`'.format(config))
-        print('    {0}'.format(error.message))
+        position = locate_json_path(config_str, error.absolute_path)
+        if position is None:
+            return error.message
+        return 'line {0}, column {1}: {2}'.format(
+            *get_line_and_column(config_str, position),
+            error.message
+        )
 
 
-def validate_all(config_dir, schema_dir):
+def validate_task(task, schema_dir, fast=False):
     """
-    Validate all files in a directory.
+    Validate a single configuration file from `get_validation_tasks`. Runs in a worker process,
+    so the base schemas are loaded if the worker has not loaded them yet.
+
+    :param task:
+        Location of the config file, location of the schema and name of the schema file
+    :type task:
+        (`str`, `str`, `str`)
+    :param schema_dir:
+        The base directory of schema files
+    :type schema_dir:
+        `str`
+    :param fast:
+        True to use a code-generated validator for FAST_SCHEMAS, if available
+    :type fast:
+        `bool`
+    :rtype:
+        `str` or None
+    """
+    if not STORE:
+        load_base_schemas(schema_dir)
+    return validate(task[0], task[1], task[2], fast)
+
+
+def get_validation_tasks(config_dir, schema_dir, config_root=None, schema_root=None):
+    """
+    Find all files in a directory and its subdirectories to validate, and the schema each
+    should be validated with. Hidden files, such as the manifest of a build, are skipped.
 
     :param config_dir:
         The base directory of configuration files
@@ -121,14 +298,25 @@ def validate_all(config_dir, schema_dir):
         The base directory of schema files to validate with
     :type schema_dir:
         `str`
+    :param config_root:
+        The root directory of configuration files, when recursing into a subdirectory
+    :type config_root:
+        `str`
+    :param schema_root:
+        The root directory of schema files, when recursing into a subdirectory
+    :type schema_root:
+        `str`
+    :rtype:
+        `list` of (`str`, `str`, `str`)
     """
+    config_root = config_dir if config_root is None else config_root
+    schema_root = schema_dir if schema_root is None else schema_root
+    tasks = []
     directories = []
-    print('Beginning validation of `{0}`'.format(config_dir))
-
-    for file in os.listdir(config_dir):
+    for file in sorted(os.listdir(config_dir)):
         file_path = os.path.join(config_dir, file)
         if os.path.isfile(file_path):
-            if not file_path.endswith('.json'):
+            if not file_path.endswith('.json') or file.startswith('.'):
                 if VERBOSE:
                     print('  Skipping `{0}`'.format(file_path))
                 continue
@@ -136,8 +324,9 @@ def validate_all(config_dir, schema_dir):
             schema_path = schema_name = None
 
             # Use specific schema for app config files
-            if re.search(os.path.join(sys.argv[1], 'config'), file_path):
-                schema_path = os.path.join(sys.argv[2], 'config')
+            if os.path.normpath(config_dir) == os.path.normpath(os.path.join(config_root,
+                                                                             'config')):
+                schema_path = os.path.join(schema_root, 'config')
                 schema_name = 'config.schema.json'
             else:
                 # Strip filetype and language modifier
@@ -149,7 +338,7 @@ def validate_all(config_dir, schema_dir):
                                   schema_name[language_pos.span()[1] + 1:]
                 schema_name = '{0}.schema.json'.format(schema_name)
 
-            validate(file_path, schema_path, schema_name)
+            tasks.append((file_path, schema_path, schema_name))
         else:
             directories.append(file)
 
@@ -157,10 +346,308 @@ def validate_all(config_dir, schema_dir):
         d_path = os.path.join(config_dir, directory)
         sd_path = os.path.join(schema_dir, directory)
 
-        # Recursively push assets in directories
-        validate_all(d_path, sd_path)
+        # Recursively find assets in directories
+        tasks.extend(get_validation_tasks(d_path, sd_path, config_root, schema_root))
+    return tasks
+
+
+def get_schema_refs(schema, refs):
+    """
+    Find the IDs of all base schemas in `STORE` which a schema references, directly or through
+    other base schemas.
+
+    :param schema:
+        Schema, or part of a schema, to search
+    :type schema:
+        `dict`
+    :param refs:
+        IDs of base schemas found so far, which found IDs are added to
+    :type refs:
+        `set`
+    :rtype:
+        `set`
+    """
+    if isinstance(schema, dict):
+        for (key, value) in schema.items():
+            if key == '$ref' and isinstance(value, str):
+                ref_id = value.split('#')[0]
+                if ref_id in STORE and ref_id not in refs:
+                    refs.add(ref_id)
+                    get_schema_refs(STORE[ref_id], refs)
+            else:
+                get_schema_refs(value, refs)
+    elif isinstance(schema, list):
+        for item in schema:
+            get_schema_refs(item, refs)
+    return refs
+
+
+def get_schema_hash(schema_path, schema_name):
+    """
+    Get a hash of a schema, all of the base schemas it references, and the version of the
+    validator, which changes if any of them change.
+
+    :param schema_path:
+        Location of the schema
+    :type schema_path:
+        `str`
+    :param schema_name:
+        Name of the schema file
+    :type schema_name:
+        `str`
+    :rtype:
+        `str`
+    """
+    cache_key = os.path.join(schema_path, schema_name)
+    if cache_key in SCHEMA_HASHES:
+        return SCHEMA_HASHES[cache_key]
+
+    schema_json = None
+    with open(os.path.join(schema_path, schema_name)) as file:
+        schema_json = json.loads(file.read())
+
+    schema_hash = hashlib.sha256(jsonschema.__version__.encode('utf-8'))
+    schema_hash.update(json.dumps(schema_json, sort_keys=True).encode('utf-8'))
+    for ref_id in sorted(get_schema_refs(schema_json, set())):
+        schema_hash.update(ref_id.encode('utf-8'))
+        schema_hash.update(json.dumps(STORE[ref_id], sort_keys=True).encode('utf-8'))
+    SCHEMA_HASHES[cache_key] = schema_hash.hexdigest()
+    return SCHEMA_HASHES[cache_key]
+
+
+def get_validation_key(task):
+    """
+    Get the key of a validation task in the validation cache, from hashes of the file without
+    comments and of its schema.
+
+    :param task:
+        Location of the config file, location of the schema and name of the schema file
+    :type task:
+        (`str`, `str`, `str`)
+    :rtype:
+        `str`
+    """
+    with open(task[0]) as file:
+        config_hash = hashlib.sha256(strip_comments(file.read()).encode('utf-8')).hexdigest()
+    return '{0}:{1}'.format(config_hash, get_schema_hash(task[1], task[2]))
+
+
+def load_validation_cache(cache_path):
+    """
+    Load the validation cache, which records when each valid pair of file and schema was
+    last validated, by `get_validation_key`. Returns an empty cache if it cannot be read.
+
+    :param cache_path:
+        Location of the cache file
+    :type cache_path:
+        `str`
+    :rtype:
+        `dict`
+    """
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get('format') != CACHE_FORMAT:
+        return {}
+    return cache.get('valid', {})
+
+
+def save_validation_cache(cache_path, valid):
+    """
+    Write the validation cache, dropping entries which have not been used recently.
+
+    :param cache_path:
+        Location of the cache file
+    :type cache_path:
+        `str`
+    :param valid:
+        Time each valid pair of file and schema was last validated, by `get_validation_key`
+    :type valid:
+        `dict`
+    """
+    expiry = int(time.time()) - CACHE_EXPIRY
+    cache = {
+        'format': CACHE_FORMAT,
+        'valid': {key: valid[key] for key in valid if valid[key] >= expiry},
+    }
+    with open(cache_path, 'w') as cache_file:
+        json.dump(cache, cache_file, sort_keys=True, indent=2)
+
+
+def run_validation_tasks(tasks, schema_dir, processes=None, fast=False):
+    """
+    Validate files across a pool of processes, or in this process. Returns the error of each
+    file, or None if it is valid, in the same order as the tasks.
 
+    :param tasks:
+        Files to validate and their schemas, from `get_validation_tasks`
+    :type tasks:
+        `list` of (`str`, `str`, `str`)
+    :param schema_dir:
+        The base directory of schema files to validate with
+    :type schema_dir:
+        `str`
+    :param processes:
+        Number of worker processes, 1 to validate in this process, or None to use one per CPU
+    :type processes:
+        `int`
+    :param fast:
+        True to use a code-generated validator for FAST_SCHEMAS, if available
+    :type fast:
+        `bool`
+    :rtype:
+        `list` of `str` or None
+    """
+    if processes == 1:
+        return [validate_task(task, schema_dir, fast) for task in tasks]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(
+            validate_task,
+            tasks,
+            itertools.repeat(schema_dir),
+            itertools.repeat(fast),
+            chunksize=max(1, len(tasks) // (4 * (processes or os.cpu_count() or 1)))
+        ))
 
-validate_all(sys.argv[1], sys.argv[2])
 
-sys.exit(SUCCESS_CODE)
+def validate_all(
+        config_dir,
+        schema_dir,
+        processes=None,
+        fast=False,
+        cache_path=None,
+        force=False):
+    """
+    Validate all files in a directory, returning the number which failed. Files are validated
+    in parallel across a pool of processes, and the results are reported in a stable order. If a
+    cache is provided, files which were valid the last time they and their schema had the same
+    content are skipped.
+
+    :param config_dir:
+        The base directory of configuration files
+    :type config_dir:
+        `str`
+    :param schema_dir:
+        The base directory of schema files to validate with
+    :type schema_dir:
+        `str`
+    :param processes:
+        Number of worker processes, 1 to validate in this process, or None to use one per CPU
+    :type processes:
+        `int`
+    :param fast:
+        True to use a code-generated validator for FAST_SCHEMAS, if available
+    :type fast:
+        `bool`
+    :param cache_path:
+        Location of the validation cache, or None to validate every file without a cache
+    :type cache_path:
+        `str`
+    :param force:
+        True to validate every file, even if the cache says it is valid, and refresh the cache
+    :type force:
+        `bool`
+    :rtype:
+        `int`
+    """
+    # pylint:disable=R0913,R0914
+    print('Beginning validation of `{0}`'.format(config_dir))
+    if not STORE:
+        load_base_schemas(schema_dir)
+    tasks = get_validation_tasks(config_dir, schema_dir)
+
+    valid = {}
+    task_keys = [None] * len(tasks)
+    if cache_path is not None:
+        valid = load_validation_cache(cache_path)
+        task_keys = [get_validation_key(task) for task in tasks]
+
+    now = int(time.time())
+    pending = []
+    for (task, task_key) in zip(tasks, task_keys):
+        if task_key in valid and not force:
+            valid[task_key] = now
+            if VERBOSE:
+                print('  Cached: {0}'.format(task[0]))
+        else:
+            pending.append((task, task_key))
+    pending_tasks = [task for (task, _) in pending]
+
+    errors = run_validation_tasks(pending_tasks, schema_dir, processes, fast)
+
+    failures = 0
+    for ((task, task_key), error) in zip(pending, errors):
+        if error is None:
+            if task_key is not None:
+                valid[task_key] = now
+            if VERBOSE:
+                print('  Success: {0}'.format(task[0]))
+            continue
+        failures += 1
+        set_success_code(1)
+        print('  Failed: `{0}`'.format(task[0]))
+        print('    {0}'.format(error))
+
+    if cache_path is not None:
+        save_validation_cache(cache_path, valid)
+    print('Validated {0} files, {1} failed, {2} unchanged and skipped'.format(
+        len(pending),
+        failures,
+        len(tasks) - len(pending)
+    ))
+    return failures
+
+
+if __name__ == '__main__':
+    if '-v' in sys.argv:
+        VERBOSE = True
+        sys.argv.remove('-v')
+
+    if '--verbose' in sys.argv:
+        VERBOSE = True
+        sys.argv.remove('--verbose')
+
+    FAST = False
+    if '--fast' in sys.argv:
+        FAST = True
+        sys.argv.remove('--fast')
+
+    FORCE = False
+    if '--force' in sys.argv:
+        FORCE = True
+        sys.argv.remove('--force')
+
+    PROCESSES = None
+    if '-j' in sys.argv:
+        PROCESSES = int(sys.argv[sys.argv.index('-j') + 1])
+        sys.argv.pop(sys.argv.index('-j') + 1)
+        sys.argv.remove('-j')
+
+    CACHE_PATH = DEFAULT_CACHE_PATH
+    if '--cache' in sys.argv:
+        CACHE_PATH = sys.argv[sys.argv.index('--cache') + 1]
+        sys.argv.pop(sys.argv.index('--cache') + 1)
+        sys.argv.remove('--cache')
+    if '--no-cache' in sys.argv:
+        CACHE_PATH = None
+        sys.argv.remove('--no-cache')
+
+    if len(sys.argv) < 3:
+        print('Usage: ./schema_validate.py <asset_dir> <schema_dir> [-v] [-j <processes>]', end='')
+        print(' [--fast] [--force] [--cache <path>|--no-cache]')
+        SUCCESS_CODE = 2
+        sys.exit(SUCCESS_CODE)
+
+    load_base_schemas(sys.argv[2])
+    validate_all(
+        sys.argv[1],
+        sys.argv[2],
+        processes=PROCESSES,
+        fast=FAST,
+        cache_path=CACHE_PATH,
+        force=FORCE
+    )
+
+    sys.exit(SUCCESS_CODE)
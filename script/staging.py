@@ -0,0 +1,238 @@
+"""
+Stage assets into app bundle directories without copying them where the filesystem allows.
+
+Each asset is staged as one of:
+
+- `reflink`: a copy-on-write clone sharing the source's blocks (Linux, on btrfs or XFS)
+- `hardlink`: another name for the source file. Edits to the staged file change the source
+- `symlink`: a link to the source's absolute path
+- `copy`: a full copy, which always works
+
+The `auto` mode tries a reflink, then a hardlink, then falls back to a copy. Symlinks are only
+made when requested, because some app bundlers do not follow them.
+
+Staged files are recorded in `.staging.json` in the bundle directory, with the source they
+were staged from. An asset is only staged again when its source has changed size or
+modification time, its staged file is missing, or the requested mode has changed. Files staged
+by a previous run which are no longer staged are removed. Without a record, the bundle
+directory is cleaned first.
+"""
+
+import json
+import os
+import shutil
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Name of the record of staged files in a bundle directory
+STAGING_RECORD_NAME = '.staging.json'
+
+# Staging modes, and the modes tried in order by `auto`
+STAGING_MODES = ('auto', 'reflink', 'hardlink', 'symlink', 'copy')
+AUTO_MODES = ('reflink', 'hardlink', 'copy')
+
+# ioctl request to clone a file on Linux, from linux/fs.h
+FICLONE = 0x40049409
+
+
+def reflink_file(source, dest):
+    """
+    Create `dest` as a copy-on-write clone of `source`. Raises :class:OSError if the platform
+    or filesystem does not support it.
+
+    :param source:
+        Location of the file to clone
+    :type source:
+        `str`
+    :param dest:
+        Location of the clone
+    :type dest:
+        `str`
+    """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError('Reflinks are not supported on this platform')
+    with open(source, 'rb') as source_file, open(dest, 'wb') as dest_file:
+        try:
+            fcntl.ioctl(dest_file.fileno(), FICLONE, source_file.fileno())
+        except OSError:
+            dest_file.close()
+            os.remove(dest)
+            raise
+
+
+def stage_file(source, dest, mode):
+    """
+    Stage a file, replacing any existing staged file atomically.
+
+    :param source:
+        Location of the file to stage
+    :type source:
+        `str`
+    :param dest:
+        Location to stage the file
+    :type dest:
+        `str`
+    :param mode:
+        One of 'reflink', 'hardlink', 'symlink' or 'copy'
+    :type mode:
+        `str`
+    """
+    temp_dest = '{0}.staging'.format(dest)
+    if os.path.lexists(temp_dest):
+        os.remove(temp_dest)
+    if mode == 'reflink':
+        reflink_file(source, temp_dest)
+    elif mode == 'hardlink':
+        os.link(source, temp_dest)
+    elif mode == 'symlink':
+        os.symlink(os.path.abspath(source), temp_dest)
+    else:
+        shutil.copy(source, temp_dest)
+    os.replace(temp_dest, dest)
+
+
+def load_staging_record(stage_dir):
+    """
+    Load the record of files staged into a directory. Returns None if there is no usable
+    record.
+
+    :param stage_dir:
+        Directory files were staged into
+    :type stage_dir:
+        `str`
+    :rtype:
+        `dict` or None
+    """
+    try:
+        with open(os.path.join(stage_dir, STAGING_RECORD_NAME)) as record_file:
+            record = json.load(record_file)
+    except (OSError, ValueError):
+        return None
+    return record if isinstance(record, dict) else None
+
+
+def is_staged_file_current(entry, source, source_stat, dest, mode):
+    """
+    Check if a staged file can be kept.
+
+    :param entry:
+        The file's entry in the staging record, or None
+    :type entry:
+        `dict`
+    :param source:
+        Location of the file to stage
+    :type source:
+        `str`
+    :param source_stat:
+        Result of `os.stat` on the source
+    :type source_stat:
+        :class:os.stat_result
+    :param dest:
+        Location of the staged file
+    :type dest:
+        `str`
+    :param mode:
+        Requested staging mode
+    :type mode:
+        `str`
+    :rtype:
+        `bool`
+    """
+    if entry is None or not os.path.lexists(dest) or entry['source'] != os.path.abspath(source):
+        return False
+    if entry['mode'] != mode and (mode != 'auto' or entry['mode'] not in AUTO_MODES):
+        return False
+    return entry['size'] == source_stat.st_size and entry['mtime'] == source_stat.st_mtime_ns
+
+
+def stage_files(files, stage_dir, mode='auto', changed=None):
+    """
+    Stage files into a directory, only staging files again which have changed since they were
+    last staged. Returns the number of files staged with each mode, and the number kept.
+    When the files which changed are already known, `changed` skips checking the others.
+
+    :param files:
+        Location of each file to stage, by destination relative to `stage_dir`, using `/`
+    :type files:
+        `dict`
+    :param stage_dir:
+        Directory to stage files into
+    :type stage_dir:
+        `str`
+    :param mode:
+        One of STAGING_MODES
+    :type mode:
+        `str`
+    :param changed:
+        Destinations of files which may have changed since they were last staged, or None to
+        check every file
+    :type changed:
+        `set`
+    :rtype:
+        `dict`
+    """
+    if mode not in STAGING_MODES:
+        raise ValueError('Unknown staging mode `{0}`, expected one of {1}'.format(
+            mode,
+            ', '.join(STAGING_MODES)
+        ))
+
+    record = load_staging_record(stage_dir)
+    if record is None:
+        if os.path.exists(stage_dir):
+            print('No staging record, cleaning `{0}`'.format(stage_dir))
+            shutil.rmtree(stage_dir)
+        record = {}
+    os.makedirs(stage_dir, exist_ok=True)
+
+    # Modes which fail are not tried again for the rest of the files
+    modes = list(AUTO_MODES) if mode == 'auto' else [mode]
+    counts = {'kept': 0}
+    staged = {}
+    for relative_dest in sorted(files):
+        source = files[relative_dest]
+        entry = record.get(relative_dest)
+        if changed is not None and entry is not None and relative_dest not in changed:
+            staged[relative_dest] = entry
+            counts['kept'] += 1
+            continue
+
+        dest = os.path.join(stage_dir, *relative_dest.split('/'))
+        source_stat = os.stat(source)
+        if is_staged_file_current(entry, source, source_stat, dest, mode):
+            staged[relative_dest] = entry
+            counts['kept'] += 1
+            continue
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        while True:
+            try:
+                stage_file(source, dest, modes[0])
+                break
+            except OSError:
+                if len(modes) == 1:
+                    raise
+                print('Could not stage with {0}, falling back to {1}'.format(modes[0], modes[1]))
+                modes.pop(0)
+        counts[modes[0]] = counts.get(modes[0], 0) + 1
+        staged[relative_dest] = {
+            'mode': modes[0],
+            'mtime': source_stat.st_mtime_ns,
+            'size': source_stat.st_size,
+            'source': os.path.abspath(source),
+        }
+
+    for relative_dest in sorted(set(record) - set(staged)):
+        dest = os.path.join(stage_dir, *relative_dest.split('/'))
+        if os.path.lexists(dest):
+            print('Removing stale staged file `{0}`'.format(dest))
+            os.remove(dest)
+
+    with open(os.path.join(stage_dir, STAGING_RECORD_NAME), 'w') as record_file:
+        json.dump(staged, record_file, sort_keys=True, indent=2)
+    return counts
@@ -0,0 +1,919 @@
+"""
+Storage backends for releases. Each backend stores versioned objects by key, and provides the
+operations the release manager needs: listing objects by prefix, getting the metadata or content
+of an object, uploading an object, and building the URL of a version of an object.
+
+- `S3Storage` stores objects in an S3 bucket with versioning enabled
+- `LocalStorage` stores objects in a local directory, to rehearse releases offline
+- `MemoryStorage` stores objects in memory, with optional latency, for benchmarks
+
+`InstrumentedStorage` wraps any backend to count its requests and bytes transferred.
+
+Objects can be uploaded in one request from bytes or a file, or in parts with a multipart
+upload, so large objects never need to be held in memory.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    import boto3
+    import botocore.exceptions
+except ImportError:
+    boto3 = None
+
+
+# Storage backends which can be chosen from the command line
+STORAGE_TYPES = ('s3', 'local', 'memory')
+
+# Default AWS region of S3 buckets
+DEFAULT_REGION = 'ca-central-1'
+
+# Size of chunks to read when streaming the content of an object
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Summary of an object from a listing. The ETag is the MD5 of objects uploaded in one request.
+ObjectSummary = collections.namedtuple('ObjectSummary', ['key', 'etag', 'size'])
+
+
+class StorageError(Exception):
+    """
+    A request to a storage backend failed, and may succeed if it is retried.
+    """
+
+
+class ObjectNotFoundError(LookupError):
+    """
+    There is no object with the requested key.
+    """
+
+
+# Errors which a request to storage may fail with and succeed if it is retried. Responses from S3
+# are only retried if `is_retryable_error` accepts them.
+if boto3 is None:
+    RETRYABLE_ERRORS = (StorageError,)
+else:
+    RETRYABLE_ERRORS = (
+        StorageError,
+        botocore.exceptions.BotoCoreError,
+        botocore.exceptions.ClientError,
+    )
+
+# Error codes of S3 responses which are throttled or timed out, rather than refused
+RETRYABLE_ERROR_CODES = ('RequestTimeout', 'SlowDown', 'Throttling')
+
+
+def is_retryable_error(error):
+    """
+    Check if a request to storage which failed may succeed if it is retried. S3 responses are
+    only retried when they are throttled, timed out or a server error, so permanent errors such
+    as AccessDenied or NoSuchBucket fail at once.
+
+    :param error:
+        Error the request failed with
+    :type error:
+        `Exception`
+    :rtype:
+        `bool`
+    """
+    if not isinstance(error, RETRYABLE_ERRORS):
+        return False
+    if boto3 is not None and isinstance(error, botocore.exceptions.ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return error.response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES or \
+            status >= 500
+    return True
+
+
+def encode_body(body):
+    """
+    Get the content of an object as bytes. File objects are read to the end.
+
+    :param body:
+        Content of the object
+    :type body:
+        `bytes`, `str` or binary file object
+    :rtype:
+        `bytes`
+    """
+    if hasattr(body, 'read'):
+        return body.read()
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    return bytes(body)
+
+
+def iter_body(body, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Get the content of an object in chunks, so file objects are never read all at once.
+
+    :param body:
+        Content of the object
+    :type body:
+        `bytes`, `str` or binary file object
+    :param chunk_size:
+        Maximum size of each chunk
+    :type chunk_size:
+        `int`
+    :rtype:
+        iterator of `bytes`
+    """
+    if hasattr(body, 'read'):
+        return iter(lambda: body.read(chunk_size), b'')
+    return iter([encode_body(body)])
+
+
+def get_body_size(body):
+    """
+    Get the size in bytes of the content of an object. The position of file objects is
+    unchanged.
+
+    :param body:
+        Content of the object
+    :type body:
+        `bytes`, `str` or binary file object
+    :rtype:
+        `int`
+    """
+    if hasattr(body, 'read'):
+        position = body.tell()
+        size = body.seek(0, os.SEEK_END) - position
+        body.seek(position)
+        return size
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    return len(body)
+
+
+def get_multipart_etag(part_etags):
+    """
+    Get the ETag S3 gives an object uploaded in parts: the MD5 of the concatenated binary MD5s
+    of its parts, followed by the number of parts.
+
+    :param part_etags:
+        Hex MD5 digest of each part, in order
+    :type part_etags:
+        `list` of `str`
+    :rtype:
+        `str`
+    """
+    digests = b''.join(bytes.fromhex(etag) for etag in part_etags)
+    return '{0}-{1}'.format(hashlib.md5(digests).hexdigest(), len(part_etags))
+
+
+class Storage:
+    """
+    Interface of a storage backend. Implementations must be safe to use from multiple threads.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def list(self, prefix=''):
+        """
+        List the objects with keys starting with a prefix, in key order.
+
+        :param prefix:
+            Prefix of the keys
+        :type prefix:
+            `str`
+        :rtype:
+            `list` of :class:ObjectSummary
+        """
+        raise NotImplementedError()
+
+    def head(self, key):
+        """
+        Get the details of the current version of an object, without its content. Returns the
+        'size', 'etag', user 'metadata' and 'versionId' of the object. Raises
+        :class:ObjectNotFoundError if there is no object with the key.
+
+        :param key:
+            Key of the object
+        :type key:
+            `str`
+        :rtype:
+            `dict`
+        """
+        raise NotImplementedError()
+
+    def get(self, key):
+        """
+        Get the content of the current version of an object. Raises :class:ObjectNotFoundError
+        if there is no object with the key.
+
+        :param key:
+            Key of the object
+        :type key:
+            `str`
+        :rtype:
+            `bytes`
+        """
+        raise NotImplementedError()
+
+    def put(self, key, body, metadata=None, content_type=None, content_encoding=None,
+            public=False, cache_control=None):
+        """
+        Upload a new version of an object. Returns the 'etag' and 'versionId' of the new
+        version.
+
+        :param key:
+            Key of the object
+        :type key:
+            `str`
+        :param body:
+            Content of the object. File objects are read from their current position.
+        :type body:
+            `bytes`, `str` or binary file object
+        :param metadata:
+            User metadata of the object
+        :type metadata:
+            `dict`
+        :param content_type:
+            MIME type of the object
+        :type content_type:
+            `str`
+        :param content_encoding:
+            Encoding of the object, such as 'gzip'
+        :type content_encoding:
+            `str`
+        :param public:
+            True to allow anyone to read the object
+        :type public:
+            `bool`
+        :param cache_control:
+            Cache-Control header to serve the object with, or None for the default
+        :type cache_control:
+            `str`
+        :rtype:
+            `dict`
+        """
+        # pylint:disable=R0913
+        raise NotImplementedError()
+
+    def start_multipart(self, key, metadata=None, content_type=None, content_encoding=None,
+                        public=False, cache_control=None):
+        """
+        Begin uploading a new version of an object in parts. Returns the ID of the upload.
+        Parameters are the same as `put`.
+
+        :rtype:
+            `str`
+        """
+        # pylint:disable=R0913
+        raise NotImplementedError()
+
+    def put_part(self, key, upload_id, part_number, body):
+        """
+        Upload one part of a multipart upload. Returns the ETag of the part. Parts may be
+        uploaded concurrently and in any order.
+
+        :param key:
+            Key of the object
+        :type key:
+            `str`
+        :param upload_id:
+            ID of the upload, from `start_multipart`
+        :type upload_id:
+            `str`
+        :param part_number:
+            Position of the part in the object, from 1
+        :type part_number:
+            `int`
+        :param body:
+            Content of the part
+        :type body:
+            `bytes`
+        :rtype:
+            `str`
+        """
+        raise NotImplementedError()
+
+    def complete_multipart(self, key, upload_id, part_etags):
+        """
+        Finish a multipart upload, creating the new version of the object from its parts.
+        Returns the 'etag' and 'versionId' of the new version.
+
+        :param key:
+            Key of the object
+        :type key:
+            `str`
+        :param upload_id:
+            ID of the upload, from `start_multipart`
+        :type upload_id:
+            `str`
+        :param part_etags:
+            ETag of each part, in order of part number
+        :type part_etags:
+            `list` of `str`
+        :rtype:
+            `dict`
+        """
+        raise NotImplementedError()
+
+    def abort_multipart(self, key, upload_id):
+        """
+        Cancel a multipart upload, discarding any uploaded parts.
+
+        :param key:
+            Key of the object
+        :type key:
+            `str`
+        :param upload_id:
+            ID of the upload, from `start_multipart`
+        :type upload_id:
+            `str`
+        """
+        raise NotImplementedError()
+
+    def url(self, key, version_id):
+        """
+        Get the URL of a version of an object.
+
+        :param key:
+            Key of the object
+        :type key:
+            `str`
+        :param version_id:
+            ID of the version, or None for whichever version is current
+        :type version_id:
+            `str`
+        :rtype:
+            `str`
+        """
+        raise NotImplementedError()
+
+
+class S3Storage(Storage):
+    """
+    Stores objects in an S3 bucket. The bucket must have versioning enabled.
+    """
+
+    def __init__(self, name, region=DEFAULT_REGION):
+        if boto3 is None:
+            raise ImportError('boto3 is required to release to S3')
+        super(S3Storage, self).__init__(name)
+        self.region = region
+        self.client = boto3.client('s3', region_name=region)
+
+    @staticmethod
+    def _is_not_found(error):
+        return error.response.get('Error', {}).get('Code') in ('NoSuchKey', 'NotFound', '404')
+
+    def list(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        items = []
+        for page in paginator.paginate(Bucket=self.name, Prefix=prefix):
+            for item in page.get('Contents', []):
+                items.append(ObjectSummary(item['Key'], item['ETag'].strip('"'), item['Size']))
+        return items
+
+    def head(self, key):
+        try:
+            response = self.client.head_object(Bucket=self.name, Key=key)
+        except botocore.exceptions.ClientError as error:
+            if self._is_not_found(error):
+                raise ObjectNotFoundError(key) from error
+            raise
+        return {
+            'etag': response['ETag'].strip('"'),
+            'metadata': response['Metadata'],
+            'size': response['ContentLength'],
+            'versionId': response.get('VersionId'),
+        }
+
+    def get(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.name, Key=key)
+        except botocore.exceptions.ClientError as error:
+            if self._is_not_found(error):
+                raise ObjectNotFoundError(key) from error
+            raise
+        return response['Body'].read()
+
+    @staticmethod
+    def _get_object_kwargs(metadata, content_type, content_encoding, public, cache_control):
+        object_kwargs = {}
+        if metadata:
+            object_kwargs['Metadata'] = metadata
+        if content_type:
+            object_kwargs['ContentType'] = content_type
+        if content_encoding:
+            object_kwargs['ContentEncoding'] = content_encoding
+        if public:
+            object_kwargs['ACL'] = 'public-read'
+        if cache_control:
+            object_kwargs['CacheControl'] = cache_control
+        return object_kwargs
+
+    def put(self, key, body, metadata=None, content_type=None, content_encoding=None,
+            public=False, cache_control=None):
+        # pylint:disable=R0913
+        response = self.client.put_object(
+            Bucket=self.name,
+            Key=key,
+            Body=body,
+            **self._get_object_kwargs(
+                metadata,
+                content_type,
+                content_encoding,
+                public,
+                cache_control
+            )
+        )
+        return {
+            'etag': response['ETag'].strip('"'),
+            'versionId': response.get('VersionId'),
+        }
+
+    def start_multipart(self, key, metadata=None, content_type=None, content_encoding=None,
+                        public=False, cache_control=None):
+        # pylint:disable=R0913
+        return self.client.create_multipart_upload(
+            Bucket=self.name,
+            Key=key,
+            **self._get_object_kwargs(
+                metadata,
+                content_type,
+                content_encoding,
+                public,
+                cache_control
+            )
+        )['UploadId']
+
+    def put_part(self, key, upload_id, part_number, body):
+        return self.client.upload_part(
+            Bucket=self.name,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=body
+        )['ETag'].strip('"')
+
+    def complete_multipart(self, key, upload_id, part_etags):
+        response = self.client.complete_multipart_upload(
+            Bucket=self.name,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [
+                {'ETag': '"{0}"'.format(etag), 'PartNumber': part_number}
+                for (part_number, etag) in enumerate(part_etags, start=1)
+            ]}
+        )
+        return {
+            'etag': response['ETag'].strip('"'),
+            'versionId': response.get('VersionId'),
+        }
+
+    def abort_multipart(self, key, upload_id):
+        self.client.abort_multipart_upload(Bucket=self.name, Key=key, UploadId=upload_id)
+
+    def url(self, key, version_id):
+        url = 'https://s3.{0}.amazonaws.com/{1}/{2}'.format(self.region, self.name, key)
+        return url if version_id is None else '{0}?versionId={1}'.format(url, version_id)
+
+
+class LocalStorage(Storage):
+    """
+    Stores objects as files in a local directory. The details of each object are stored
+    alongside it in `.storage/<key>.json`, and each upload increments its version ID. Parts of
+    multipart uploads are kept in `.storage/.uploads/<upload ID>/` until they are completed.
+    """
+
+    # Directory of object details, inside the storage directory
+    DETAILS_DIR = '.storage'
+
+    # Directory of multipart uploads, inside DETAILS_DIR
+    UPLOADS_DIR = '.uploads'
+
+    def __init__(self, name, base_url=None):
+        super(LocalStorage, self).__init__(name)
+        self.base_url = base_url or pathlib.Path(os.path.abspath(name)).as_uri()
+        self._lock = threading.Lock()
+
+    def _get_path(self, key, details=False):
+        if details:
+            return os.path.join(self.name, self.DETAILS_DIR, *'{0}.json'.format(key).split('/'))
+        return os.path.join(self.name, *key.split('/'))
+
+    def _load_details(self, key):
+        try:
+            with open(self._get_path(key, details=True)) as details_file:
+                return json.load(details_file)
+        except (OSError, ValueError) as error:
+            raise ObjectNotFoundError(key) from error
+
+    def _get_upload_dir(self, upload_id):
+        return os.path.join(self.name, self.DETAILS_DIR, self.UPLOADS_DIR, upload_id)
+
+    @staticmethod
+    def _write_file(path, chunks):
+        """
+        Write a file atomically from chunks of content, so readers never see a partial file.
+        Returns the hex MD5 digest and size of the content.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        (handle, temp_path) = tempfile.mkstemp(dir=os.path.dirname(path))
+        md5 = hashlib.md5()
+        size = 0
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                for chunk in chunks:
+                    md5.update(chunk)
+                    size += len(chunk)
+                    temp_file.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return md5.hexdigest(), size
+
+    def _write_object(self, key, chunks, details, etag=None):
+        """
+        Write a new version of an object and its details. Returns the 'etag' and 'versionId'
+        of the new version.
+        """
+        os.makedirs(os.path.join(self.name, self.DETAILS_DIR), exist_ok=True)
+        (temp_handle, temp_path) = tempfile.mkstemp(dir=os.path.join(self.name, self.DETAILS_DIR))
+        os.close(temp_handle)
+        try:
+            (md5, size) = self._write_file(temp_path, chunks)
+            with self._lock:
+                try:
+                    version_id = str(int(self._load_details(key)['versionId']) + 1)
+                except ObjectNotFoundError:
+                    version_id = '1'
+                details = dict(details, etag=etag or md5, size=size, versionId=version_id)
+                os.makedirs(os.path.dirname(self._get_path(key)), exist_ok=True)
+                os.replace(temp_path, self._get_path(key))
+                self._write_file(
+                    self._get_path(key, details=True),
+                    [json.dumps(details, sort_keys=True, indent=2).encode('utf-8')]
+                )
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return {'etag': details['etag'], 'versionId': version_id}
+
+    def list(self, prefix=''):
+        items = []
+        for (directory, directories, filenames) in os.walk(self.name):
+            if os.path.abspath(directory) == os.path.abspath(self.name):
+                directories[:] = [x for x in directories if x != self.DETAILS_DIR]
+            for filename in filenames:
+                key = os.path.relpath(os.path.join(directory, filename), self.name).replace(
+                    os.path.sep,
+                    '/'
+                )
+                if not key.startswith(prefix):
+                    continue
+                try:
+                    details = self._load_details(key)
+                except ObjectNotFoundError:
+                    continue
+                items.append(ObjectSummary(key, details['etag'], details['size']))
+        items.sort()
+        return items
+
+    def head(self, key):
+        details = self._load_details(key)
+        return {
+            'etag': details['etag'],
+            'metadata': details['metadata'],
+            'size': details['size'],
+            'versionId': details['versionId'],
+        }
+
+    def get(self, key):
+        self._load_details(key)
+        with open(self._get_path(key), 'rb') as object_file:
+            return object_file.read()
+
+    def put(self, key, body, metadata=None, content_type=None, content_encoding=None,
+            public=False, cache_control=None):
+        # pylint:disable=R0913
+        return self._write_object(key, iter_body(body), {
+            'cacheControl': cache_control,
+            'contentEncoding': content_encoding,
+            'contentType': content_type,
+            'metadata': dict(metadata or {}),
+            'public': public,
+        })
+
+    def start_multipart(self, key, metadata=None, content_type=None, content_encoding=None,
+                        public=False, cache_control=None):
+        # pylint:disable=R0913
+        upload_id = uuid.uuid4().hex
+        self._write_file(
+            os.path.join(self._get_upload_dir(upload_id), 'upload.json'),
+            [json.dumps({
+                'cacheControl': cache_control,
+                'contentEncoding': content_encoding,
+                'contentType': content_type,
+                'key': key,
+                'metadata': dict(metadata or {}),
+                'public': public,
+            }).encode('utf-8')]
+        )
+        return upload_id
+
+    def put_part(self, key, upload_id, part_number, body):
+        return self._write_file(
+            os.path.join(self._get_upload_dir(upload_id), str(part_number)),
+            iter_body(body)
+        )[0]
+
+    def complete_multipart(self, key, upload_id, part_etags):
+        upload_dir = self._get_upload_dir(upload_id)
+        with open(os.path.join(upload_dir, 'upload.json')) as upload_file:
+            details = json.load(upload_file)
+        details.pop('key')
+
+        def iter_parts():
+            for part_number in range(1, len(part_etags) + 1):
+                with open(os.path.join(upload_dir, str(part_number)), 'rb') as part_file:
+                    yield from iter_body(part_file)
+
+        result = self._write_object(
+            key,
+            iter_parts(),
+            details,
+            etag=get_multipart_etag(part_etags)
+        )
+        shutil.rmtree(upload_dir)
+        return result
+
+    def abort_multipart(self, key, upload_id):
+        shutil.rmtree(self._get_upload_dir(upload_id), ignore_errors=True)
+
+    def url(self, key, version_id):
+        url = '{0}/{1}'.format(self.base_url.rstrip('/'), key)
+        return url if version_id is None else '{0}?versionId={1}'.format(url, version_id)
+
+
+class MemoryStorage(Storage):
+    """
+    Stores objects in memory, waiting `latency` seconds before each request to simulate a
+    remote store. Objects are lost when the process exits.
+    """
+
+    def __init__(self, name='memory', latency=0.0):
+        super(MemoryStorage, self).__init__(name)
+        self.latency = latency
+        self._objects = {}
+        self._uploads = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get_object(self, key):
+        try:
+            return self._objects[key]
+        except KeyError as error:
+            raise ObjectNotFoundError(key) from error
+
+    def list(self, prefix=''):
+        self._wait()
+        with self._lock:
+            return [
+                ObjectSummary(key, self._objects[key]['etag'], len(self._objects[key]['body']))
+                for key in sorted(self._objects)
+                if key.startswith(prefix)
+            ]
+
+    def head(self, key):
+        self._wait()
+        with self._lock:
+            stored = self._get_object(key)
+            return {
+                'etag': stored['etag'],
+                'metadata': dict(stored['metadata']),
+                'size': len(stored['body']),
+                'versionId': stored['versionId'],
+            }
+
+    def get(self, key):
+        self._wait()
+        with self._lock:
+            return self._get_object(key)['body']
+
+    def _store(self, key, body, details, etag=None):
+        with self._lock:
+            self._version += 1
+            self._objects[key] = dict(
+                details,
+                body=body,
+                etag=etag or hashlib.md5(body).hexdigest(),
+                versionId=str(self._version)
+            )
+            return {'etag': self._objects[key]['etag'], 'versionId': str(self._version)}
+
+    def put(self, key, body, metadata=None, content_type=None, content_encoding=None,
+            public=False, cache_control=None):
+        # pylint:disable=R0913
+        self._wait()
+        return self._store(key, encode_body(body), {
+            'cacheControl': cache_control,
+            'contentEncoding': content_encoding,
+            'contentType': content_type,
+            'metadata': dict(metadata or {}),
+        })
+
+    def start_multipart(self, key, metadata=None, content_type=None, content_encoding=None,
+                        public=False, cache_control=None):
+        # pylint:disable=R0913
+        self._wait()
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {
+                'details': {
+                    'cacheControl': cache_control,
+                    'contentEncoding': content_encoding,
+                    'contentType': content_type,
+                    'metadata': dict(metadata or {}),
+                },
+                'parts': {},
+            }
+        return upload_id
+
+    def put_part(self, key, upload_id, part_number, body):
+        self._wait()
+        body = encode_body(body)
+        with self._lock:
+            self._uploads[upload_id]['parts'][part_number] = body
+        return hashlib.md5(body).hexdigest()
+
+    def complete_multipart(self, key, upload_id, part_etags):
+        self._wait()
+        with self._lock:
+            upload = self._uploads.pop(upload_id)
+        body = b''.join(upload['parts'][number] for number in range(1, len(part_etags) + 1))
+        return self._store(key, body, upload['details'], etag=get_multipart_etag(part_etags))
+
+    def abort_multipart(self, key, upload_id):
+        self._wait()
+        with self._lock:
+            self._uploads.pop(upload_id, None)
+
+    def url(self, key, version_id):
+        url = 'memory://{0}/{1}'.format(self.name, key)
+        return url if version_id is None else '{0}?versionId={1}'.format(url, version_id)
+
+
+class InstrumentedStorage(Storage):
+    """
+    Wraps a storage backend, recording the number of requests, bytes sent and received, and
+    seconds spent waiting for each operation.
+    """
+
+    def __init__(self, backend):
+        super(InstrumentedStorage, self).__init__(backend.name)
+        self.backend = backend
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def _call(self, operation, func, *args, bytes_sent=0):
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                operation_stats = self.stats.setdefault(operation, {
+                    'bytesReceived': 0,
+                    'bytesSent': 0,
+                    'requests': 0,
+                    'seconds': 0.0,
+                })
+                operation_stats['requests'] += 1
+                operation_stats['bytesSent'] += bytes_sent
+                operation_stats['seconds'] += elapsed
+        if operation == 'get':
+            with self._lock:
+                self.stats[operation]['bytesReceived'] += len(result)
+        return result
+
+    def get_stats(self):
+        """
+        Get a copy of the recorded stats, by operation.
+
+        :rtype:
+            `dict`
+        """
+        with self._lock:
+            return {operation: dict(stats) for (operation, stats) in self.stats.items()}
+
+    def reset(self):
+        """
+        Clear the recorded stats.
+        """
+        with self._lock:
+            self.stats = {}
+
+    def list(self, prefix=''):
+        return self._call('list', self.backend.list, prefix)
+
+    def head(self, key):
+        return self._call('head', self.backend.head, key)
+
+    def get(self, key):
+        return self._call('get', self.backend.get, key)
+
+    def put(self, key, body, metadata=None, content_type=None, content_encoding=None,
+            public=False, cache_control=None):
+        # pylint:disable=R0913
+        return self._call(
+            'put',
+            self.backend.put,
+            key,
+            body,
+            metadata,
+            content_type,
+            content_encoding,
+            public,
+            cache_control,
+            bytes_sent=get_body_size(body)
+        )
+
+    def start_multipart(self, key, metadata=None, content_type=None, content_encoding=None,
+                        public=False, cache_control=None):
+        # pylint:disable=R0913
+        return self._call(
+            'start_multipart',
+            self.backend.start_multipart,
+            key,
+            metadata,
+            content_type,
+            content_encoding,
+            public,
+            cache_control
+        )
+
+    def put_part(self, key, upload_id, part_number, body):
+        return self._call(
+            'put_part',
+            self.backend.put_part,
+            key,
+            upload_id,
+            part_number,
+            body,
+            bytes_sent=get_body_size(body)
+        )
+
+    def complete_multipart(self, key, upload_id, part_etags):
+        return self._call(
+            'complete_multipart',
+            self.backend.complete_multipart,
+            key,
+            upload_id,
+            part_etags
+        )
+
+    def abort_multipart(self, key, upload_id):
+        return self._call('abort_multipart', self.backend.abort_multipart, key, upload_id)
+
+    def url(self, key, version_id):
+        return self.backend.url(key, version_id)
+
+
+def open_storage(storage_type, name, region=DEFAULT_REGION):
+    """
+    Open a storage backend.
+
+    :param storage_type:
+        One of STORAGE_TYPES
+    :type storage_type:
+        `str`
+    :param name:
+        Name of the S3 bucket, or the directory of local storage
+    :type name:
+        `str`
+    :param region:
+        AWS region of the S3 bucket
+    :type region:
+        `str`
+    :rtype:
+        :class:Storage
+    """
+    if storage_type == 's3':
+        return S3Storage(name, region)
+    elif storage_type == 'local':
+        return LocalStorage(name)
+    elif storage_type == 'memory':
+        return MemoryStorage(name)
+    raise ValueError('Unknown storage type `{0}`, expected one of {1}'.format(
+        storage_type,
+        ', '.join(STORAGE_TYPES)
+    ))